@@ -9,9 +9,7 @@ University of Toronto Mississauga
 This module contains the Actor class and all its subclasses that represent
 different types of elements in the game.
 """
-from typing import Tuple, Optional
-
-import pygame
+from typing import Any, Dict, Tuple, Optional
 
 from settings import *
 
@@ -26,8 +24,11 @@ class Actor:
         x coordinate of this actor's location on the stage
     y:
         y coordinate of this actor's location on the stage
-    image:
-        the image of the actor
+    sprite:
+        the path of the sprite of the actor, or None for a blank tile; shared
+        by the class unless its actors change sprite
+    flip_x:
+        whether the sprite is drawn mirrored horizontally
 
     === Private Attributes ===
     _is_stop:
@@ -41,14 +42,28 @@ class Actor:
     y: int
     _is_stop: bool
     _is_push: bool
-    image: pygame.Surface
+    sprite: Optional[str]
+    flip_x: bool
+
+    __slots__ = ("x", "y", "_is_stop", "_is_push")
+    sprite = None
+    flip_x = False
 
     def __init__(self, x: int, y: int) -> None:
 
         self.x, self.y = x, y
         self._is_stop = False
         self._is_push = False
-        self.image = pygame.Surface((TILESIZE, TILESIZE))
+
+    @property
+    def image(self) -> Any:
+        """
+        The image of the actor, loaded from its sprite
+        """
+        import sprites
+        if self.sprite is None:
+            return sprites.blank_image()
+        return sprites.load_image(self.sprite, flip_x=self.flip_x)
 
     def is_stop(self) -> bool:
         """
@@ -62,12 +77,35 @@ class Actor:
         """
         return self._is_push
 
+    def get_flags(self) -> Tuple[bool, ...]:
+        """
+        Return the boolean flags of this actor as a tuple
+        """
+        return self._is_stop, self._is_push
+
+    def set_flags(self, flags: Tuple[bool, ...]) -> None:
+        """
+        Set the boolean flags of this actor from a tuple returned by get_flags
+        """
+        self._is_stop, self._is_push = flags
+
     def copy(self) -> 'Actor':
         """
         Creates an identical copy of self and returns the new copy
-        To be implemented in the subclasses
+
+        The fields of self are copied into a new actor of the same class
+        without calling its constructor, so copying never loads a sprite.
         """
-        raise NotImplementedError
+        cls = type(self)
+        fields = _FIELDS.get(cls)
+        if fields is None:
+            fields = _FIELDS[cls] = tuple(
+                name for klass in cls.__mro__
+                for name in vars(klass).get("__slots__", ()))
+        other = object.__new__(cls)
+        for name in fields:
+            setattr(other, name, getattr(self, name))
+        return other
 
     def move(self, game_: 'Game', dx: int, dy: int) -> bool:
         """
@@ -92,34 +130,31 @@ class Actor:
           in which case this method should return False
         - Recall how push works: you may push and move a line of multiple
           objects as long as the move is not blocked by something.
-        """
 
+        The line is found by looking ahead once, one cell at a time, at the
+        first actor of each cell: it ends at an empty cell or an actor that
+        is neither stop nor push (the line moves), or at the edge of the
+        screen or an actor that is stop and not push (nothing moves). Only
+        then are all the actors of the line moved, with Game.move_actors.
+
+        Returns False only if the first cell is off the screen or holds an
+        actor that is stop and not push, so a push into a line of objects
+        that is blocked also returns True, even though nothing moves.
+        """
         width = game_.width / TILESIZE
         height = game_.height / TILESIZE
-        while (0 <= self.x + dx < width) and (0 <= self.y + dy < height):
-            new_x = self.x + dx
-            new_y = self.y + dy
-            actor = game_.get_actor(new_x, new_y)
-            if actor is None:
-                self.x += dx
-                self.y += dy
+        line = [self]
+        x, y = self.x + dx, self.y + dy
+        while (0 <= x < width) and (0 <= y < height):
+            actor = game_.get_actor(x, y)
+            if actor is None or not (actor.is_stop() or actor.is_push()):
+                game_.move_actors(line, dx, dy)
                 return True
-            if actor.is_stop() and not actor.is_push():
-                return False
-            if actor.is_push():
-                self.x += dx
-                self.y += dy
-                actor.move(game_, dx, dy)
-                if actor.is_stop:
-                    if self.x == actor.x and self.y == actor.y:
-                        self.x -= dx
-                        self.y -= dy
-                return True
-            if not (actor.is_stop() and actor.is_push()):
-                self.x += dx
-                self.y += dy
-                return True
-        return False
+            if not actor.is_push():
+                break
+            line.append(actor)
+            x, y = x + dx, y + dy
+        return len(line) > 1
 
 
 class Character(Actor):
@@ -142,6 +177,8 @@ class Character(Actor):
     _is_lose: bool
     _is_win: bool
 
+    __slots__ = ("_is_player", "_is_lose", "_is_win")
+
     def __init__(self, x: int, y: int) -> None:
         """
         Initializes the Character
@@ -249,18 +286,27 @@ class Character(Actor):
         other._is_lose = self._is_lose
         other._is_win = self._is_win
 
-    def copy(self) -> 'Character':
+    def get_flags(self) -> Tuple[bool, ...]:
         """
-        Returns a copy of this object itself.
-        Need to be implemented in the subclasses
+        Return the boolean flags of this character as a tuple
         """
-        raise NotImplementedError
+        return (self._is_stop, self._is_push, self._is_player,
+                self._is_lose, self._is_win)
+
+    def set_flags(self, flags: Tuple[bool, ...]) -> None:
+        """
+        Set the boolean flags of this character from a tuple returned by
+        get_flags
+        """
+        (self._is_stop, self._is_push, self._is_player,
+         self._is_lose, self._is_win) = flags
 
     def handle_key_press(self, game_: 'Game') -> Tuple[int, int]:
         """
         Process the key press input and
         return (dx, dy), the offsets on the x and y directions.
         """
+        import pygame
         key_pressed = game_.keys_pressed
         dx, dy = 0, 0
         if key_pressed[pygame.K_LEFT]:
@@ -282,10 +328,26 @@ class Character(Actor):
         and call the win() and lose() methods in Game accordingly
         """
         dx, dy = self.handle_key_press(game_)
+        return self.step(game_, dx, dy)
+
+    def step(self, game_: 'Game', dx: int, dy: int) -> bool:
+        """
+        Move the Player by (dx, dy) as if the matching directional key was
+        pressed. Returns whether <self> actually moves.
+        """
         if dx == 0 and dy == 0:
             return False
+        self.turn(dx, dy)
         return self.move(game_, dx, dy)
 
+    def turn(self, dx: int, dy: int) -> None:
+        """
+        Show that the Player is moving by (dx, dy).
+        Does nothing by default; overridden by characters whose image depends
+        on the direction of the move.
+        """
+        return
+
 
 class Meepo(Character):
     """
@@ -297,13 +359,13 @@ class Meepo(Character):
 
     === Additional Public Attributes ===
     walk_right:
-        Image for walking right
+        Sprites for walking right
     walk_left:
-        Image for walking left
+        Sprites for walking left
     walk_up:
-        Image for walking up
+        Sprites for walking up
     walk_down:
-        Image for walking down
+        Sprites for walking down
     count:
         keeps track of image
     """
@@ -313,145 +375,99 @@ class Meepo(Character):
     walk_up: list
     count: int
 
+    __slots__ = ("sprite", "flip_x", "count")
+
+    # The (sprite, flip_x) pairs for each direction, shared by all Meepos
+    walk_right = [(PLAYER_SPRITE_R1, False), (PLAYER_SPRITE_R2, False)]
+    walk_left = [(PLAYER_SPRITE_R1, True), (PLAYER_SPRITE_R2, True)]
+    walk_up = [(PLAYER_SPRITE_U1, False), (PLAYER_SPRITE_U2, False)]
+    walk_down = [(PLAYER_SPRITE_B1, False), (PLAYER_SPRITE_B2, False)]
+
     def __init__(self, x: int, y: int) -> None:
         """
         Initializes the Meepo Class
-        Load the images for displaying Ms. Meepo's movement.
         """
         super().__init__(x, y)
-
-        # Add motion images
-        self.walk_right = [load_image(PLAYER_SPRITE_R1),
-                           load_image(PLAYER_SPRITE_R2)]
-        self.walk_left = [
-            pygame.transform.flip(load_image(PLAYER_SPRITE_R1), True, False),
-            pygame.transform.flip(load_image(PLAYER_SPRITE_R2), True, False)
-        ]
-        self.walk_up = [load_image(PLAYER_SPRITE_U1),
-                        load_image(PLAYER_SPRITE_U2)]
-
-        self.walk_down = [load_image(PLAYER_SPRITE_B1),
-                          load_image(PLAYER_SPRITE_B2)]
-
-        self.image = self.walk_down[1]
+        self.sprite, self.flip_x = self.walk_down[1]
 
         self.count = 0
 
-    def handle_key_press(self, game_: 'Game') -> Tuple[int, int]:
-        """
-        Overriding the same method in the base class, adding the modification
-        of the image depending on the direction of the move.
-        """
-        key_pressed = game_.keys_pressed
-        dx, dy = 0, 0
-        if key_pressed[pygame.K_LEFT]:
-            dx -= 1
-            self.image = self.walk_left[self.count]
-            self.count = (0, 1)[self.count == 0]
-
-        elif key_pressed[pygame.K_RIGHT]:
-            dx += 1
-            self.image = self.walk_right[self.count]
-            self.count = (0, 1)[self.count == 0]
-
-        elif key_pressed[pygame.K_UP]:
-            dy -= 1
-            self.image = self.walk_up[self.count]
-            self.count = (0, 1)[self.count == 0]
-
-        elif key_pressed[pygame.K_DOWN]:
-            dy += 1
-            self.image = self.walk_down[self.count]
-            self.count = (0, 1)[self.count == 0]
-
-        return dx, dy
-
-    def copy(self) -> 'Meepo':
+    def turn(self, dx: int, dy: int) -> None:
         """
-        Returns a copy of the Flag object
+        Overriding the same method in the base class, changing the image
+        depending on the direction of the move.
         """
-        return Meepo(self.x, self.y)
+        if dx < 0:
+            walk = self.walk_left
+        elif dx > 0:
+            walk = self.walk_right
+        elif dy < 0:
+            walk = self.walk_up
+        else:
+            walk = self.walk_down
+        self.sprite, self.flip_x = walk[self.count]
+        self.count = (0, 1)[self.count == 0]
 
 
 class Wall(Character):
     """
     Class representing the edges and unmovable objects in the game.
     """
+    __slots__ = ()
+    sprite = WALL_SPRITE
 
     def __init__(self, x: int, y: int) -> None:
         super().__init__(x, y)
-        self.image = load_image(WALL_SPRITE)
 
         # Walls can't be moved however they can be moved through
         self._is_stop = False
         self._is_push = False
 
-    def copy(self) -> 'Wall':
-        """
-        Returns a copy of the Wall object
-        """
-        return Wall(self.x, self.y)
-
 
 class Rock(Character):
     """
     Class representing the edges and unmovable objects in the game.
     """
+    __slots__ = ()
+    sprite = ROCK_SPRITE
 
     def __init__(self, x: int, y: int) -> None:
         super().__init__(x, y)
-        self.image = load_image(ROCK_SPRITE)
 
         # Rocks can be moved however they can't be moved through
         self._is_stop = False
         self._is_push = False
 
-    def copy(self) -> 'Rock':
-        """
-        Returns a copy of the Rock object
-        """
-        return Rock(self.x, self.y)
-
 
 class Flag(Character):
     """
     Class representing the edges and unmovable objects in the game.
     """
+    __slots__ = ()
+    sprite = FLAG_SPRITE
 
     def __init__(self, x: int, y: int) -> None:
         super().__init__(x, y)
-        self.image = load_image(FLAG_SPRITE)
 
         # Flags can't be moved however they can be moved through
         self._is_stop = False
         self._is_push = False
 
-    def copy(self) -> 'Flag':
-        """
-        Returns a copy of the Flag object
-        """
-        return Flag(self.x, self.y)
-
 
 class Bush(Actor):
     """
     Class representing the edges and unmovable objects in the game.
     """
+    __slots__ = ()
+    sprite = BUSH_SPRITE
 
     def __init__(self, x: int, y: int) -> None:
         super().__init__(x, y)
-        self.image = load_image(BUSH_SPRITE)
 
         # Bush is always unmovable and cannot be moved through
         self._is_stop = True
         self._is_push = False
 
-    def copy(self) -> 'Bush':
-        """
-        Returns a copy of the Bush object
-        """
-        return Bush(self.x, self.y)
-
 
 class Block(Actor):
     """
@@ -466,6 +482,8 @@ class Block(Actor):
     """
     word: str
 
+    __slots__ = ("word",)
+
     def __init__(self, x: int, y: int, word_: str) -> None:
         super().__init__(x, y)
         self.word = word_
@@ -474,12 +492,13 @@ class Block(Actor):
         self._is_stop = True
         self._is_push = True
 
-    def copy(self) -> 'Block':
+    @property
+    def sprite(self) -> str:
         """
-        Creates an identical copy of self and returns the new copy.
-        To be implemented in the subclasses
+        The sprite of the word of this block, shared by every block of the
+        word
         """
-        raise NotImplementedError
+        return WORDS_SPRITES[self.word.lower()]
 
 
 class Subject(Block):
@@ -488,21 +507,15 @@ class Subject(Block):
     "Meepo", "Wall", "Flag", "Rock" (see SUBJECTS in settings.py)
     """
 
+    __slots__ = ()
+
     def __init__(self, x: int, y: int, subject: str) -> None:
         super().__init__(x, y, subject)
-        self.image = load_image(WORDS_SPRITES[subject.lower()])
 
         # Blocks are always pushable and cannot be moved through.
         self._is_push = True
         self._is_stop = True
 
-    def copy(self) -> 'Block':
-        """
-        Creates an identical copy of self and returns the new copy.
-        To be implemented in the subclasses
-        """
-        return Subject(self.x, self.y, self.word)
-
 
 class Attribute(Block):
     """
@@ -510,21 +523,15 @@ class Attribute(Block):
     "Push", "Stop", "Victory", "Lose", "You"
     """
 
+    __slots__ = ()
+
     def __init__(self, x: int, y: int, attribute: str) -> None:
         super().__init__(x, y, attribute)
-        self.image = load_image(WORDS_SPRITES[attribute.lower()])
 
         # Blocks are always pushable and cannot be moved through.
         self._is_push = True
         self._is_stop = True
 
-    def copy(self) -> 'Block':
-        """
-        Creates an identical copy of self and returns the new copy.
-        To be implemented in the subclasses
-        """
-        return Attribute(self.x, self.y, self.word)
-
 
 class Is(Block):
     """
@@ -532,9 +539,11 @@ class Is(Block):
     """
     colour: str
 
+    __slots__ = ("sprite", "colour")
+
     def __init__(self, x: int, y: int) -> None:
         super().__init__(x, y, " is")  # Note the space in " is"
-        self.image = load_image(IS_PURPLE)
+        self.sprite = IS_PURPLE
         self.colour = "Purple"
 
         self._is_push = True
@@ -585,37 +594,24 @@ class Is(Block):
                 rule2 = ''
 
         if rule1 == '' and rule2 == '':
-            self.image = load_image(IS_PURPLE)
+            self.sprite = IS_PURPLE
             self.colour = "Purple"
         if rule1 == '' and rule2 != '':
-            self.image = load_image(IS_LIGHT_BLUE)
+            self.sprite = IS_LIGHT_BLUE
             self.colour = "Light Blue"
         if rule2 == '' and rule1 != '':
-            self.image = load_image(IS_LIGHT_BLUE)
+            self.sprite = IS_LIGHT_BLUE
             self.colour = "Light Blue"
         if rule1 != '' and rule2 != '':
-            self.image = load_image(IS_DARK_BLUE)
+            self.sprite = IS_DARK_BLUE
             self.colour = "Dark Blue"
 
 
         return rule1, rule2
 
-    def copy(self) -> 'Is':
-        """
-        Creates an identical copy of self and returns the new copy.
-        To be implemented in the subclasses
-        """
-        return Is(self.x, self.y)
-
 
-def load_image(img_name: str, width: int = TILESIZE,
-               height: int = TILESIZE) -> pygame.image:
-    """
-    Return a pygame img of the PNG img_name that has been scaled according
-    to the given width and size
-    """
-    img = pygame.image.load(img_name).convert_alpha()
-    return pygame.transform.scale(img, (width, height))
+# Maps each class of actor to the names of the fields copied by Actor.copy
+_FIELDS: Dict[type, Tuple[str, ...]] = {}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,336 @@
+"""
+Times the main operations of the game on generated maps of several sizes and
+compares the timings with a saved baseline, e.g. python benchmark.py -h.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from game import Game
+from settings import ATTRIBUTES, SUBJECTS
+
+# The map sizes timed by default, as (columns, rows); the first is the size
+# of maps/map.txt
+SIZES = [(26, 19), (100, 100), (250, 250), (500, 500)]
+
+# The operations timed, in the order they are reported
+OPERATIONS = ["move", "push_chain", "update_full", "update_incremental",
+              "edit_rules", "copy", "undo", "load_text", "load_cache",
+              "draw_full", "draw_dirty"]
+
+# A timing is a regression when it is this many times slower than the
+# baseline
+THRESHOLD = 1.5
+
+# The tiles that can be scattered as blocks
+_BLOCKS = list(SUBJECTS) + list(ATTRIBUTES) + ["I"]
+
+# The tiles that can be scattered as scenery: Wall, Rock and Flag
+_SCENERY = ["3", "4", "5"]
+
+
+def make_map(width: int, height: int, blocks: float = 0.05,
+             scenery: float = 0.05, chain: int = 10,
+             seed: int = 0) -> List[str]:
+    """
+    Return the lines of a generated map of <width> columns and <height> rows.
+
+    Row 1 holds the rules, Meepo stands at the start of row 3 followed by
+    <chain> rocks to push right, and every other cell holds a block with
+    probability <blocks> (only on even rows and columns) or else scenery
+    with probability <scenery>.
+    """
+    if width < max(chain + 4, 10) or height < 7:
+        raise ValueError("a {}x{} map is too small".format(width, height))
+    rnd = random.Random(seed)
+    grid = [["."] * width for _ in range(height)]
+    for y in range(5, height - 1):
+        for x in range(1, width - 1):
+            if x % 2 == 0 and y % 2 == 0 and rnd.random() < blocks:
+                grid[y][x] = rnd.choice(_BLOCKS)
+            elif (x % 2 == 1 or y % 2 == 1) and rnd.random() < scenery:
+                grid[y][x] = rnd.choice(_SCENERY)
+    for y in range(height):
+        grid[y][0] = grid[y][width - 1] = "1"
+    grid[0] = grid[height - 1] = ["1"] * width
+    grid[1][1:4] = list("MIY")
+    grid[1][5:8] = list("RIP")
+    grid[3][1] = "2"
+    for x in range(2, chain + 2):
+        grid[3][x] = "4"
+    return ["".join(row) for row in grid]
+
+
+def make_game(lines: List[str]) -> Game:
+    """
+    Return a new game of the map <lines>, without a window and without
+    printing.
+    """
+    game_ = Game()
+    game_.verbose = False
+    game_.load_lines(lines)
+    game_.new()
+    return game_
+
+
+def time_operation(run: Callable[[], Any],
+                   setup: Optional[Callable[[], Any]] = None,
+                   repeat: int = 20) -> Dict[str, float]:
+    """
+    Return the median and the fastest time of <repeat> calls of <run>, in
+    microseconds. <setup> is called before each call, and is not timed.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1e6)
+    return {"median_us": statistics.median(times), "min_us": min(times),
+            "runs": repeat}
+
+
+def actor_bytes(game_: Game) -> float:
+    """
+    Return the memory taken by an actor of <game_> on average, in bytes
+    (with its place in a list), measured with tracemalloc on copies of the
+    actors.
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    copies = [ac.copy() for ac in game_.get_actors()]
+    used = tracemalloc.get_traced_memory()[0] - before
+    if not tracing:
+        tracemalloc.stop()
+    return used / max(1, len(copies))
+
+
+def bench_map(lines: List[str], repeat: int = 20,
+              draw: bool = True) -> Dict[str, Any]:
+    """
+    Return the timings of every operation of OPERATIONS on the map <lines>.
+    Drawing is only timed if <draw> is True; the window shows at most
+    VIEWPORT_TILES of the map, so it is timed on maps of every size.
+    """
+    game_ = make_game(lines)
+    start = game_.snapshot()
+    player = game_.player
+    raw_rules = [rule for ar in game_._is for rule in game_._is_rules[id(ar)]]
+
+    def reset() -> None:
+        game_.restore(start)
+        game_._update()
+
+    def push() -> None:
+        reset()
+        player.move(game_, 1, 0)
+
+    def journal_push() -> None:
+        reset()
+        game_.play_move(1, 0)
+
+    def stale() -> None:
+        game_._rules_stale = True
+
+    results: Dict[str, Any] = {"actors": len(game_.get_actors()),
+                               "actor_bytes": actor_bytes(game_)}
+    results["move"] = time_operation(lambda: player.move(game_, 0, -1),
+                                     reset, repeat)
+    results["push_chain"] = time_operation(lambda: player.move(game_, 1, 0),
+                                           reset, repeat)
+    results["update_full"] = time_operation(game_._update, stale, repeat)
+    results["update_incremental"] = time_operation(game_._update, push,
+                                                   repeat)
+    results["edit_rules"] = time_operation(
+        lambda: Game.edit_rules(list(raw_rules)), None, repeat)
+    results["copy"] = time_operation(game_._copy, None, repeat)
+    results["undo"] = time_operation(game_._undo, journal_push, repeat)
+    results.update(bench_load(lines, repeat))
+
+    if draw:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        import pygame
+        from view import View
+        pygame.display.init()
+        reset()
+        game_.view = View(game_)
+        game_._draw()
+
+        def redraw_all() -> None:
+            game_._redraw_all = True
+
+        def moved() -> None:
+            push()
+            game_.take_redraw()
+            player.move(game_, 0, -1)
+
+        results["draw_full"] = time_operation(game_._draw, redraw_all,
+                                              repeat)
+        results["draw_dirty"] = time_operation(game_._draw, moved, repeat)
+        game_.view = None
+        pygame.display.quit()
+    return results
+
+
+def bench_load(lines: List[str], repeat: int = 20) -> Dict[str, Any]:
+    """
+    Return the timings of loading the map <lines> from a map file as text
+    and from the map cache, once the cache is filled.
+    """
+    import mapcache
+
+    def load_text() -> None:
+        text = Game()
+        text.load_map(path)
+        text.new()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        path = os.path.join(cache_dir, "map.txt")
+        with open(path, 'wt') as f:
+            f.write("\n".join(lines) + "\n")
+        mapcache.load_map(path, cache_dir).close()
+        return {"load_text": time_operation(load_text, None, repeat),
+                "load_cache": time_operation(
+                    lambda: mapcache.load_game(path, cache_dir), None,
+                    repeat)}
+
+
+def run_benchmarks(sizes: List[Tuple[int, int]], blocks: float = 0.05,
+                   scenery: float = 0.05, chain: int = 10, repeat: int = 20,
+                   draw: bool = True) -> Dict[str, Any]:
+    """
+    Return the timings on a generated map of each of <sizes>, with the
+    parameters they were made with, ready to be saved as JSON.
+    """
+    report: Dict[str, Any] = {
+        "version": 1,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {"blocks": blocks, "scenery": scenery, "chain": chain,
+                   "repeat": repeat},
+        "results": {}
+    }
+    for width, height in sizes:
+        lines = make_map(width, height, blocks, scenery, chain)
+        report["results"]["{}x{}".format(width, height)] = \
+            bench_map(lines, repeat, draw)
+    return report
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: float = THRESHOLD) -> List[Tuple[str, str, float]]:
+    """
+    Return the (size, operation, slowdown) of the timings of <report> whose
+    median is more than <threshold> times the one in <baseline>.
+    Timings missing from either report are ignored.
+    """
+    regressions = []
+    for size, results in report["results"].items():
+        before = baseline.get("results", {}).get(size, {})
+        for op in OPERATIONS:
+            if op in results and op in before \
+                    and before[op]["median_us"] > 0:
+                slowdown = results[op]["median_us"] / before[op]["median_us"]
+                if slowdown > threshold:
+                    regressions.append((size, op, slowdown))
+    return regressions
+
+
+def format_report(report: Dict[str, Any],
+                  baseline: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Return the median timings of <report> as a table, with the change from
+    <baseline> if given.
+    """
+    sizes = list(report["results"])
+    lines = ["{:<20}".format("median (us)")
+             + "".join("{:>18}".format(size) for size in sizes)]
+    lines.append("{:<20}".format("actors") + "".join(
+        "{:>18}".format(report["results"][size]["actors"]) for size in sizes))
+    lines.append("{:<20}".format("bytes per actor") + "".join(
+        "{:>18.1f}".format(report["results"][size].get("actor_bytes", 0))
+        for size in sizes))
+    for op in OPERATIONS:
+        row = "{:<20}".format(op)
+        for size in sizes:
+            timing = report["results"][size].get(op)
+            if timing is None:
+                row += "{:>18}".format("-")
+                continue
+            cell = "{:.1f}".format(timing["median_us"])
+            old = (baseline or {}).get("results", {}).get(size, {}).get(op)
+            if old and old["median_us"] > 0:
+                cell += " ({:+.0%})".format(
+                    timing["median_us"] / old["median_us"] - 1)
+            row += "{:>18}".format(cell)
+        lines.append(row)
+    return "\n".join(lines)
+
+
+def _size(text: str) -> Tuple[int, int]:
+    """
+    Return the size written as <text>, e.g. 26x19.
+    """
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Run the benchmarks, print them and save or compare them as asked on the
+    command line. Returns 1 if a regression was found, otherwise 0.
+    """
+    parser = argparse.ArgumentParser(
+        description="Time the game operations on generated maps.")
+    parser.add_argument("--sizes", default=",".join(
+        "{}x{}".format(*size) for size in SIZES),
+                        help="comma-separated map sizes, e.g. 26x19,100x100")
+    parser.add_argument("--blocks", type=float, default=0.05,
+                        help="density of the scattered blocks")
+    parser.add_argument("--scenery", type=float, default=0.05,
+                        help="density of the scattered walls, rocks, flags")
+    parser.add_argument("--chain", type=int, default=10,
+                        help="length of the line of rocks pushed")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="number of timed calls of each operation")
+    parser.add_argument("--no-draw", action="store_true",
+                        help="do not time drawing")
+    parser.add_argument("--output", help="save the timings to this JSON file")
+    parser.add_argument("--compare", help="JSON file of baseline timings")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="slowdown flagged as a regression")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks([_size(s) for s in args.sizes.split(",")],
+                            args.blocks, args.scenery, args.chain,
+                            args.repeat, not args.no_draw)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'rt') as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(report, f, indent=2)
+    if baseline is None:
+        return 0
+    regressions = compare(report, baseline, args.threshold)
+    for size, op, slowdown in regressions:
+        print("REGRESSION: {} on {} is {:.2f}x slower".format(op, size,
+                                                             slowdown))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+A spatial index of the actors of a game, by the cell they stand on.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class Board:
+    """
+    The actors of the game by cell and by type, each in the order they were
+    added to the board, i.e. the order of the game's list of actors.
+
+    === Private Attributes ===
+    _cells:
+        Maps an (x, y) cell to the actors standing on it, in board order
+    _rank:
+        Maps id(actor) to the position of that actor in board order
+    _next_rank:
+        The rank to give to the next actor added to the board
+    _types:
+        Maps the type of an actor to the actors of that type, in board order
+
+    Representation Invariant: every actor on the board appears in exactly one
+    cell, namely the one at its (x, y) coordinates
+    """
+    _cells: Dict[Tuple[int, int], List[Any]]
+    _rank: Dict[int, int]
+    _next_rank: int
+    _types: Dict[type, List[Any]]
+
+    def __init__(self) -> None:
+        """
+        Initialize an empty board.
+        """
+        self._cells = {}
+        self._rank = {}
+        self._next_rank = 0
+        self._types = {}
+
+    def clear(self) -> None:
+        """
+        Remove every actor from the board.
+        """
+        self._cells = {}
+        self._rank = {}
+        self._next_rank = 0
+        self._types = {}
+
+    def rebuild(self, actors: List[Any]) -> None:
+        """
+        Replace the contents of the board with <actors>, in the given order.
+        """
+        self.clear()
+        # The same as adding each actor, without a call per actor
+        cells, types, rank = self._cells, self._types, self._rank
+        for i, ac in enumerate(actors):
+            rank[id(ac)] = i
+            cells.setdefault((ac.x, ac.y), []).append(ac)
+            types.setdefault(type(ac), []).append(ac)
+        self._next_rank = len(actors)
+
+    def add(self, actor_: Any) -> None:
+        """
+        Put <actor_> on the cell at its current coordinates. It is ordered
+        after every actor already on the board.
+        """
+        self._rank[id(actor_)] = self._next_rank
+        self._next_rank += 1
+        self._cells.setdefault((actor_.x, actor_.y), []).append(actor_)
+        self._types.setdefault(type(actor_), []).append(actor_)
+
+    def remove(self, actor_: Any) -> None:
+        """
+        Take <actor_> off the board. Do nothing if it is not on the board.
+        """
+        if id(actor_) not in self._rank:
+            return
+        self._take(actor_, actor_.x, actor_.y)
+        del self._rank[id(actor_)]
+        same_type = self._types[type(actor_)]
+        for i, ac in enumerate(same_type):
+            if ac is actor_:
+                same_type.pop(i)
+                break
+
+    def move(self, actor_: Any, x: int, y: int) -> None:
+        """
+        Move <actor_> to the cell (x, y), updating its coordinates.
+        """
+        if id(actor_) in self._rank:
+            self._take(actor_, actor_.x, actor_.y)
+            actor_.x, actor_.y = x, y
+            self._put(actor_)
+        else:
+            actor_.x, actor_.y = x, y
+
+    def get(self, x: int, y: int) -> Optional[Any]:
+        """
+        Return the first actor on the cell (x, y), or None if it is empty.
+        """
+        cell = self._cells.get((x, y))
+        if cell:
+            return cell[0]
+        return None
+
+    def get_all(self, x: int, y: int) -> List[Any]:
+        """
+        Return every actor on the cell (x, y), in board order.
+        """
+        return list(self._cells.get((x, y), ()))
+
+    def get_type(self, cls: type) -> List[Any]:
+        """
+        Return every actor of type <cls> on the board (not of its
+        subclasses), in board order.
+        """
+        return list(self._types.get(cls, ()))
+
+    def __contains__(self, actor_: Any) -> bool:
+        """
+        Return whether <actor_> is on the board.
+        """
+        return id(actor_) in self._rank
+
+    def _take(self, actor_: Any, x: int, y: int) -> None:
+        """
+        Remove <actor_> from the list of the cell (x, y).
+        """
+        cell = self._cells[(x, y)]
+        for i, ac in enumerate(cell):
+            if ac is actor_:
+                cell.pop(i)
+                break
+        if not cell:
+            del self._cells[(x, y)]
+
+    def _put(self, actor_: Any) -> None:
+        """
+        Insert <actor_> into the cell at its coordinates, keeping the cell
+        in board order.
+        """
+        cell = self._cells.setdefault((actor_.x, actor_.y), [])
+        rank = self._rank[id(actor_)]
+        i = len(cell)
+        while i > 0 and self._rank[id(cell[i - 1])] > rank:
+            i -= 1
+        cell.insert(i, actor_)
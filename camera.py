@@ -0,0 +1,98 @@
+"""
+The Camera class, the part of a map shown in the window of a view.View.
+"""
+from typing import Iterator, Tuple
+
+from settings import CAMERA_MARGIN, VIEWPORT_TILES
+
+
+class Camera:
+    """
+    A window of cells onto a map, which scrolls to keep a cell in view and
+    never shows cells outside the map.
+
+    === Public Attributes ===
+    x, y:
+        the cell at the top left of the view
+    width, height:
+        the number of columns and rows of cells in the view
+    map_width, map_height:
+        the number of columns and rows of cells of the map
+    margin:
+        how close the followed cell may come to an edge of the view, in cells
+    """
+    x: int
+    y: int
+    width: int
+    height: int
+    map_width: int
+    map_height: int
+    margin: int
+
+    def __init__(self, map_width: int, map_height: int,
+                 view: Tuple[int, int] = VIEWPORT_TILES,
+                 margin: int = CAMERA_MARGIN) -> None:
+        """
+        Initialize a camera showing the top left of a map of <map_width> by
+        <map_height> cells, through a view of at most <view> cells.
+        """
+        self.map_width, self.map_height = map_width, map_height
+        self.width = min(view[0], map_width)
+        self.height = min(view[1], map_height)
+        self.margin = margin
+        self.x, self.y = 0, 0
+
+    def centre(self, x: int, y: int) -> None:
+        """
+        Scroll so that the cell (x, y) is in the middle of the view, as far
+        as the edges of the map allow.
+        """
+        self.x = self._clamp(x - self.width // 2, self.width, self.map_width)
+        self.y = self._clamp(y - self.height // 2, self.height,
+                             self.map_height)
+
+    def follow(self, x: int, y: int) -> bool:
+        """
+        Scroll as little as needed to keep the cell (x, y) at least margin
+        cells from the edges of the view. Return whether the camera moved.
+        """
+        old = (self.x, self.y)
+        self.x = self._follow(self.x, x, self.width, self.map_width)
+        self.y = self._follow(self.y, y, self.height, self.map_height)
+        return (self.x, self.y) != old
+
+    def visible(self, x: int, y: int) -> bool:
+        """
+        Return whether the cell (x, y) is in the view.
+        """
+        return self.x <= x < self.x + self.width \
+            and self.y <= y < self.y + self.height
+
+    def cells(self) -> Iterator[Tuple[int, int]]:
+        """
+        Yield every cell in the view, row by row.
+        """
+        for y in range(self.y, self.y + self.height):
+            for x in range(self.x, self.x + self.width):
+                yield x, y
+
+    def _follow(self, start: int, target: int, size: int,
+                limit: int) -> int:
+        """
+        Return the first cell of the view along one axis, starting at
+        <start>, once it follows <target>.
+        """
+        margin = min(self.margin, (size - 1) // 2)
+        if target < start + margin:
+            start = target - margin
+        elif target >= start + size - margin:
+            start = target - size + margin + 1
+        return self._clamp(start, size, limit)
+
+    @staticmethod
+    def _clamp(start: int, size: int, limit: int) -> int:
+        """
+        Return <start> moved so that a view of <size> cells from it stays
+        within <limit> cells.
+        """
+        return max(0, min(start, limit - size))
@@ -7,16 +7,23 @@ University of Toronto Mississauga
 
 === Module Description ===
 This module contains the Game class and the main game application.
-
 """
-
-from typing import Any, Type, Tuple, List, Sequence, Optional
-
-import pygame
+import time
+from collections import deque
+from typing import Any, Type, Tuple, List, Sequence, Optional, Dict, Set, \
+    FrozenSet, Deque, Iterable, Iterator, Union
 
 import actor
+from board import Board
 from settings import *
-from stack import Stack
+from history import Journal, Trail
+
+# The types of actors that only move when a rule makes them pushable or the
+# player; Blocks are always pushable
+SCENERY_TYPES = (actor.Bush, actor.Meepo, actor.Wall, actor.Rock, actor.Flag)
+
+# The queued input standing for a redo; an undo is None
+REDO = "redo"
 
 
 class Game:
@@ -26,21 +33,32 @@ class Game:
     size: Tuple[int, int]
     width: int
     height: int
-    screen: Optional[pygame.Surface]
+    view: Optional[Any]
     x_tiles: int
     y_tiles: int
     tiles_number: Tuple[int, int]
-    background: Optional[pygame.Surface]
 
     _actors: List[actor.Actor]
+    _board: Board
     _is: List[actor.Is]
     _running: bool
     _rules: List[str]
-    _history: Stack
+    _is_rules: Dict[int, Tuple[str, str]]
+    _dirty_cells: Set[Tuple[int, int]]
+    _redraw_cells: Set[Tuple[int, int]]
+    _redraw_all: bool
+    _rules_stale: bool
+    _history: Union[Journal, Trail]
+    _inputs: Deque[Union[None, str, Tuple[int, int]]]
 
     player: Optional[actor.Actor]
     map_data: List[str]
     keys_pressed: Optional[Sequence[bool]]
+    verbose: bool
+    compact_state: Optional[Any]
+    frame_times: Deque[float]
+    recorder: Optional[Any]
+    profiler: Optional[Any]
 
     def __init__(self) -> None:
         """
@@ -48,28 +66,45 @@ class Game:
         """
         self.width, self.height = 0, 0
         self.size = (self.width, self.height)
-        self.screen = None
+        self.view = None
         self.x_tiles, self.y_tiles = (0, 0)
         self.tiles_number = (self.x_tiles, self.y_tiles)
-        self.background = None
 
         self._actors = []
+        self._board = Board()
         self._is = []
         self._running = True
         self._rules = []
-        self._history = Stack()
+        self._is_rules = {}
+        self._dirty_cells = set()
+        self._rules_stale = True
+        self._redraw_cells = set()
+        self._redraw_all = True
+        self._history = Journal()
+        self._inputs = deque()
         self.player = None
         self.map_data = []
 
         self.keys_pressed = []
+        self.verbose = True
+        self.compact_state = None
+        self.frame_times = deque(maxlen=FRAME_TIME_SAMPLES)
+        self.recorder = None
+        self.profiler = None
 
     def load_map(self, path: str) -> None:
         """
         Reads a .txt file representing the map
         """
         with open(path, 'rt') as f:
-            for line in f:
-                self.map_data.append(line.strip())
+            self.load_lines([line.strip() for line in f])
+
+    def load_lines(self, lines: List[str]) -> None:
+        """
+        Reads the lines of a map, e.g. one made by a program instead of read
+        from a .txt file
+        """
+        self.map_data.extend(lines)
 
         self.width = (len(self.map_data[0])) * TILESIZE
         self.height = len(self.map_data) * TILESIZE
@@ -83,24 +118,55 @@ class Game:
         """
         Initialize variables to be object on screen.
         """
-        self.screen = pygame.display.set_mode(self.size)
-        self.background = pygame.image.load(
-            "{}/backgroundBig.png".format(SPRITES_DIR)).convert_alpha()
+        self.new_from(self.tiles())
+
+    def tiles(self) -> Iterator[Tuple[str, int, int]]:
+        """
+        Yield (tile, x, y) for every cell of the map that holds an actor,
+        row by row.
+        """
         for col, tiles in enumerate(self.map_data):
             for row, tile in enumerate(tiles):
-                if tile.isnumeric():
-                    self._actors.append(
-                        Game.get_character(CHARACTERS[tile])(row, col))
-                elif tile in SUBJECTS:
-                    self._actors.append(
-                        actor.Subject(row, col, SUBJECTS[tile]))
-                elif tile in ATTRIBUTES:
-                    self._actors.append(
-                        actor.Attribute(row, col, ATTRIBUTES[tile]))
-                elif tile == 'I':
-                    is_tile = actor.Is(row, col)
-                    self._is.append(is_tile)
-                    self._actors.append(is_tile)
+                if tile != '.':
+                    yield tile, row, col
+
+    def new_from(self, tiles: Iterable[Tuple[str, int, int]]) -> None:
+        """
+        Initialize the actors from (tile, x, y) triples, e.g. from tiles().
+        Unknown tiles are skipped.
+        """
+        actors = []
+        for tile, row, col in tiles:
+            if tile.isnumeric():
+                actors.append(Game.get_character(CHARACTERS[tile])(row, col))
+            elif tile in SUBJECTS:
+                actors.append(actor.Subject(row, col, SUBJECTS[tile]))
+            elif tile in ATTRIBUTES:
+                actors.append(actor.Attribute(row, col, ATTRIBUTES[tile]))
+            elif tile == 'I':
+                actors.append(actor.Is(row, col))
+        self.new_actors(actors)
+
+    def new_actors(self, actors: List[actor.Actor]) -> None:
+        """
+        Initialize the game with <actors>, already made in the order of the
+        map, e.g. from the actor table of a compiled map (see mapcache.py).
+        """
+        self._actors.extend(actors)
+        self._is.extend(ac for ac in actors if isinstance(ac, actor.Is))
+        self._board.rebuild(self._actors)
+        self._rules_stale = True
+        self._redraw_all = True
+        self.reset_history()
+        self._update()
+
+    def reset_history(self, history: Optional[Journal] = None) -> None:
+        """
+        Replace the undo history with <history>, or with an empty one if None,
+        closing the one it replaces.
+        """
+        self._history.close()
+        self._history = history if history is not None else Journal()
 
     def get_actors(self) -> List[actor.Actor]:
         """
@@ -130,55 +196,153 @@ class Game:
         """
         Draws the screen, grid, and objects/players on the screen
         """
-        self.screen.blit(self.background,
-                         (((0.5 * self.width) - (0.5 * 1920),
-                           (0.5 * self.height) - (0.5 * 1080))))
-        for actor_ in self._actors:
-            rect = pygame.Rect(actor_.x * TILESIZE,
-                               actor_.y * TILESIZE, TILESIZE, TILESIZE)
-            self.screen.blit(actor_.image, rect)
+        self.view.draw(self)
 
-        # Blit the player at the end to make it above all other objects
-        if self.player:
-            rect = pygame.Rect(self.player.x * TILESIZE,
-                               self.player.y * TILESIZE, TILESIZE, TILESIZE)
-            self.screen.blit(self.player.image, rect)
+    def take_redraw(self) -> Tuple[bool, Set[Tuple[int, int]]]:
+        """
+        Return whether the whole map must be drawn again and which cells
+        changed since the last call, and start tracking changes anew.
+        """
+        redraw = (self._redraw_all, self._redraw_cells)
+        self._redraw_all = False
+        self._redraw_cells = set()
+        return redraw
 
-        pygame.display.flip()
+    def history_stats(self) -> Tuple[int, int]:
+        """
+        Return the number of undo steps in the history and how many actors
+        the last one saved the state of.
+        """
+        return len(self._history), self._history.last_copied()
+
+    def history_depth(self) -> Tuple[int, int]:
+        """
+        Return the number of moves that can be undone and redone. Moves
+        undone are dropped first if the game changed since, as a redo would.
+        """
+        self._history.can_redo(self)
+        return len(self._history), self._history.redo_depth()
+
+    def static_types(self) -> FrozenSet[type]:
+        """
+        Return the types of the actors that cannot move under the current
+        rules: Bushes, and the characters that are neither pushable nor the
+        player.
+        """
+        movable = set()
+        for rule in self._rules:
+            subject, attribute = rule.split(" ")
+            if attribute in ("isPush", "isYou"):
+                movable.add(self.get_character(subject))
+        if self.player is not None:
+            movable.add(type(self.player))
+        return frozenset(t for t in SCENERY_TYPES if t not in movable)
 
     def _events(self) -> None:
         """
         Event handling of the game window
         """
+        import pygame
         for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                self._running = False
-            # Allows us to make each press count as 1 movement.
-            elif event.type == pygame.KEYDOWN:
-                self.keys_pressed = pygame.key.get_pressed()
-                ctrl_held = self.keys_pressed[pygame.K_LCTRL]
-
-                # handle undo button and player movement here
-                if event.key == pygame.K_z and ctrl_held:  # Ctrl-Z
-                    self._undo()
-                else:
-                    if self.player is not None:
-                        assert isinstance(self.player, actor.Character)
-                        save = self._copy()
-                        if self.player.player_move(self) \
-                                and not self.win_or_lose():
-                            self._history.push(save)
+            self._handle_event(event)
         return
 
+    def _handle_event(self, event: Any) -> None:
+        """
+        Handle one pygame event. Key presses are queued and played by _tick.
+        """
+        import pygame
+        if event.type == pygame.QUIT:
+            self._running = False
+        elif event.type == pygame.VIDEOEXPOSE:
+            self._redraw_all = True
+        # Allows us to make each press count as 1 movement.
+        elif event.type == pygame.KEYDOWN:
+            self.keys_pressed = pygame.key.get_pressed()
+            ctrl_held = self.keys_pressed[pygame.K_LCTRL]
+
+            # handle undo and redo buttons and player movement here
+            if event.key == pygame.K_z and ctrl_held:  # Ctrl-Z
+                self._inputs.append(None)
+            elif event.key == pygame.K_y and ctrl_held:  # Ctrl-Y
+                self._inputs.append(REDO)
+            elif event.key == pygame.key.key_code(PROFILE_KEY) \
+                    and self.profiler is not None:
+                self.profiler.dump(PROFILE_PATH)
+            elif self.player is not None:
+                assert isinstance(self.player, actor.Character)
+                self._inputs.append(self.player.handle_key_press(self))
+
+    def _tick(self) -> None:
+        """
+        Play the oldest queued key press, if any, and update the rules.
+        The key press is recorded if a replay.Recorder is attached.
+        """
+        if not self._inputs:
+            self._update()
+            return
+        move = self._inputs.popleft()
+        if move is None:
+            self._undo()
+        elif move == REDO:
+            self._redo()
+        elif self.player is not None:
+            self.play_move(*move)
+        self._update()
+        if self.recorder is not None:
+            self.recorder.record(self, move)
+
+    def play_input(self, move: Union[None, str, Tuple[int, int]]) -> None:
+        """
+        Queue <move>, an offset of the player, None for an undo or REDO, and
+        play it as a key press, without a window.
+        """
+        self._inputs.append(move)
+        self._tick()
+
+    def play_move(self, dx: int, dy: int, record: bool = True) -> bool:
+        """
+        Move the player by (dx, dy), as if the matching directional key was
+        pressed, and record the move in the undo history unless <record> is
+        False.
+        Returns whether the move was kept, i.e. the player moved without
+        winning or losing.
+        """
+        if self.player is None:
+            return False
+        assert isinstance(self.player, actor.Character)
+        player = self.player
+        if record:
+            self._history.begin(self)
+        kept = player.step(self, dx, dy) and not self.win_or_lose()
+        # The player may have turned without moving
+        self._redraw_cells.add((player.x, player.y))
+        if record and kept:
+            self._history.commit()
+        elif record:
+            self._history.abandon()
+        return kept
+
+    def step(self, dx: int, dy: int, record: bool = True) -> bool:
+        """
+        Play one move of the player by (dx, dy) and update the rules, without
+        a window. See play_move for <record> and the return value.
+        """
+        kept = self.play_move(dx, dy, record)
+        self._update()
+        return kept
+
     def win_or_lose(self) -> bool:
         """
         Check if the game has won or lost
         Returns True if the game is won or lost; otherwise return False
+
+        Only the actors on the player's cell are looked at, in the order of
+        the list of actors, so the cost does not grow with the map.
         """
         assert isinstance(self.player, actor.Character)
-        for ac in self._actors:
-            if isinstance(ac, actor.Character) \
-                    and ac.x == self.player.x and ac.y == self.player.y:
+        for ac in self._board.get_all(self.player.x, self.player.y):
+            if isinstance(ac, actor.Character):
                 if ac.is_win():
                     self.win()
                     return True
@@ -190,12 +354,79 @@ class Game:
     def run(self) -> None:
         """
         Run the Game until it ends or player quits.
-        """
+
+        The loop sleeps until an event arrives, plays queued key presses at
+        LOGIC_HZ, and draws a frame only when something changed, at most FPS
+        times per second. Each tick is measured if a profiler.Profiler is
+        attached to self.profiler (or PROFILE is set), and its report is
+        written to PROFILE_PATH at the end.
+        """
+        import pygame
+        from view import View
+        if self.view is None:
+            self.view = View(self)
+        if PROFILE and self.profiler is None:
+            from profiler import Profiler
+            self.profiler = Profiler()
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.attach(self)
+        clock = pygame.time.Clock()
+        tick = 1000 / LOGIC_HZ
+        next_tick = pygame.time.get_ticks()
         while self._running:
-            pygame.time.wait(1000 // FPS)
+            now = pygame.time.get_ticks()
+            event = None
+            if not self._inputs:
+                event = pygame.event.wait(IDLE_WAIT_MS)
+            elif next_tick > now:
+                # pygame.event.wait(0) would wait forever
+                event = pygame.event.wait(max(1, int(next_tick - now)))
+
+            if profiler is not None:
+                profiler.begin()
+            if event is not None:
+                self._handle_event(event)
             self._events()
-            self._update()
-            self._draw()
+            if profiler is not None:
+                profiler.lap("events")
+
+            now = pygame.time.get_ticks()
+            ticked = bool(self._inputs) and now >= next_tick
+            if ticked:
+                self._tick()
+                next_tick = max(next_tick, now - tick) + tick
+            else:
+                self._update()
+            if profiler is not None:
+                profiler.lap("update")
+
+            drawn = bool(self._redraw_all or self._redraw_cells)
+            if drawn:
+                start = time.perf_counter()
+                self._draw()
+                self.frame_times.append((time.perf_counter() - start) * 1000)
+            if profiler is not None:
+                profiler.lap("draw")
+                profiler.end(self, ticked or drawn)
+            if drawn:
+                clock.tick(FPS)
+        if self.verbose and self.frame_times:
+            print(self.frame_report())
+        if self.verbose and not self._history.is_empty():
+            print(self._history.report())
+        self._history.close()
+        if profiler is not None:
+            profiler.detach()
+            profiler.dump(PROFILE_PATH)
+
+    def frame_report(self) -> str:
+        """
+        Return the mean and worst time taken to draw the recent frames.
+        """
+        times = self.frame_times
+        return "{} frames drawn in {:.2f} ms on average, {:.2f} ms at " \
+               "worst".format(len(times), sum(times) / len(times), max(times))
 
     def set_player(self, actor_: Optional[actor.Actor]) -> None:
         """
@@ -207,52 +438,120 @@ class Game:
         """
         Remove the given <actor> from the game's list of actors.
         """
+        self._history.record_removal(self._actors.index(actor_), actor_)
         self._actors.remove(actor_)
+        self._board.remove(actor_)
+        self._rules_stale = True
+        self._redraw_cells.add((actor_.x, actor_.y))
         self.player = None
+        if self.compact_state is not None:
+            self.compact_state.remove(actor_)
+            self.compact_state.set_player(None)
 
     def _update(self) -> None:
         """
         Check each "Is" tile to find what rules are added and which are removed
         if any, and handle them accordingly.
-        """
+
+        When INCREMENTAL_RULES is set, only the "Is" tiles on or next to a cell
+        that changed since the last update are read again, and only the actors
+        whose rules changed are updated. Nothing is done if no cell changed.
+        """
+        full = self._rules_stale or not INCREMENTAL_RULES
+        if full:
+            self._is = self._board.get_type(actor.Is)
+            self._is_rules = {}
+            touched = self._is
+        elif self._dirty_cells:
+            touched = self._touched_is()
+        else:
+            return
+
+        for ar in touched:
+            up = self.get_actor(ar.x - 1, ar.y)
+            down = self.get_actor(ar.x + 1, ar.y)
+            left = self.get_actor(ar.x, ar.y - 1)
+            right = self.get_actor(ar.x, ar.y + 1)
+            sprite = ar.sprite
+            self._is_rules[id(ar)] = ar.update(up, down, left, right)
+            if ar.sprite != sprite:
+                self._redraw_cells.add((ar.x, ar.y))
+        self._dirty_cells = set()
+        self._rules_stale = False
+
         rules = []
-        for ar in self._actors:
-            if isinstance(ar, actor.Is):
-                up = self.get_actor(ar.x - 1, ar.y)
-                down = self.get_actor(ar.x + 1, ar.y)
-                left = self.get_actor(ar.x, ar.y - 1)
-                right = self.get_actor(ar.x, ar.y + 1)
-                r1, r2 = ar.update(up, down, left, right)
-                rules.append(r1)
-                rules.append(r2)
+        for ar in self._is:
+            r1, r2 = self._is_rules[id(ar)]
+            rules.append(r1)
+            rules.append(r2)
 
         rules = self.edit_rules(rules)
+        player = self.player
 
         remove_rules = [r for r in self._rules if r not in rules]
+        if full:
+            enforce_rules = rules
+        else:
+            enforce_rules = self._affected_rules(rules, remove_rules)
 
+        # Only the actors of the subject of a rule are looked at
         for rule2 in remove_rules:
-            rule2 = rule2.split(" ")
-            for character in self._actors:
-                object = self.get_character(rule2[0])
-                if object is not None:
-                    if isinstance(character, object):
-                        self.deforce_rule(character, rule2[1])
-
-        for rule in rules:
-            rule = rule.split(" ")
-            for character in self._actors:
-                object = self.get_character(rule[0])
-                if object is not None:
-                    if isinstance(character, object):
-                        self.enforce_rule(character, rule[1])
+            subject, attribute = rule2.split(" ")
+            object = self.get_character(subject)
+            if object is not None:
+                for character in self._board.get_type(object):
+                    self.deforce_rule(character, attribute)
+
+        for rule in enforce_rules:
+            subject, attribute = rule.split(" ")
+            object = self.get_character(subject)
+            if object is not None:
+                for character in self._board.get_type(object):
+                    self.enforce_rule(character, attribute)
 
         self._rules = rules
+        if self.player is not player:
+            # The player is drawn on top of the other actors
+            for ar in (player, self.player):
+                if ar is not None:
+                    self._redraw_cells.add((ar.x, ar.y))
+        if self.compact_state is not None:
+            self.compact_state.set_rules(rules, self.player)
 
         return
 
+    def _touched_is(self) -> List[actor.Is]:
+        """
+        Return the "Is" tiles that stand on a changed cell or next to one.
+        """
+        touched = []
+        for x, y in self._dirty_cells:
+            for cell in ((x, y), (x - 1, y), (x + 1, y), (x, y - 1),
+                         (x, y + 1)):
+                for ar in self._board.get_all(*cell):
+                    if isinstance(ar, actor.Is) and ar not in touched:
+                        touched.append(ar)
+        return touched
+
+    def _affected_rules(self, rules: List[str],
+                        remove_rules: List[str]) -> List[str]:
+        """
+        Return the rules in <rules> that must be put into effect again after
+        <remove_rules> are taken out of effect, i.e. the rules of every subject
+        whose rules changed. Since "isYou" decides who the player is, every
+        "isYou" rule is put into effect again if any of them is affected.
+        """
+        changed = remove_rules + [r for r in rules if r not in self._rules]
+        subjects = {r.split(" ")[0] for r in changed}
+        you = any(r.split(" ")[0] in subjects and r.split(" ")[1] == "isYou"
+                  for r in rules + remove_rules)
+        return [r for r in rules if r.split(" ")[0] in subjects
+                or (you and r.split(" ")[1] == "isYou")]
+
     def deforce_rule(self, character: Optional[type], rule: str) -> None:
         """ Takes rules out of effect
         """
+        flags = character.get_flags()
         if rule == 'isYou':
             self.player = None
         if rule == "isPush":
@@ -263,11 +562,14 @@ class Game:
             character.unset_win()
         if rule == "isLose":
             character.unset_lose()
+        if character.get_flags() != flags:
+            self._history.record_flags(character, flags)
         return
 
     def enforce_rule(self, character: Optional[type], rule: str) -> None:
         """ Puts all the rules into effect
         """
+        flags = character.get_flags()
         if rule == "isYou":
             self.player = character
             character.set_player()
@@ -283,6 +585,8 @@ class Game:
             character.set_win()
         if rule == "isLose":
             character.set_lose()
+        if character.get_flags() != flags:
+            self._history.record_flags(character, flags)
         return
 
     @staticmethod
@@ -329,18 +633,111 @@ class Game:
 
     def _undo(self) -> None:
         """
-        Returns the game to a previous state based on what is at the top of the
-        _history stack.
+        Returns the game to its state before the last move recorded in the
+        _history journal. Does nothing if there is no move to undo.
         """
-        game = self._history.pop()
-        self._is = game.get_is()
-        self.player = game.player
-        self._actors = game.get_actors()
-        self._rules = game.get_rules()
-        self._running = game.get_running()
-        self.keys_pressed = game.keys_pressed
+        if not self._history.is_empty():
+            self._history.undo(self)
         return
 
+    def _redo(self) -> None:
+        """
+        Plays again the last move undone, if no other move was made since.
+        Does nothing if there is no move to redo.
+        """
+        if self._history.can_redo(self):
+            self._history.redo(self)
+
+    def begin_trial(self) -> Trail:
+        """
+        Start a trial and return its Trail: the changes made to the game until
+        end_trial are recorded so that end_trial can take them back without
+        rebuilding the board or reading every rule again, e.g. to try each
+        move from a state in a search. The rules must be up to date, and the
+        undo history records nothing in the meantime.
+        """
+        self._history = Trail(self._history, self._rules, self._is_rules,
+                              self._is, self.player, self._running)
+        return self._history
+
+    def keep_trial(self) -> None:
+        """
+        End the trial begun by begin_trial, keeping its changes.
+        """
+        trail = self._history
+        assert isinstance(trail, Trail)
+        self._history = trail.journal
+
+    def end_trial(self) -> None:
+        """
+        Return the game to its state when begin_trial was called.
+        """
+        trail = self._history
+        assert isinstance(trail, Trail)
+        self._history = trail.journal
+        for actor_, flags in reversed(trail.flags):
+            actor_.set_flags(flags)
+        if trail.removed:
+            # A removed actor is put back in its place in the board order
+            for actor_, x, y in reversed(trail.moves):
+                actor_.x, actor_.y = x, y
+            for index, actor_ in reversed(trail.removed):
+                self._actors.insert(index, actor_)
+            self._board.rebuild(self._actors)
+        else:
+            for actor_, x, y in reversed(trail.moves):
+                self._board.move(actor_, x, y)
+        for ar, sprite, colour in trail.is_blocks:
+            ar.sprite, ar.colour = sprite, colour
+        self._is = [ar for ar, _, _ in trail.is_blocks]
+        self._is_rules = trail.is_rules
+        self._rules = trail.rules
+        self.player = trail.player
+        self._running = trail.running
+        self._dirty_cells = set()
+        self._rules_stale = False
+        self._redraw_all = True
+        if self.compact_state is not None:
+            self.track_state()
+
+    def snapshot(self) -> tuple:
+        """
+        Return a snapshot of the state of the game: its actors with their
+        positions and flags, its rules, its player and whether it is running.
+        The snapshot can be given to restore() to return to this state.
+        """
+        states = tuple((ac.x, ac.y, ac.get_flags()) for ac in self._actors)
+        return (tuple(self._actors), states, tuple(self._rules), self.player,
+                self._running)
+
+    def restore(self, snapshot: tuple) -> None:
+        """
+        Return the game to the state of a snapshot taken by snapshot().
+        """
+        actors, states, rules, player, running = snapshot
+        for ac, (x, y, flags) in zip(actors, states):
+            ac.x, ac.y = x, y
+            ac.set_flags(flags)
+        self._actors = list(actors)
+        self.reset_state(list(rules), player, running)
+
+    def reset_state(self, rules: List[str], player: Optional[actor.Actor],
+                    running: bool) -> None:
+        """
+        Set the rules, player and running state of the game after the actors
+        were changed directly, e.g. by an undo, and rebuild the board.
+        """
+        self._rules = rules
+        self.player = player
+        self._running = running
+        self._history.forget_state()
+        self._board.rebuild(self._actors)
+        self._dirty_cells = set()
+        self._rules_stale = True
+        self._redraw_all = True
+        if self.compact_state is not None:
+            self.track_state()
+
     def _copy(self) -> 'Game':
         """
         Copies relevant attributes of the game onto a new instance of Game.
@@ -367,31 +764,70 @@ class Game:
         """
         Return the actor at the position x,y. If the slot is empty, Return None
         """
-        for ac in self._actors:
-            if ac.x == x and ac.y == y:
-                return ac
-        return None
+        return self._board.get(x, y)
+
+    def get_actors_at(self, x: int, y: int) -> List[actor.Actor]:
+        """
+        Return every actor at the position x,y, in the order of the list of
+        actors. If the slot is empty, Return an empty list
+        """
+        return self._board.get_all(x, y)
+
+    def move_actors(self, actors: List[actor.Actor], dx: int,
+                    dy: int) -> None:
+        """
+        Move each of <actors> by (dx, dy), e.g. a line of pushed actors, in
+        order.
+        """
+        for actor_ in actors:
+            self.move_actor(actor_, actor_.x + dx, actor_.y + dy)
+
+    def move_actor(self, actor_: actor.Actor, x: int, y: int) -> None:
+        """
+        Move <actor_> to the position x,y, keeping the board index in sync.
+        All changes to an actor's position must go through this method.
+        """
+        self._history.record_move(actor_, actor_.x, actor_.y, x, y)
+        self._dirty_cells.add((actor_.x, actor_.y))
+        self._dirty_cells.add((x, y))
+        self._redraw_cells.add((actor_.x, actor_.y))
+        self._redraw_cells.add((x, y))
+        if self.compact_state is not None:
+            self.compact_state.move(actor_, x, y)
+        self._board.move(actor_, x, y)
+
+    def track_state(self) -> Any:
+        """
+        Start keeping a state.CompactState of the game up to date with every
+        move, so that its hash is always current, and return it.
+        """
+        from state import CompactState
+        self.compact_state = CompactState.from_game(self)
+        return self.compact_state
 
     def win(self) -> None:
         """
-        End the game and print win message.
+        End the game and print win message if the game is verbose.
         """
         self._running = False
-        print("Congratulations, you won!")
+        if self.compact_state is not None:
+            self.compact_state.running = False
+        if self.verbose:
+            print("Congratulations, you won!")
 
     def lose(self, char: actor.Character) -> None:
         """
-        Lose the game and print lose message
+        Lose the game and print lose message if the game is verbose
         """
         self.remove_player(char)
-        print("You lost! But you can have it undone if undo is done :)")
+        if self.verbose:
+            print("You lost! But you can have it undone if undo is done :)")
 
 
 if __name__ == "__main__":
-    game = Game()
-    # load_map public function
-    game.load_map(MAP_PATH)
-    game.new()
+    # Loaded through the map cache, or as text if it cannot be compiled
+    from mapcache import load_game
+    game = load_game(MAP_PATH)
     game.run()
 
     # import python_ta
@@ -0,0 +1,974 @@
+"""
+The undo history of the game, recording only what each move changed.
+"""
+import struct
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from settings import HISTORY_KEYFRAME_INTERVAL, HISTORY_MAX_BYTES, \
+    HISTORY_RAM_STEPS, HISTORY_SEGMENT_STEPS, HISTORY_SPILL_DIR
+from spill import SpillFile
+from stack import EmptyStackError
+
+# Size in bytes of one reference stored in a list
+_SLOT = 8
+
+# Estimated size in bytes of a Delta without any changes recorded: the object,
+# its attributes and its three empty lists
+_EMPTY_DELTA = 600
+
+# Estimated size in bytes of a Node with one move stored
+_NODE = 400
+
+# The encoding of a step written to the spill file: a header (source and
+# target hashes, player and running state before and after, whether it is a
+# keyframe, numbers of rules, moves, flag changes and removals), the rules as
+# numbers of strings, then its moves, flag changes (flags as bits) and
+# removals, and for a keyframe the state of every actor. Actors are written
+# as the number given to them when they were first hashed.
+_STEP = struct.Struct("<qqii???HHIII")
+_MOVE = struct.Struct("<IHHHH")
+_FLAGS = struct.Struct("<IBBB")
+_REMOVAL = struct.Struct("<II")
+_KEYFRAME = struct.Struct("<Ii?H")
+_STATE = struct.Struct("<IHHBB")
+
+# The flags converted by _bits and _flags, as there are only a few distinct
+# ones
+_BITS: Dict[Tuple[bool, ...], int] = {}
+_FLAG_TUPLES: Dict[Tuple[int, int], Tuple[bool, ...]] = {}
+
+
+class Delta:
+    """
+    The changes made to the game from the start of one move until the start of
+    the next one, i.e. a move from one state of the history to another.
+
+    === Public Attributes ===
+    rules:
+        The rules of the game when the move started
+    player:
+        The player when the move started
+    running:
+        Whether the game was running when the move started
+    after:
+        (rules, player, running) when the next move started, or None if the
+        move is not finished yet
+    moves:
+        (actor, old_x, old_y, new_x, new_y) for every move of an actor, in the
+        order they happened
+    flags:
+        (actor, old_flags, new_flags) for every change to the flags of an
+        actor, in the order they happened
+    removed:
+        (index, actor) for every actor removed from the list of actors
+    keyframe:
+        A full snapshot of the game when the move started (see
+        Game.snapshot), or None if this is not a keyframe
+    source:
+        The hash of the state the move started from
+    target:
+        The hash of the state the move ended in, or None if the move is not
+        finished yet
+    refs:
+        The number of undo and redo steps going through this move
+    nbytes:
+        Estimated memory used by this delta
+    """
+    rules: List[str]
+    player: Optional[Any]
+    running: bool
+    after: Optional[Tuple[List[str], Optional[Any], bool]]
+    moves: List[Tuple[Any, int, int, int, int]]
+    flags: List[Tuple[Any, Tuple[bool, ...], Tuple[bool, ...]]]
+    removed: List[Tuple[int, Any]]
+    keyframe: Optional[tuple]
+    source: Optional[int]
+    target: Optional[int]
+    refs: int
+    nbytes: int
+
+    def __init__(self, rules: List[str], player: Optional[Any],
+                 running: bool) -> None:
+        """
+        Initialize a delta for a move starting with the given state.
+        """
+        self.rules = rules
+        self.player = player
+        self.running = running
+        self.after = None
+        self.moves = []
+        self.flags = []
+        self.removed = []
+        self.keyframe = None
+        self.source = None
+        self.target = None
+        self.refs = 0
+        self.nbytes = _EMPTY_DELTA
+
+    def absorb(self, other: 'Delta') -> None:
+        """
+        Append the changes of <other>, which happened after those of self.
+        """
+        self.moves.extend(other.moves)
+        self.flags.extend(other.flags)
+        self.removed.extend(other.removed)
+        self.nbytes += other.nbytes - _EMPTY_DELTA
+        if other.keyframe is not None:
+            self.nbytes -= _snapshot_size(other.keyframe)
+
+    def copy(self) -> 'Delta':
+        """
+        Return an unfinished copy of this delta, sharing its keyframe.
+        """
+        other = Delta(self.rules, self.player, self.running)
+        other.moves = list(self.moves)
+        other.flags = list(self.flags)
+        other.removed = list(self.removed)
+        other.keyframe = self.keyframe
+        other.source = self.source
+        other.nbytes = self.nbytes
+        return other
+
+    def apply(self, game_: Any) -> None:
+        """
+        Make the changes of this finished move again in <game_>, which is in
+        the state the move started from.
+        """
+        for actor_, _, _, x, y in self.moves:
+            actor_.x, actor_.y = x, y
+        for actor_, _, flags in self.flags:
+            actor_.set_flags(flags)
+        actors = game_.get_actors()
+        for index, _ in self.removed:
+            actors.pop(index)
+        rules, player, running = self.after
+        game_.reset_state(list(rules), player, running)
+
+    def revert(self, game_: Any) -> None:
+        """
+        Return <game_>, which is in the state this move ended in, to the state
+        it started from.
+        """
+        if self.keyframe is not None:
+            game_.restore(self.keyframe)
+            return
+        for actor_, flags, _ in reversed(self.flags):
+            actor_.set_flags(flags)
+        for actor_, x, y, _, _ in reversed(self.moves):
+            actor_.x, actor_.y = x, y
+        actors = game_.get_actors()
+        for index, actor_ in reversed(self.removed):
+            actors.insert(index, actor_)
+        game_.reset_state(list(self.rules), self.player, self.running)
+
+
+class Node:
+    """
+    A state of the game in the history.
+
+    === Public Attributes ===
+    key:
+        The hash of the state
+    parent:
+        The move that first reached this state, or None for the first state
+        of the history or once that move is forgotten
+    moves:
+        The moves stored from this state, by the hash of the state they reach
+    """
+    key: int
+    parent: Optional[Delta]
+    moves: Dict[int, Delta]
+
+    def __init__(self, key: int, parent: Optional[Delta]) -> None:
+        """
+        Initialize a state reached by <parent>.
+        """
+        self.key = key
+        self.parent = parent
+        self.moves = {}
+
+
+class Journal:
+    """
+    The undo history of a game: a graph of the states it went through, with
+    a Delta for each move between two of them.
+
+    === Public Attributes ===
+    keyframe_interval:
+        How many steps apart the keyframes are
+    max_bytes:
+        The estimated memory the history may use
+    ram_steps:
+        The number of undo steps kept in memory
+    segment_steps:
+        The number of undo steps written to the spill file at once
+    nbytes:
+        The estimated memory the history uses now
+    saved:
+        The estimated memory not used because steps shared a move stored
+        before
+
+    === Private Attributes ===
+    _deltas:
+        The undo steps kept in memory, oldest first; older ones are in _spill
+    _spill:
+        The undo steps written out, in segments of encoded steps
+    _redo:
+        The steps undone that can be redone, the next one last
+    _pending:
+        The move started by begin(), if it is not committed or abandoned yet
+    _committed:
+        How many steps were committed so far
+    _nodes:
+        The states of the graph, by hash, in the order they were first visited
+    _edges:
+        Every move stored in the graph, oldest first, by id
+    _loose:
+        The moves stored that no step goes through, oldest first, by id
+    _node:
+        The hash of the state the last step was finished in, or None before
+        the first move
+    _hash:
+        The hash of the actors of the game as they are now, kept up to date
+        as changes are recorded, or None if it must be computed again
+    _roster:
+        The number given to each actor hashed, by id
+    _actors:
+        The actors hashed, by number
+    _texts:
+        The rules written to the spill file, by number
+    _text_numbers:
+        The number of each rule written to the spill file
+    """
+    keyframe_interval: int
+    max_bytes: int
+    ram_steps: int
+    segment_steps: int
+    nbytes: int
+    saved: int
+    _deltas: List[Delta]
+    _spill: SpillFile
+    _redo: List[Delta]
+    _pending: Optional[Delta]
+    _committed: int
+    _nodes: Dict[int, Node]
+    _edges: Dict[int, Delta]
+    _loose: Dict[int, Delta]
+    _node: Optional[int]
+    _hash: Optional[int]
+    _roster: Dict[int, int]
+    _actors: List[Any]
+    _texts: List[str]
+    _text_numbers: Dict[str, int]
+
+    def __init__(self, keyframe_interval: int = HISTORY_KEYFRAME_INTERVAL,
+                 max_bytes: int = HISTORY_MAX_BYTES,
+                 ram_steps: int = HISTORY_RAM_STEPS,
+                 segment_steps: int = HISTORY_SEGMENT_STEPS,
+                 spill_dir: Optional[str] = HISTORY_SPILL_DIR) -> None:
+        """
+        Initialize an empty history, whose spill file will be created in
+        <spill_dir>.
+        """
+        self.keyframe_interval = keyframe_interval
+        self.max_bytes = max_bytes
+        self.ram_steps = ram_steps
+        self.segment_steps = segment_steps
+        self.nbytes = 0
+        self.saved = 0
+        self._deltas = []
+        self._spill = SpillFile(spill_dir)
+        self._redo = []
+        self._pending = None
+        self._committed = 0
+        self._nodes = {}
+        self._edges = {}
+        self._loose = {}
+        self._node = None
+        self._hash = None
+        self._roster = {}
+        self._actors = []
+        self._texts = []
+        self._text_numbers = {}
+
+    def __len__(self) -> int:
+        """
+        Return the number of undo steps in the history.
+        """
+        return len(self._deltas) + self._spill.count
+
+    def is_empty(self) -> bool:
+        """
+        Return whether there is nothing to undo.
+        """
+        return not self._deltas and not self._spill.count
+
+    def close(self) -> None:
+        """
+        Close the spill file, dropping the undo steps written to it. Call it
+        when the history is no longer used.
+        """
+        self._spill.close()
+
+    def can_redo(self, game_: Optional[Any] = None) -> bool:
+        """
+        Return whether there is a step undone to redo. If <game_> is given,
+        first note its current state as redo() does, so that the steps undone
+        are dropped if <game_> changed since.
+        """
+        if game_ is not None:
+            self._settle(game_)
+        return bool(self._redo)
+
+    def redo_depth(self) -> int:
+        """
+        Return the number of steps undone that can be redone.
+        """
+        return len(self._redo)
+
+    def last_copied(self) -> int:
+        """
+        Return how many actors the last undo step saved the state of: the
+        actors it moved or changed the flags of, and every actor if it is a
+        keyframe.
+        """
+        if not self._deltas:
+            return 0
+        delta = self._deltas[-1]
+        copied = len(delta.moves) + len(delta.flags) + len(delta.removed)
+        if delta.keyframe is not None:
+            copied += len(delta.keyframe[0])
+        return copied
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the number of states and moves stored, of steps to undo and to
+        redo and of those written to the spill file, the estimated memory used
+        and saved by sharing moves, and the size of the spill file.
+        """
+        return {"states": len(self._nodes), "moves": len(self._edges),
+                "undo": len(self), "redo": len(self._redo),
+                "spilled": self._spill.count, "nbytes": self.nbytes,
+                "saved": self.saved, "disk_bytes": self._spill.nbytes}
+
+    def report(self) -> str:
+        """
+        Return the stats of the history as one line.
+        """
+        stats = self.stats()
+        return "history: {} states, {} moves stored, {} steps to undo " \
+               "({} on disk), {} to redo, {:.1f} KiB used, {:.1f} KiB " \
+               "saved by sharing moves, {:.1f} KiB on disk".format(
+                   stats["states"], stats["moves"], stats["undo"],
+                   stats["spilled"], stats["redo"], stats["nbytes"] / 1024,
+                   stats["saved"] / 1024, stats["disk_bytes"] / 1024)
+
+    def states(self) -> List[int]:
+        """
+        Return the hashes of the states stored, in the order they were first
+        visited.
+        """
+        return list(self._nodes)
+
+    def state(self, game_: Any) -> int:
+        """
+        Return the hash of the state <game_> is in, finishing the last step.
+        It must be called between two moves, after the rules were updated.
+        """
+        self._settle(game_)
+        return self._node
+
+    def begin(self, game_: Any) -> None:
+        """
+        Start recording a move of <game_>.
+        """
+        self._settle(game_)
+        self._pending = Delta(game_.get_rules(), game_.player,
+                              game_.get_running())
+        self._pending.source = self._node
+        if self._committed % self.keyframe_interval == 0:
+            self._pending.keyframe = game_.snapshot()
+            self._pending.nbytes += _snapshot_size(self._pending.keyframe)
+
+    def commit(self) -> None:
+        """
+        Keep the move started by begin() as a new undo step. The steps undone
+        can no longer be redone.
+        """
+        delta = self._pending
+        self._pending = None
+        self._clear_redo()
+        self._deltas.append(delta)
+        self._edges[id(delta)] = delta
+        self._ref(delta, 1)
+        self.nbytes += delta.nbytes + _SLOT
+        self._committed += 1
+        if len(self._deltas) > self.ram_steps + self.segment_steps:
+            self._spill_steps(self.segment_steps)
+        self._trim()
+
+    def abandon(self) -> None:
+        """
+        Fold the changes of the move started by begin() into the last undo
+        step, so that undoing that step also undoes this move. If the move
+        changed anything, the steps undone can no longer be redone.
+        """
+        pending = self._pending
+        self._pending = None
+        if not (pending.moves or pending.flags or pending.removed):
+            return
+        # The state changed: the steps undone no longer start from it
+        self._clear_redo()
+        if not self._deltas and self._spill.count:
+            self._page_in()
+        if not self._deltas:
+            return
+        last = self._deltas[-1]
+        if last.target is not None:
+            # The move of the last step is in the graph: change a copy
+            last = last.copy()
+            self._edges[id(last)] = last
+            self.nbytes += last.nbytes
+            self._ref(self._deltas[-1], -1)
+            self._deltas[-1] = last
+            self._ref(last, 1)
+        self.nbytes -= last.nbytes
+        last.absorb(pending)
+        self.nbytes += last.nbytes
+        self._trim()
+
+    def record_move(self, actor_: Any, x: int, y: int, new_x: int,
+                    new_y: int) -> None:
+        """
+        Record that <actor_> moved from (x, y) to (new_x, new_y).
+        """
+        if self._hash is not None:
+            flags = actor_.get_flags()
+            self._hash ^= self._actor_hash(actor_, x, y, flags) \
+                ^ self._actor_hash(actor_, new_x, new_y, flags)
+        delta = self._current()
+        if delta is not None:
+            item = (actor_, x, y, new_x, new_y)
+            delta.moves.append(item)
+            self._grow(delta, sys.getsizeof(item) + _SLOT)
+
+    def record_flags(self, actor_: Any, flags: Tuple[bool, ...]) -> None:
+        """
+        Record that the flags of <actor_> were changed from <flags>.
+        """
+        new_flags = actor_.get_flags()
+        if self._hash is not None:
+            self._hash ^= self._actor_hash(actor_, actor_.x, actor_.y, flags) \
+                ^ self._actor_hash(actor_, actor_.x, actor_.y, new_flags)
+        delta = self._current()
+        if delta is not None:
+            item = (actor_, flags, new_flags)
+            delta.flags.append(item)
+            self._grow(delta, sys.getsizeof(item) + _SLOT)
+
+    def record_removal(self, index: int, actor_: Any) -> None:
+        """
+        Record that <actor_> was removed from position <index> of the list of
+        actors.
+        """
+        if self._hash is not None:
+            self._hash ^= self._actor_hash(actor_, actor_.x, actor_.y,
+                                           actor_.get_flags())
+        delta = self._current()
+        if delta is not None:
+            item = (index, actor_)
+            delta.removed.append(item)
+            self._grow(delta, sys.getsizeof(item) + _SLOT)
+
+    def forget_state(self) -> None:
+        """
+        Note that the actors of the game were changed without being recorded,
+        e.g. by Game.restore, so their hash must be computed again.
+        """
+        self._hash = None
+
+    def undo(self, game_: Any) -> None:
+        """
+        Return <game_> to the state it had at the start of the last undo step,
+        and make that step the next one to redo.
+
+        Raise an EmptyStackError if there is nothing to undo.
+        """
+        if self.is_empty():
+            raise EmptyStackError
+        self._settle(game_)
+        if not self._deltas:
+            self._page_in()
+        delta = self._deltas.pop()
+        self._redo.append(delta)
+        self._committed -= 1
+        delta.revert(game_)
+        self._arrive(game_, delta.source)
+
+    def redo(self, game_: Any) -> None:
+        """
+        Play again in <game_> the last step undone, and make it an undo step
+        again.
+
+        Raise an EmptyStackError if there is nothing to redo.
+        """
+        self._settle(game_)
+        if not self._redo:
+            raise EmptyStackError
+        delta = self._redo.pop()
+        self._deltas.append(delta)
+        self._committed += 1
+        delta.apply(game_)
+        self._arrive(game_, delta.target)
+
+    def jump(self, game_: Any, key: int) -> None:
+        """
+        Return <game_> to the state visited with the hash <key>: undo steps
+        until a state from which that state was first reached, then play the
+        moves that reached it. The steps undone can no longer be redone.
+
+        Raise a KeyError if no state with hash <key> is stored, and a
+        ValueError if it cannot be reached any more because the moves to it
+        were forgotten or written to the spill file.
+        """
+        self._settle(game_)
+        node = self._nodes[key]
+        # The moves that first reached <key>, back to a state without any
+        chain = []
+        ancestors = {key: 0}
+        while node.parent is not None and node.parent.source in self._nodes:
+            chain.append(node.parent)
+            node = self._nodes[node.parent.source]
+            ancestors[node.key] = len(chain)
+        # How many steps to undo until one of those states
+        undos, at = 0, self._node
+        while at not in ancestors:
+            if undos == len(self._deltas):
+                raise ValueError("state {:x} can no longer be reached".format(
+                    key))
+            undos += 1
+            at = self._deltas[-undos].source
+        for _ in range(undos):
+            self.undo(game_)
+        self._clear_redo()
+        for delta in reversed(chain[:ancestors[at]]):
+            delta.apply(game_)
+            self._deltas.append(delta)
+            self._ref(delta, 1)
+            self.nbytes += _SLOT
+            self._committed += 1
+            self._arrive(game_, delta.target)
+        self._trim()
+
+    def _settle(self, game_: Any) -> None:
+        """
+        Finish the last undo step if it is not finished yet, and note the
+        state of <game_> as the current state, adding it to the graph if it
+        is new.
+        """
+        key = self._key(game_)
+        delta = self._deltas[-1] if self._deltas else None
+        if delta is not None and delta.target is None:
+            delta.after = (game_.get_rules(), game_.player,
+                           game_.get_running())
+            source = self._nodes.get(delta.source)
+            shared = None if source is None else source.moves.get(key)
+            if shared is not None:
+                # This move was stored before: keep that one instead
+                self._deltas[-1] = shared
+                self._ref(shared, 1)
+                del self._edges[id(delta)]
+                self.nbytes -= delta.nbytes
+                self.saved += delta.nbytes
+            else:
+                delta.target = key
+                if source is not None:
+                    source.moves[key] = delta
+                if key not in self._nodes:
+                    self._add_node(key, delta)
+        elif key != self._node and self._node is not None:
+            # The game changed outside of a move: the steps undone no longer
+            # start from this state
+            self._clear_redo()
+        if key not in self._nodes:
+            self._add_node(key, None)
+        self._node = key
+
+    def _arrive(self, game_: Any, key: int) -> None:
+        """
+        Note that <game_> was brought to the state with the hash <key>.
+        """
+        self._node = key
+        self._hash = key ^ self._extra_hash(game_)
+
+    def _key(self, game_: Any) -> int:
+        """
+        Return the hash of the state of <game_>.
+        """
+        if self._hash is None:
+            self._hash = 0
+            for actor_ in game_.get_actors():
+                self._hash ^= self._actor_hash(actor_, actor_.x, actor_.y,
+                                               actor_.get_flags())
+        return self._hash ^ self._extra_hash(game_)
+
+    def _extra_hash(self, game_: Any) -> int:
+        """
+        Return the hash of the rules, player and running state of <game_>.
+        """
+        return hash((tuple(game_.get_rules()), self._number(game_.player),
+                     game_.get_running()))
+
+    def _actor_hash(self, actor_: Any, x: int, y: int,
+                    flags: Tuple[bool, ...]) -> int:
+        """
+        Return the hash of <actor_> at (x, y) with <flags>.
+        """
+        return hash((self._number(actor_), x, y, flags))
+
+    def _number(self, actor_: Optional[Any]) -> int:
+        """
+        Return the number of <actor_>, giving it the next one if it has none,
+        or -1 if it is None.
+        """
+        if actor_ is None:
+            return -1
+        number = self._roster.get(id(actor_))
+        if number is None:
+            number = self._roster[id(actor_)] = len(self._actors)
+            self._actors.append(actor_)
+        return number
+
+    def _add_node(self, key: int, parent: Optional[Delta]) -> None:
+        """
+        Add the state with the hash <key>, first reached by <parent>.
+        """
+        self._nodes[key] = Node(key, parent)
+        self.nbytes += _NODE
+
+    def _ref(self, delta: Delta, n: int) -> None:
+        """
+        Add <n> to the number of steps going through <delta>.
+        """
+        delta.refs += n
+        if delta.refs == 0:
+            self._loose[id(delta)] = delta
+        elif n > 0:
+            self._loose.pop(id(delta), None)
+
+    def _clear_redo(self) -> None:
+        """
+        Drop the steps undone; their moves stay in the graph.
+        """
+        for delta in self._redo:
+            self._ref(delta, -1)
+        self.nbytes -= _SLOT * len(self._redo)
+        self._redo = []
+
+    def _trim(self) -> None:
+        """
+        Forget moves until the history uses at most max_bytes, keeping at
+        least the last undo step.
+        """
+        while self.nbytes > self.max_bytes:
+            if self._loose:
+                self._forget(next(iter(self._loose.values())))
+            elif len(self._deltas) > 1:
+                self._spill_steps(min(self.segment_steps,
+                                      len(self._deltas) - 1))
+            else:
+                break
+
+    def _spill_steps(self, n: int) -> None:
+        """
+        Write the oldest <n> undo steps in memory to the spill file, and
+        forget their moves unless a later step shares them.
+        """
+        steps = self._deltas[:n]
+        del self._deltas[:n]
+        self._spill.push(b"".join(self._encode(delta) for delta in steps), n)
+        self.nbytes -= _SLOT * n
+        for delta in steps:
+            self._ref(delta, -1)
+            if delta.refs == 0:
+                self._forget(delta)
+
+    def _page_in(self) -> None:
+        """
+        Read back the last segment of undo steps written to the spill file.
+        """
+        data = self._spill.pop()
+        steps = []
+        pos = 0
+        while pos < len(data):
+            delta, pos = self._decode(data, pos)
+            self._edges[id(delta)] = delta
+            self._ref(delta, 1)
+            self.nbytes += delta.nbytes + _SLOT
+            steps.append(delta)
+        self._deltas[:0] = steps
+
+    def _encode(self, delta: Delta) -> bytes:
+        """
+        Return the finished step <delta> encoded for the spill file.
+        """
+        rules, player, running = delta.after
+        parts = [_STEP.pack(delta.source, delta.target,
+                            self._number(delta.player), self._number(player),
+                            delta.running, running, delta.keyframe is not None,
+                            len(delta.rules), len(rules), len(delta.moves),
+                            len(delta.flags), len(delta.removed)),
+                 self._encode_rules(delta.rules), self._encode_rules(rules)]
+        parts.extend(_MOVE.pack(self._number(actor_), x, y, new_x, new_y)
+                     for actor_, x, y, new_x, new_y in delta.moves)
+        parts.extend(_FLAGS.pack(self._number(actor_), len(old),
+                                 _bits(old), _bits(new))
+                     for actor_, old, new in delta.flags)
+        parts.extend(_REMOVAL.pack(index, self._number(actor_))
+                     for index, actor_ in delta.removed)
+        if delta.keyframe is not None:
+            actors, states, rules, player, running = delta.keyframe
+            parts.append(_KEYFRAME.pack(len(actors), self._number(player),
+                                        running, len(rules)))
+            parts.append(self._encode_rules(rules))
+            fields = []
+            for actor_, (x, y, flags) in zip(actors, states):
+                fields += (self._number(actor_), x, y, len(flags),
+                           _bits(flags))
+            parts.append(struct.pack("<" + _STATE.format[1:] * len(actors),
+                                     *fields))
+        return b"".join(parts)
+
+    def _decode(self, data: bytes, pos: int) -> Tuple[Delta, int]:
+        """
+        Return the step encoded in <data> at <pos> by _encode, and the
+        position after it.
+        """
+        actors = self._actors
+        source, target, player, after_player, running, after_running, \
+            keyframe, n_rules, n_after, n_moves, n_flags, n_removed = \
+            _STEP.unpack_from(data, pos)
+        pos += _STEP.size
+        rules, pos = self._decode_rules(data, pos, n_rules)
+        after, pos = self._decode_rules(data, pos, n_after)
+        delta = Delta(rules, self._actor(player), running)
+        delta.after = (after, self._actor(after_player), after_running)
+        delta.source, delta.target = source, target
+        view = memoryview(data)
+        end = pos + n_moves * _MOVE.size
+        delta.moves = [(actors[number], x, y, new_x, new_y)
+                       for number, x, y, new_x, new_y
+                       in _MOVE.iter_unpack(view[pos:end])]
+        pos, end = end, end + n_flags * _FLAGS.size
+        delta.flags = [(actors[number], _flags(old, n), _flags(new, n))
+                       for number, n, old, new
+                       in _FLAGS.iter_unpack(view[pos:end])]
+        pos, end = end, end + n_removed * _REMOVAL.size
+        delta.removed = [(index, actors[number]) for index, number
+                         in _REMOVAL.iter_unpack(view[pos:end])]
+        pos = end
+        if keyframe:
+            n_actors, player, running, n_rules = \
+                _KEYFRAME.unpack_from(data, pos)
+            rules, pos = self._decode_rules(data, pos + _KEYFRAME.size,
+                                            n_rules)
+            end = pos + n_actors * _STATE.size
+            states = [(actors[number], (x, y, _flags(bits, n)))
+                      for number, x, y, n, bits
+                      in _STATE.iter_unpack(view[pos:end])]
+            pos = end
+            delta.keyframe = (tuple(actor_ for actor_, _ in states),
+                              tuple(state for _, state in states),
+                              tuple(rules), self._actor(player), running)
+        delta.nbytes = _delta_size(delta)
+        return delta, pos
+
+    def _encode_rules(self, rules: List[str]) -> bytes:
+        """
+        Return <rules> encoded as the numbers of their strings.
+        """
+        numbers = []
+        for rule in rules:
+            number = self._text_numbers.get(rule)
+            if number is None:
+                number = self._text_numbers[rule] = len(self._texts)
+                self._texts.append(rule)
+            numbers.append(number)
+        return struct.pack("<{}H".format(len(numbers)), *numbers)
+
+    def _decode_rules(self, data: bytes, pos: int,
+                      n: int) -> Tuple[List[str], int]:
+        """
+        Return the <n> rules encoded in <data> at <pos> by _encode_rules, and
+        the position after them.
+        """
+        numbers = struct.unpack_from("<{}H".format(n), data, pos)
+        return [self._texts[number] for number in numbers], pos + 2 * n
+
+    def _actor(self, number: int) -> Optional[Any]:
+        """
+        Return the actor with the number <number>, or None if it is -1.
+        """
+        return None if number < 0 else self._actors[number]
+
+    def _forget(self, delta: Delta) -> None:
+        """
+        Remove <delta>, which no step goes through, from the graph, with the
+        states left without any move.
+        """
+        del self._edges[id(delta)]
+        del self._loose[id(delta)]
+        self.nbytes -= delta.nbytes
+        source = self._nodes.get(delta.source)
+        if source is not None and source.moves.get(delta.target) is delta:
+            del source.moves[delta.target]
+        target = self._nodes.get(delta.target)
+        if target is not None and target.parent is delta:
+            target.parent = None
+        for node in (source, target):
+            if node is not None and node.key in self._nodes \
+                    and node.parent is None and not node.moves \
+                    and node.key != self._node:
+                del self._nodes[node.key]
+                self.nbytes -= _NODE
+
+    def _current(self) -> Optional[Delta]:
+        """
+        Return the delta that changes to the game belong to, or None if there
+        is no move being recorded or unfinished.
+        """
+        if self._pending is not None:
+            return self._pending
+        if self._deltas and self._deltas[-1].target is None:
+            return self._deltas[-1]
+        return None
+
+    def _grow(self, delta: Delta, nbytes: int) -> None:
+        """
+        Add <nbytes> to the estimated size of <delta>.
+        """
+        delta.nbytes += nbytes
+        if delta is not self._pending:
+            self.nbytes += nbytes
+
+
+class Trail:
+    """
+    The changes made to a game by a trial move (see Game.begin_trial), so
+    that they can be taken back without rebuilding the game.
+
+    === Public Attributes ===
+    journal:
+        The Journal of the game, put back when the trial ends
+    rules:
+        The rules of the game when the trial began
+    is_rules:
+        A copy of the rules read by each Is block when the trial began
+    is_blocks:
+        The Is blocks of the game when the trial began, with their sprite and
+        colour
+    player:
+        The player when the trial began
+    running:
+        Whether the game was running when the trial began
+    moves:
+        (actor, old_x, old_y) for every move of an actor, in the order they
+        happened
+    flags:
+        (actor, old_flags) for every change to the flags of an actor, in the
+        order they happened
+    removed:
+        (index, actor) for every actor removed from the list of actors
+    """
+    journal: Journal
+    rules: List[str]
+    is_rules: Dict[int, Tuple[str, str]]
+    is_blocks: List[Tuple[Any, Any, str]]
+    player: Optional[Any]
+    running: bool
+    moves: List[Tuple[Any, int, int]]
+    flags: List[Tuple[Any, Tuple[bool, ...]]]
+    removed: List[Tuple[int, Any]]
+
+    def __init__(self, journal: Journal, rules: List[str],
+                 is_rules: Dict[int, Tuple[str, str]], is_blocks: List[Any],
+                 player: Optional[Any], running: bool) -> None:
+        """
+        Initialize a trail for a trial beginning in the given state.
+        """
+        self.journal = journal
+        self.rules = rules
+        self.is_rules = dict(is_rules)
+        self.is_blocks = [(ar, ar.sprite, ar.colour) for ar in is_blocks]
+        self.player = player
+        self.running = running
+        self.moves = []
+        self.flags = []
+        self.removed = []
+
+    def record_move(self, actor_: Any, x: int, y: int, new_x: int,
+                    new_y: int) -> None:
+        """
+        Record that <actor_> moved from (x, y) to (new_x, new_y).
+        """
+        self.moves.append((actor_, x, y))
+
+    def record_flags(self, actor_: Any, flags: Tuple[bool, ...]) -> None:
+        """
+        Record that the flags of <actor_> were changed from <flags>.
+        """
+        self.flags.append((actor_, flags))
+
+    def record_removal(self, index: int, actor_: Any) -> None:
+        """
+        Record that <actor_> was removed from position <index> of the list of
+        actors.
+        """
+        self.removed.append((index, actor_))
+
+
+def _delta_size(delta: Delta) -> int:
+    """
+    Return the estimated memory used by <delta>, as recorded by Journal.
+    """
+    nbytes = _EMPTY_DELTA + _SLOT * (len(delta.moves) + len(delta.flags)
+                                     + len(delta.removed))
+    nbytes += sum(sys.getsizeof(item) for item in delta.moves)
+    nbytes += sum(sys.getsizeof(item) for item in delta.flags)
+    nbytes += sum(sys.getsizeof(item) for item in delta.removed)
+    if delta.keyframe is not None:
+        nbytes += _snapshot_size(delta.keyframe)
+    return nbytes
+
+
+def _bits(flags: Tuple[bool, ...]) -> int:
+    """
+    Return <flags> as the bits of an int, the first flag lowest.
+    """
+    bits = _BITS.get(flags)
+    if bits is None:
+        bits = _BITS[flags] = sum(1 << i for i, flag in enumerate(flags)
+                                  if flag)
+    return bits
+
+
+def _flags(bits: int, n: int) -> Tuple[bool, ...]:
+    """
+    Return the <n> flags held in <bits> by _bits.
+    """
+    flags = _FLAG_TUPLES.get((bits, n))
+    if flags is None:
+        flags = _FLAG_TUPLES[bits, n] = tuple(bool(bits >> i & 1)
+                                              for i in range(n))
+    return flags
+
+
+def _snapshot_size(snapshot: tuple) -> int:
+    """
+    Return the estimated memory used by a snapshot from Game.snapshot.
+    """
+    actors, states, rules, _, _ = snapshot
+    return (sys.getsizeof(snapshot) + sys.getsizeof(actors)
+            + sys.getsizeof(states) + sys.getsizeof(rules)
+            + sum(sys.getsizeof(state) for state in states))
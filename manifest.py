@@ -0,0 +1,29 @@
+"""
+The sprites in ./sprites. Written by sprites.py, do not edit.
+"""
+SPRITES = frozenset([
+    'atlas.png',
+    'backgroundBig.png',
+    'bush.png',
+    'flag.png',
+    'flagS.png',
+    'isDarkBlue.png',
+    'isLightBlue.png',
+    'isPurple.png',
+    'lose.png',
+    'meepo.png',
+    'playerB1.png',
+    'playerB2.png',
+    'playerR1.png',
+    'playerR2.png',
+    'playerU1.png',
+    'playerU2.png',
+    'push.png',
+    'rock.png',
+    'rockS.png',
+    'stop.png',
+    'victory.png',
+    'wall.png',
+    'wallS.png',
+    'you.png',
+])
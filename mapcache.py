@@ -0,0 +1,470 @@
+"""
+Compiles map files into a binary form that loads without parsing text, and
+bundles compiled maps into level packs, e.g. python mapcache.py -h.
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, \
+    Union
+
+import actor
+from game import Game
+from settings import ATTRIBUTES, CHARACTERS, MAP_CACHE_DIR, SUBJECTS
+
+MAP_MAGIC = b"MEEPOMAP"
+PACK_MAGIC = b"MEEPOPAK"
+VERSION = 2
+
+# A compiled map is a _MAP_HEADER, one byte per cell holding the tile of the
+# map file row by row, then an _ACTOR per actor in the order Game.new creates
+# them. A level pack is a _PACK_HEADER, a _PACK_ENTRY followed by the name of
+# each map, then the compiled maps. Both are read through a memory map.
+
+# magic, version, width, height, number of actors, and size, modification
+# time in nanoseconds and sha1 of the source
+_MAP_HEADER = struct.Struct("<8sHHHIQQ20s")
+# tile, x, y
+_ACTOR = struct.Struct("<cHH")
+# magic, version, number of maps
+_PACK_HEADER = struct.Struct("<8sHI")
+# length of the name, offset and length of the compiled map
+_PACK_ENTRY = struct.Struct("<HQI")
+
+
+class CompiledMap:
+    """
+    A compiled map, read from a buffer without copying it.
+
+    === Public Attributes ===
+    width:
+        The number of columns of the map
+    height:
+        The number of rows of the map
+    source_size:
+        The size in bytes of the map file the map was compiled from
+    source_mtime:
+        The modification time in nanoseconds of that map file
+    source_hash:
+        The sha1 of that map file
+
+    === Private Attributes ===
+    _owner:
+        The memory map under the buffer, closed with the map, or None if the
+        buffer belongs to someone else
+    """
+    width: int
+    height: int
+    source_size: int
+    source_mtime: int
+    source_hash: bytes
+    _data: memoryview
+    _count: int
+    _owner: Optional[mmap.mmap]
+
+    def __init__(self, data: Union[bytes, memoryview, mmap.mmap],
+                 owner: Optional[mmap.mmap] = None) -> None:
+        """
+        Read the compiled map in <data>. If <owner> is given, it is closed
+        when the map is.
+        Raises ValueError if <data> is not a whole compiled map of this
+        version.
+        """
+        self._data = memoryview(data)
+        self._owner = owner
+        try:
+            self._check()
+        except ValueError:
+            # Let go of the buffer, so that the caller can close <owner>
+            self._data.release()
+            raise
+
+    def lines(self) -> List[str]:
+        """
+        Return the lines of the map file.
+        """
+        start = _MAP_HEADER.size
+        grid = self._data[start:start + self.width * self.height].tobytes()
+        return [grid[i:i + self.width].decode('ascii')
+                for i in range(0, len(grid), self.width)]
+
+    def tiles(self) -> Iterator[Tuple[str, int, int]]:
+        """
+        Yield (tile, x, y) for every actor of the map, in the order Game.new
+        creates them.
+        """
+        for tile, x, y in _ACTOR.iter_unpack(self._table()):
+            yield tile.decode('ascii'), x, y
+
+    def to_game(self) -> Game:
+        """
+        Return a new game of this map.
+
+        The actors are made straight from the actor table, without reading
+        the grid cell by cell as Game.new does.
+        """
+        makers = _actor_makers()
+        actors = []
+        for tile, x, y in _ACTOR.iter_unpack(self._table()):
+            make = makers.get(tile)
+            if make is not None:
+                actors.append(make(x, y))
+        game_ = Game()
+        game_.load_lines(self.lines())
+        game_.new_actors(actors)
+        return game_
+
+    def close(self) -> None:
+        """
+        Let go of the buffer, and close the memory map under it if the map
+        owns it.
+        """
+        self._data.release()
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+
+    def _table(self) -> memoryview:
+        """
+        Return the actor table of the map.
+        """
+        start = _MAP_HEADER.size + self.width * self.height
+        return self._data[start:start + self._count * _ACTOR.size]
+
+    def _check(self) -> None:
+        """
+        Read the header of the map.
+        Raises ValueError if the buffer is not a whole compiled map of this
+        version.
+        """
+        if len(self._data) < _MAP_HEADER.size:
+            raise ValueError("not a compiled map")
+        magic, version, self.width, self.height, self._count, \
+            self.source_size, self.source_mtime, self.source_hash = \
+            _MAP_HEADER.unpack_from(self._data)
+        if magic != MAP_MAGIC or version != VERSION:
+            raise ValueError("not a compiled map of version {}".format(
+                VERSION))
+        if len(self._data) < _MAP_HEADER.size + self.width * self.height \
+                + self._count * _ACTOR.size:
+            raise ValueError("compiled map is truncated")
+
+
+def _actor_makers() -> Dict[bytes, Callable[[int, int], Any]]:
+    """
+    Return a function making the actor of each tile at (x, y), by the tile
+    as it is stored in the actor table.
+    """
+    makers: Dict[bytes, Callable[[int, int], Any]] = {
+        tile.encode('ascii'): Game.get_character(name)
+        for tile, name in CHARACTERS.items()}
+    for tile, word in SUBJECTS.items():
+        makers[tile.encode('ascii')] = \
+            lambda x, y, word=word: actor.Subject(x, y, word)
+    for tile, word in ATTRIBUTES.items():
+        makers[tile.encode('ascii')] = \
+            lambda x, y, word=word: actor.Attribute(x, y, word)
+    makers[b'I'] = actor.Is
+    return makers
+
+
+class LevelPack:
+    """
+    Many compiled maps in one file, opened through a memory map.
+
+    === Public Attributes ===
+    names:
+        The names of the maps, in the order of the pack
+
+    === Private Attributes ===
+    _index:
+        Maps each name to the offset and length of its compiled map
+    """
+    names: List[str]
+    _index: Dict[str, Tuple[int, int]]
+    _file: object
+    _mmap: mmap.mmap
+
+    def __init__(self, path: str) -> None:
+        """
+        Open the level pack at <path>.
+        Raises ValueError if it is not a level pack of this version.
+        """
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.names = []
+        self._index = {}
+        try:
+            magic, version, count = _PACK_HEADER.unpack_from(self._mmap)
+            if magic != PACK_MAGIC or version != VERSION:
+                raise ValueError("{} is not a level pack of version {}".format(
+                    path, VERSION))
+            pos = _PACK_HEADER.size
+            for _ in range(count):
+                size, offset, length = _PACK_ENTRY.unpack_from(self._mmap,
+                                                               pos)
+                pos += _PACK_ENTRY.size
+                if pos + size > len(self._mmap) \
+                        or offset + length > len(self._mmap):
+                    raise ValueError("{} is truncated".format(path))
+                name = self._mmap[pos:pos + size].decode('utf-8')
+                pos += size
+                if name in self._index:
+                    raise ValueError("{} has more than one map named {}"
+                                     .format(path, name))
+                self.names.append(name)
+                self._index[name] = (offset, length)
+        except struct.error:
+            self.close()
+            raise ValueError("{} is truncated".format(path))
+        except ValueError:
+            self.close()
+            raise
+
+    def __len__(self) -> int:
+        """
+        Return the number of maps in the pack.
+        """
+        return len(self.names)
+
+    def get(self, name: Union[str, int]) -> CompiledMap:
+        """
+        Return the compiled map called <name>, or the one at index <name>.
+        Raises KeyError if there is no such map, and ValueError if it is not
+        a whole compiled map.
+        """
+        if isinstance(name, int):
+            name = self.names[name]
+        offset, length = self._index[name]
+        return CompiledMap(memoryview(self._mmap)[offset:offset + length])
+
+    def close(self) -> None:
+        """
+        Close the pack. Maps returned by get must be closed first.
+        """
+        self._mmap.close()
+        self._file.close()
+
+
+def compile_map(path: str) -> bytes:
+    """
+    Return the map file at <path> compiled.
+    Raises ValueError if the map has rows of different lengths or glyphs
+    that are not ASCII, which the grid cannot hold.
+    """
+    # Taken before the file is read, so that a change made while it is read
+    # makes the cache look stale rather than fresh
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        source = f.read()
+    try:
+        lines = [line.strip() for line in source.decode('ascii').splitlines()]
+    except UnicodeDecodeError:
+        raise ValueError("{} has glyphs that are not ASCII".format(path))
+    if not lines or len({len(line) for line in lines}) != 1:
+        raise ValueError("{} is not rectangular".format(path))
+
+    game_ = Game()
+    game_.load_lines(lines)
+    tiles = list(game_.tiles())
+    header = _MAP_HEADER.pack(MAP_MAGIC, VERSION, len(lines[0]), len(lines),
+                              len(tiles), len(source), stat.st_mtime_ns,
+                              hashlib.sha1(source).digest())
+    return header + "".join(lines).encode('ascii') + b"".join(
+        _ACTOR.pack(tile.encode('ascii'), x, y) for tile, x, y in tiles)
+
+
+def cache_path(path: str, cache_dir: str = MAP_CACHE_DIR) -> str:
+    """
+    Return where the compiled form of the map file at <path> is cached. The
+    name holds a hash of the full path, so maps with the same name in
+    different directories are cached apart.
+    """
+    full = os.path.normcase(os.path.abspath(path))
+    digest = hashlib.sha1(full.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, "{}-{}.bin".format(
+        os.path.basename(path), digest))
+
+
+def load_map(path: str, cache_dir: str = MAP_CACHE_DIR) -> CompiledMap:
+    """
+    Return the compiled form of the map file at <path>, from the cache if it
+    was compiled from the same content, otherwise compiling it and updating
+    the cache. The caller must close the map.
+
+    The map file is only read if its size or modification time changed
+    since it was compiled. If its content did not change, only the times in
+    the cache are updated.
+    """
+    stat = os.stat(path)
+    cached = cache_path(path, cache_dir)
+    compiled = _open_cached(cached)
+    if compiled is not None:
+        if (compiled.source_size, compiled.source_mtime) == \
+                (stat.st_size, stat.st_mtime_ns):
+            return compiled
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).digest()
+        if compiled.source_hash == digest:
+            data = _MAP_HEADER.pack(
+                MAP_MAGIC, VERSION, compiled.width, compiled.height,
+                compiled._count, stat.st_size, stat.st_mtime_ns, digest) \
+                + compiled._data[_MAP_HEADER.size:].tobytes()
+            compiled.close()
+            _write_cache(cached, data)
+            return CompiledMap(data)
+        compiled.close()
+    data = compile_map(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_cache(cached, data)
+    return CompiledMap(data)
+
+
+def _open_cached(cached: str) -> Optional[CompiledMap]:
+    """
+    Return the compiled map in the cache file <cached> through a memory map,
+    or None if there is no such file or it does not hold a whole compiled
+    map of this version.
+    """
+    try:
+        with open(cached, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # A missing file cannot be opened, and an empty one cannot be mapped
+        return None
+    try:
+        return CompiledMap(mapped, mapped)
+    except ValueError:
+        mapped.close()
+        return None
+
+
+def _write_cache(cached: str, data: bytes) -> None:
+    """
+    Write the compiled map <data> to the cache file <cached>.
+    """
+    # Written aside and moved into place, so that maps still open on the old
+    # file keep reading it
+    with open(cached + ".tmp", 'wb') as f:
+        f.write(data)
+    os.replace(cached + ".tmp", cached)
+
+
+def load_game(path: str, cache_dir: str = MAP_CACHE_DIR) -> Game:
+    """
+    Return a new game of the map file at <path>, loaded through the cache,
+    or read as text if the map cannot be compiled (e.g. its rows have
+    different lengths) or the cache cannot be written.
+    """
+    try:
+        compiled = load_map(path, cache_dir)
+    except (OSError, ValueError):
+        game_ = Game()
+        game_.load_map(path)
+        game_.new()
+        return game_
+    game_ = compiled.to_game()
+    compiled.close()
+    return game_
+
+
+def pack_maps(paths: List[str], dst: str) -> None:
+    """
+    Write the maps at <paths> compiled into the level pack <dst>, each
+    named after its file.
+    Raises ValueError if two of the files have the same name.
+    """
+    write_pack([(os.path.basename(path), compile_map(path))
+                for path in paths], dst)
+
+
+def write_pack(maps: List[Tuple[str, bytes]], dst: str) -> None:
+    """
+    Write the compiled maps of <maps>, given as (name, compiled map), into
+    the level pack <dst>.
+    Raises ValueError if two of the maps have the same name.
+    """
+    _check_names([name for name, _ in maps])
+    names = [name.encode('utf-8') for name, _ in maps]
+    blobs = [blob for _, blob in maps]
+    offset = _PACK_HEADER.size + sum(_PACK_ENTRY.size + len(name)
+                                     for name in names)
+    index = []
+    for name, blob in zip(names, blobs):
+        index.append(_PACK_ENTRY.pack(len(name), offset, len(blob)) + name)
+        offset += len(blob)
+    with open(dst, 'wb') as f:
+        f.write(_PACK_HEADER.pack(PACK_MAGIC, VERSION, len(maps)))
+        f.write(b"".join(index))
+        f.write(b"".join(blobs))
+
+
+def _check_names(names: List[str]) -> None:
+    """
+    Raise ValueError if a name appears more than once in <names>.
+    """
+    seen = set()
+    for name in names:
+        if name in seen:
+            raise ValueError("more than one map is named {}".format(name))
+        seen.add(name)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Compile maps into the cache, build a level pack or list one, as asked on
+    the command line. Returns 1 if a map could not be compiled, otherwise 0.
+    """
+    parser = argparse.ArgumentParser(
+        description="Compile maps and build level packs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compile_ = commands.add_parser("compile", help="fill the map cache")
+    compile_.add_argument("maps", nargs="+")
+    compile_.add_argument("--cache-dir", default=MAP_CACHE_DIR)
+    pack = commands.add_parser("pack", help="build a level pack")
+    pack.add_argument("pack")
+    pack.add_argument("maps", nargs="+")
+    listing = commands.add_parser("list", help="list a level pack")
+    listing.add_argument("pack")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        level_pack = LevelPack(args.pack)
+        for name in level_pack.names:
+            compiled = level_pack.get(name)
+            print("{}: {}x{}".format(name, compiled.width, compiled.height))
+            compiled.close()
+        level_pack.close()
+        return 0
+
+    failed = False
+    paths = []
+    blobs = []
+    for path in args.maps:
+        try:
+            if args.command == "pack":
+                blobs.append(compile_map(path))
+            else:
+                load_map(path, args.cache_dir).close()
+            paths.append(path)
+        except ValueError as e:
+            print("skipped: {}".format(e))
+            failed = True
+    if args.command == "pack":
+        try:
+            write_pack([(os.path.basename(path), blob)
+                        for path, blob in zip(paths, blobs)], args.pack)
+        except ValueError as e:
+            print("not packed: {}".format(e))
+            return 1
+        print("{} maps packed into {}".format(len(paths), args.pack))
+    else:
+        print("{} maps compiled into {}".format(len(paths), args.cache_dir))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
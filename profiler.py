@@ -0,0 +1,158 @@
+"""
+The Profiler class, which measures where the time of each tick of Game.run
+goes. It is off unless PROFILE is set in settings.py.
+"""
+import json
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List
+
+from settings import PROFILE_SAMPLES
+
+# The phases of a tick of Game.run, in the order they run
+PHASES = ["events", "update", "draw"]
+
+# The counters kept for each tick
+COUNTERS = ["get_actor", "load_image", "copied", "history"]
+
+# The percentiles of the summary
+PERCENTILES = [50, 95, 99]
+
+
+class Profiler:
+    """
+    Timings and counters of the last ticks of a game, in a ring buffer.
+
+    === Public Attributes ===
+    samples:
+        One dict per tick, oldest first, mapping each of PHASES to its time in
+        milliseconds and each of COUNTERS to its value. At most <size> ticks
+        are kept.
+
+    === Private Attributes ===
+    _sample:
+        The tick being measured
+    _last:
+        When the last phase ended, from time.perf_counter
+    _calls:
+        The number of calls counted by the wrappers since begin(), by name
+    _restore:
+        Functions that remove the wrappers installed by attach
+    """
+    samples: Deque[Dict[str, float]]
+    _sample: Dict[str, float]
+    _last: float
+    _calls: Dict[str, int]
+    _restore: List[Callable[[], None]]
+
+    def __init__(self, size: int = PROFILE_SAMPLES) -> None:
+        """
+        Initialize a profiler keeping the last <size> ticks.
+        """
+        self.samples = deque(maxlen=size)
+        self._sample = {}
+        self._last = 0.0
+        self._calls = {"get_actor": 0, "load_image": 0}
+        self._restore = []
+
+    def attach(self, game_: Any) -> None:
+        """
+        Start counting the calls to get_actor of <game_> and to
+        sprites.load_image.
+        """
+        import sprites
+        self._wrap(game_, "get_actor", "get_actor")
+        self._wrap(sprites, "load_image", "load_image")
+
+    def detach(self) -> None:
+        """
+        Stop counting calls.
+        """
+        while self._restore:
+            self._restore.pop()()
+
+    def begin(self) -> None:
+        """
+        Start measuring a tick.
+        """
+        self._sample = {}
+        for name in self._calls:
+            self._calls[name] = 0
+        self._last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        """
+        End the phase <phase> of the tick being measured.
+        """
+        now = time.perf_counter()
+        self._sample[phase] = (now - self._last) * 1000
+        self._last = now
+
+    def end(self, game_: Any, active: bool = True) -> None:
+        """
+        End the tick being measured in <game_>, and keep it if <active>.
+        """
+        if not active:
+            return
+        sample = {phase: self._sample.get(phase, 0.0) for phase in PHASES}
+        sample.update(self._calls)
+        sample["history"], sample["copied"] = game_.history_stats()
+        self.samples.append(sample)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Return the mean, maximum and PERCENTILES of each phase and counter
+        over the kept ticks.
+        """
+        report = {}
+        for name in PHASES + COUNTERS:
+            values = sorted(sample[name] for sample in self.samples)
+            if not values:
+                continue
+            stats = {"mean": sum(values) / len(values), "max": values[-1]}
+            for p in PERCENTILES:
+                stats["p{}".format(p)] = percentile(values, p)
+            report[name] = stats
+        return report
+
+    def dump(self, path: str) -> None:
+        """
+        Write the summary and the kept ticks to the JSON file at <path>.
+        """
+        with open(path, 'wt') as f:
+            json.dump({"ticks": len(self.samples), "summary": self.summary(),
+                       "samples": list(self.samples)}, f, indent=2)
+
+    def _wrap(self, owner: Any, attr: str, counter: str) -> None:
+        """
+        Replace the function <attr> of <owner> with one that counts its calls
+        in <counter>. Calls made while a counted one runs are not counted,
+        e.g. load_image loading the sprite it flips.
+        """
+        func = getattr(owner, attr)
+        calls = self._calls
+        depth = [0]
+
+        def counted(*args: Any, **kwargs: Any) -> Any:
+            if depth[0] == 0:
+                calls[counter] += 1
+            depth[0] += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                depth[0] -= 1
+
+        # A method of an instance is shadowed, a module function replaced
+        if attr in vars(owner):
+            self._restore.append(lambda: setattr(owner, attr, func))
+        else:
+            self._restore.append(lambda: delattr(owner, attr))
+        setattr(owner, attr, counted)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Return the <p>th percentile of the sorted <values>, by nearest rank.
+    """
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
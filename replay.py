@@ -0,0 +1,356 @@
+"""
+Records the key presses played in a game and replays them without a window.
+Run python replay.py record|play <recording> to record or replay a session.
+"""
+import argparse
+import base64
+import hashlib
+import re
+import sys
+import time
+from typing import List, Optional, Tuple, Union
+
+from game import REDO as REDO_INPUT, Game
+from settings import MAP_PATH, REPLAY_KEYFRAME_INTERVAL
+from solver import MOVES, load_game
+from state import CompactState
+
+# A recording is a text file:
+#     meepo-replay 1
+#     map <path of the map> <sha1 of the map file>
+#     keyframe <input> <undo depth> <redo depth> <base64 of a CompactState>
+#     ...
+#     inputs <run-length encoded inputs, e.g. R3D2ZU>
+#     final <Zobrist hash of the last state>
+# Each input is U, D, L, R (a move), Z (an undo) or Y (a redo), followed by
+# how many times in a row it was played if more than once. A keyframe holds
+# the state after its first <input> inputs.
+
+# The first line of every recording
+MAGIC = "meepo-replay 1"
+
+# The inputs standing for an undo and a redo
+UNDO = "Z"
+REDO = "Y"
+
+_SYMBOLS = {offset: move for move, offset in MOVES.items()}
+_RUN = re.compile(r"([UDLRZY])(\d*)")
+
+
+class Keyframe:
+    """
+    The state of a game after some number of inputs.
+
+    === Public Attributes ===
+    index:
+        The number of inputs played before this state
+    depth:
+        The number of moves that could be undone in this state
+    redo:
+        The number of moves undone that could be redone in this state
+    state:
+        The state itself
+    """
+    index: int
+    depth: int
+    redo: int
+    state: CompactState
+
+    def __init__(self, index: int, depth: int, state: CompactState,
+                 redo: int = 0) -> None:
+        """
+        Initialize a keyframe.
+        """
+        self.index = index
+        self.depth = depth
+        self.redo = redo
+        self.state = state
+
+
+class Recording:
+    """
+    The inputs played in a game on one map, with keyframes to seek in them.
+
+    === Public Attributes ===
+    map_path:
+        The path of the map the game was played on
+    map_hash:
+        The sha1 of the map file, to check that the map did not change
+    inputs:
+        The inputs played, one character each (see UNDO and solver.MOVES)
+    keyframes:
+        The keyframes, by increasing index
+    final:
+        The Zobrist hash of the state after the last input, or None if it is
+        not known yet
+    """
+    map_path: str
+    map_hash: str
+    inputs: List[str]
+    keyframes: List[Keyframe]
+    final: Optional[int]
+
+    def __init__(self, map_path: str, map_hash: Optional[str] = None) -> None:
+        """
+        Initialize an empty recording of a game on the map at <map_path>.
+        """
+        self.map_path = map_path
+        self.map_hash = map_hash if map_hash is not None \
+            else hash_map(map_path)
+        self.inputs = []
+        self.keyframes = []
+        self.final = None
+
+    def save(self, path: str) -> None:
+        """
+        Write this recording to the file at <path>.
+        """
+        lines = [MAGIC, "map {} {}".format(self.map_path, self.map_hash)]
+        for frame in self.keyframes:
+            data = base64.b64encode(frame.state.to_bytes()).decode('ascii')
+            lines.append("keyframe {} {} {} {}".format(
+                frame.index, frame.depth, frame.redo, data))
+        lines.append("inputs {}".format(encode(self.inputs)))
+        if self.final is not None:
+            lines.append("final {:016x}".format(self.final))
+        with open(path, 'wt') as f:
+            f.write("\n".join(lines) + "\n")
+
+    @staticmethod
+    def load(path: str) -> 'Recording':
+        """
+        Return the recording saved in the file at <path>.
+        Raises ValueError if the file is not a recording.
+        """
+        with open(path, 'rt') as f:
+            lines = [line.rstrip("\n") for line in f]
+        if not lines or lines[0] != MAGIC:
+            raise ValueError("{} is not a recording".format(path))
+        recording = None
+        for line in lines[1:]:
+            kind, _, rest = line.partition(" ")
+            if kind == "map":
+                map_path, map_hash = rest.rsplit(" ", 1)
+                recording = Recording(map_path, map_hash)
+            elif recording is None:
+                raise ValueError("{} has no map line".format(path))
+            elif kind == "keyframe":
+                # Recordings made before redo have no redo depth
+                fields = rest.split(" ")
+                index, depth, data = fields[0], fields[1], fields[-1]
+                redo = int(fields[2]) if len(fields) == 4 else 0
+                state = CompactState.from_bytes(base64.b64decode(data))
+                recording.keyframes.append(
+                    Keyframe(int(index), int(depth), state, redo))
+            elif kind == "inputs":
+                recording.inputs = decode(rest)
+            elif kind == "final":
+                recording.final = int(rest, 16)
+        if recording is None:
+            raise ValueError("{} has no map line".format(path))
+        return recording
+
+
+class Recorder:
+    """
+    Records the inputs played by a game (see Game._tick) into a Recording,
+    with a keyframe every <interval> inputs.
+
+    === Public Attributes ===
+    recording:
+        The recording being made
+    interval:
+        The number of inputs between two keyframes
+    """
+    recording: Recording
+    interval: int
+
+    def __init__(self, map_path: str,
+                 interval: int = REPLAY_KEYFRAME_INTERVAL) -> None:
+        """
+        Start recording a game on the map at <map_path>.
+        """
+        self.recording = Recording(map_path)
+        self.interval = interval
+
+    def record(self, game_: Game,
+               move: Union[None, str, Tuple[int, int]]) -> None:
+        """
+        Record that <game_> played <move>, an offset of the player, None for
+        an undo or game.REDO for a redo. Moves that go nowhere are not
+        recorded.
+        """
+        if move is None:
+            symbol = UNDO
+        elif move == REDO_INPUT:
+            symbol = REDO
+        elif move in _SYMBOLS:
+            symbol = _SYMBOLS[move]
+        else:
+            return
+        inputs = self.recording.inputs
+        inputs.append(symbol)
+        if len(inputs) % self.interval == 0:
+            depth, redo = game_.history_depth()
+            self.recording.keyframes.append(
+                Keyframe(len(inputs), depth, CompactState.from_game(game_),
+                         redo))
+
+    def finish(self, game_: Game) -> Recording:
+        """
+        Record the final state of <game_> and return the recording.
+        """
+        self.recording.final = CompactState.from_game(game_).hash
+        return self.recording
+
+
+def encode(inputs: List[str]) -> str:
+    """
+    Return <inputs> run-length encoded, e.g. R3D2ZU for RRRDDZU.
+    """
+    runs = []
+    i = 0
+    while i < len(inputs):
+        j = i
+        while j < len(inputs) and inputs[j] == inputs[i]:
+            j += 1
+        runs.append(inputs[i] if j - i == 1 else
+                    "{}{}".format(inputs[i], j - i))
+        i = j
+    return "".join(runs)
+
+
+def decode(text: str) -> List[str]:
+    """
+    Return the inputs run-length encoded as <text> by encode.
+    Raises ValueError if <text> is not valid.
+    """
+    inputs = []
+    end = 0
+    for match in _RUN.finditer(text):
+        if match.start() != end:
+            break
+        inputs.extend(match.group(1) * int(match.group(2) or 1))
+        end = match.end()
+    if end != len(text):
+        raise ValueError("invalid inputs at {!r}".format(text[end:end + 10]))
+    return inputs
+
+
+def hash_map(path: str) -> str:
+    """
+    Return the sha1 of the map file at <path>.
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def play(game_: Game, inputs: List[str], depth: int = 0,
+         redo: int = 0) -> bool:
+    """
+    Play <inputs> in <game_> the way Game.run plays key presses, stopping
+    once the game is over.
+
+    <depth> and <redo> are the number of moves that could be undone and
+    redone when <game_> was created from a keyframe, whose history <game_>
+    does not have. Returns False, without playing the rest of <inputs>, if
+    an undo or a redo reaches one of them.
+    """
+    for symbol in inputs:
+        if not game_.get_running():
+            break
+        undo_left, redo_left = game_.history_depth()
+        if symbol == UNDO and depth > 0 and undo_left == 0:
+            return False
+        if symbol == REDO and redo > 0 and redo_left == 0:
+            return False
+        game_.play_input(None if symbol == UNDO else REDO_INPUT
+                         if symbol == REDO else MOVES[symbol])
+    return True
+
+
+def seek(recording: Recording, index: Optional[int] = None) -> Game:
+    """
+    Return a new game, without a window, in the state after the first
+    <index> inputs of <recording>, or after all of them if <index> is None.
+
+    The game starts from the nearest keyframe at or before <index>, or from
+    an earlier one if an undo or a redo after it reaches further back than
+    the keyframe.
+    Raises ValueError if the map changed since the recording was made.
+    """
+    if hash_map(recording.map_path) != recording.map_hash:
+        raise ValueError("{} changed since it was recorded".format(
+            recording.map_path))
+    if index is None:
+        index = len(recording.inputs)
+    for frame in reversed(recording.keyframes):
+        if frame.index <= index:
+            game_ = frame.state.to_game()
+            game_.verbose = False
+            if play(game_, recording.inputs[frame.index:index], frame.depth,
+                    frame.redo):
+                return game_
+    game_ = load_game(recording.map_path)
+    play(game_, recording.inputs[:index])
+    return game_
+
+
+def verify(recording: Recording) -> bool:
+    """
+    Return whether replaying all of <recording> from the map ends in the
+    state it recorded. Recordings without a final state always verify.
+    """
+    game_ = load_game(recording.map_path)
+    play(game_, recording.inputs)
+    return recording.final is None \
+        or CompactState.from_game(game_).hash == recording.final
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Record a game, or replay a recording and check its final state.
+    Returns 0 on success, otherwise 1.
+    """
+    parser = argparse.ArgumentParser(
+        description="Record the key presses of a game, or replay them.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="play a game and record it")
+    record.add_argument("path", help="the recording to write")
+    record.add_argument("--map", default=MAP_PATH, help="the map to play")
+    record.add_argument("--interval", type=int,
+                        default=REPLAY_KEYFRAME_INTERVAL,
+                        help="number of inputs between two keyframes")
+    replay = commands.add_parser("play", help="replay a recording")
+    replay.add_argument("path", help="the recording to replay")
+    replay.add_argument("--seek", type=int, default=None,
+                        help="only replay up to this input and print the map")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        game_ = load_game(args.map)
+        game_.verbose = True
+        game_.recorder = Recorder(args.map, args.interval)
+        game_.run()
+        game_.recorder.finish(game_).save(args.path)
+        return 0
+
+    recording = Recording.load(args.path)
+    start = time.perf_counter()
+    if args.seek is not None:
+        game_ = seek(recording, args.seek)
+        print("\n".join(CompactState.from_game(game_).map_lines()))
+        print("state after input {} found in {:.3f}s".format(
+            min(args.seek, len(recording.inputs)),
+            time.perf_counter() - start))
+        return 0
+    ok = verify(recording)
+    seconds = time.perf_counter() - start
+    print("{} inputs replayed in {:.3f}s: {}".format(
+        len(recording.inputs), seconds,
+        "final state matches" if ok else "FINAL STATE DIFFERS"))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
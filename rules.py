@@ -0,0 +1,119 @@
+"""
+Finds the rules of a game on the grid of a CompactState with NumPy, giving
+the same rules and Is colours as Game._update.
+"""
+from typing import Any, List
+
+import numpy as np
+
+from game import Game
+from settings import ATTRIBUTES, SUBJECTS
+from state import ATTRIBUTE_CODES, EMPTY, IS_CODE, SUBJECT_CODES, \
+    CompactState
+
+# The colour of an Is block reading no, one or two rules
+COLOURS = ["Purple", "Light Blue", "Dark Blue"]
+
+# The rules found, one row per rule in the order Game._update reads them:
+# the index of the Is block among the Is blocks, whether the rule reads
+# down (else it reads right), and the tile codes of its subject and attribute
+RULE_DTYPE = np.dtype([("is_index", np.uint32), ("vertical", np.bool_),
+                       ("subject", np.uint8), ("attribute", np.uint8)])
+
+_IS_SUBJECT = np.zeros(256, dtype=np.bool_)
+_IS_SUBJECT[list(SUBJECT_CODES.values())] = True
+_IS_ATTRIBUTE = np.zeros(256, dtype=np.bool_)
+_IS_ATTRIBUTE[list(ATTRIBUTE_CODES.values())] = True
+
+
+class RuleScan:
+    """
+    The rules read by the Is blocks of a grid.
+
+    === Public Attributes ===
+    found:
+        Array of RULE_DTYPE with every Subject-Is-Attribute triple, in the
+        order Game._update reads them
+    counts:
+        uint8 array with the number of rules (0, 1 or 2) read by each Is block
+    rules:
+        The rules in effect, as Game._update sets Game._rules
+    """
+    found: np.ndarray
+    counts: np.ndarray
+    rules: List[str]
+
+    def __init__(self, found: np.ndarray, counts: np.ndarray) -> None:
+        """
+        Initialize the result of a scan from the triples found and the number
+        of rules of each Is block.
+        """
+        self.found = found
+        self.counts = counts
+        self.rules = Game.edit_rules(
+            [SUBJECTS[chr(s)] + " is" + ATTRIBUTES[chr(a)]
+             for s, a in zip(found["subject"].tolist(),
+                             found["attribute"].tolist())])
+
+    def colours(self) -> List[str]:
+        """
+        Return the colour of each Is block, as Is.colour.
+        """
+        return [COLOURS[n] for n in self.counts.tolist()]
+
+
+def scan_grid(grid: np.ndarray, is_cells: np.ndarray) -> RuleScan:
+    """
+    Return the rules read on <grid>, an array of the tile code of the first
+    actor on each cell, by Is blocks on the cells <is_cells> (y * width + x,
+    in the order of the list of actors).
+
+    The four neighbours of every Is block are read at once by shifting the
+    cells of all the Is blocks together, so the cost follows the number of
+    Is blocks rather than the size of the grid.
+    """
+    height, width = grid.shape
+    # An empty border, so that every cell has four neighbours
+    padded = np.full((height + 2, width + 2), EMPTY, dtype=np.uint8)
+    padded[1:-1, 1:-1] = grid
+    flat = padded.reshape(-1)
+    row = width + 2
+    cells = is_cells.astype(np.intp)
+    centre = cells + 2 * (cells // width) + row + 1
+    left, right = flat[centre - 1], flat[centre + 1]
+    above, below = flat[centre - row], flat[centre + row]
+
+    # Is.update returns (rule read rightwards, rule read downwards) and
+    # Game._update reads them in that order, so they are interleaved
+    rightwards = _IS_SUBJECT[left] & _IS_ATTRIBUTE[right]
+    downwards = _IS_SUBJECT[above] & _IS_ATTRIBUTE[below]
+    counts = rightwards.view(np.uint8) + downwards.view(np.uint8)
+    reads = np.empty(2 * len(cells), dtype=np.bool_)
+    reads[0::2] = rightwards
+    reads[1::2] = downwards
+    order = np.flatnonzero(reads)
+    index, vertical = order >> 1, (order & 1).astype(np.bool_)
+    found = np.empty(len(index), dtype=RULE_DTYPE)
+    found["is_index"] = index
+    found["vertical"] = vertical
+    found["subject"] = np.where(vertical, above[index], left[index])
+    found["attribute"] = np.where(vertical, below[index], right[index])
+    return RuleScan(found, counts)
+
+
+def scan(state: CompactState) -> RuleScan:
+    """
+    Return the rules read by the Is blocks of <state>.
+    """
+    return scan_grid(state.grid, state.cells[state.codes == IS_CODE])
+
+
+def scan_game(game_: Any) -> RuleScan:
+    """
+    Return the rules read by the Is blocks of <game_>, using its tracked
+    compact state if it has one.
+    """
+    state = game_.compact_state
+    if state is None:
+        state = CompactState.from_game(game_)
+    return scan(state)
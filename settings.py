@@ -19,18 +19,74 @@ YELLOW = (255, 255, 0)
 #                     SPECIFICATION                      #
 ##########################################################
 
-FPS = 10
+FPS = 60
 TITLE = "Base Game"
 TILESIZE = 35
 
+# The game logic plays at most one queued key press every 1 / LOGIC_HZ
+# seconds, and the window waits up to IDLE_WAIT_MS for an event when there is
+# nothing to do. FPS caps the number of frames drawn per second, and the
+# durations of the last FRAME_TIME_SAMPLES frames are kept
+LOGIC_HZ = 60
+IDLE_WAIT_MS = 1000
+FRAME_TIME_SAMPLES = 600
+
+# The window shows at most VIEWPORT_TILES (columns, rows) of the map, and
+# scrolls when the player comes within CAMERA_MARGIN cells of its edge (see
+# camera.py). The actors that cannot move are drawn into chunks of
+# CHUNK_TILES by CHUNK_TILES cells, of which CHUNK_CACHE_SIZE are kept
+VIEWPORT_TILES = (40, 24)
+CAMERA_MARGIN = 4
+CHUNK_TILES = 16
+CHUNK_CACHE_SIZE = 64
+
+# Re-read only the rules next to the tiles that moved since the last update
+INCREMENTAL_RULES = True
+
+# Undo history: a full snapshot of the game is kept every
+# HISTORY_KEYFRAME_INTERVAL moves. Only the last HISTORY_RAM_STEPS undo steps
+# are kept in memory; older ones are written HISTORY_SEGMENT_STEPS at a time
+# to a temporary file in HISTORY_SPILL_DIR (the system's temporary directory
+# if None), as they are once the history uses more than HISTORY_MAX_BYTES
+HISTORY_KEYFRAME_INTERVAL = 50
+HISTORY_MAX_BYTES = 16 * 1024 * 1024
+HISTORY_RAM_STEPS = 1000
+HISTORY_SEGMENT_STEPS = 200
+HISTORY_SPILL_DIR = None
+
+# Maximum number of decoded sprites kept in memory by sprites.load_image
+IMAGE_CACHE_SIZE = 64
+
 SUBJECTS = {"W": "Wall", "R": "Rock", "F": "Flag", "M": "Meepo"}
 ATTRIBUTES = {"P": "Push", "S": "Stop", "V": "Victory", "L": "Lose", "Y": "You"}
 CHARACTERS = {"1": "Bush", "2": "Meepo", "3": "Wall", "4": "Rock", "5": "Flag"}
 
+# Per-tick profiling of Game.run (see profiler.py): whether it is on, how
+# many ticks are kept, where the report is written and the key writing it
+PROFILE = False
+PROFILE_SAMPLES = 1000
+PROFILE_PATH = "profile.json"
+PROFILE_KEY = "f9"
+
+# Number of inputs between two keyframes of a recording (see replay.py)
+REPLAY_KEYFRAME_INTERVAL = 100
+
+# Where compiled maps are cached (see mapcache.py)
+MAP_CACHE_DIR = ".mapcache"
+
+# Default limits of the solver (see solver.py)
+SOLVER_MAX_NODES = 1000000
+SOLVER_MAX_SECONDS = 60
+SOLVER_MAX_BYTES = 512 * 1024 * 1024
+
 BASE_DIR = "."
 SPRITES_DIR = "{}/sprites".format(BASE_DIR)
 MAP_PATH = "{}/maps/map.txt".format(BASE_DIR)
 
+# The texture atlas of the tiles and its index (see sprites.py)
+ATLAS_IMAGE = "{}/atlas.png".format(SPRITES_DIR)
+ATLAS_INDEX = "{}/atlas.json".format(SPRITES_DIR)
+
 # Actors' sprites
 PLAYER_SPRITE_R1 = "{}/playerR1.png".format(SPRITES_DIR)
 PLAYER_SPRITE_R2 = "{}/playerR2.png".format(SPRITES_DIR)
@@ -48,8 +104,15 @@ IS_PURPLE = "{}/isPurple.png".format(SPRITES_DIR)
 IS_DARK_BLUE = "{}/isDarkBlue.png".format(SPRITES_DIR)
 IS_LIGHT_BLUE = "{}/isLightBlue.png".format(SPRITES_DIR)
 
+# The sprites that exist, listed once in manifest.py by sprites.py instead of
+# looked up on disk at every import
+try:
+    from manifest import SPRITES
+except ImportError:  # manifest.py has not been written yet
+    SPRITES = frozenset(os.listdir(SPRITES_DIR))
+
 WORDS_SPRITES = {}
 for word in (list(SUBJECTS.values()) + list(ATTRIBUTES.values())):
-    filepath = "{}/{}.png".format(SPRITES_DIR, word.lower())
-    if os.path.exists(filepath):
-        WORDS_SPRITES[word.lower()] = filepath
+    filename = "{}.png".format(word.lower())
+    if filename in SPRITES:
+        WORDS_SPRITES[word.lower()] = "{}/{}".format(SPRITES_DIR, filename)
@@ -0,0 +1,345 @@
+"""
+A breadth-first search solver for the maps in maps/, playing the moves with
+the game logic itself. Run python solver.py <map> to solve a map.
+"""
+import argparse
+import sys
+import time
+from array import array
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from game import Game
+from history import Trail
+from mapcache import load_game as load_cached
+from settings import SOLVER_MAX_BYTES, SOLVER_MAX_NODES, SOLVER_MAX_SECONDS
+
+# The moves the solver tries, with their offsets
+MOVES = {"U": (0, -1), "D": (0, 1), "L": (-1, 0), "R": (1, 0)}
+
+# The value used in a state key for the position of a removed actor
+_REMOVED = 0xFFFF
+
+# Estimated size in bytes of one state stored, on top of its key: its entry
+# in the transposition table and its place in the frontier
+_ENTRY_SIZE = 200
+
+
+class SolveResult:
+    """
+    The outcome of a search.
+
+    === Public Attributes ===
+    status:
+        "solved" if a winning sequence was found, "unsolvable" if every
+        reachable state was searched without winning, or "limit" if the search
+        stopped at its node, time or memory limit
+    solution:
+        The shortest winning sequence of moves, as a string of the keys of
+        MOVES (e.g. "UUR"), or None if none was found
+    expanded:
+        The number of states whose moves were tried
+    stored:
+        The number of distinct states in the transposition table
+    seconds:
+        How long the search took
+    """
+    status: str
+    solution: Optional[str]
+    expanded: int
+    stored: int
+    seconds: float
+
+    def __init__(self, status: str, solution: Optional[str], expanded: int,
+                 stored: int, seconds: float) -> None:
+        """
+        Initialize a search result.
+        """
+        self.status = status
+        self.solution = solution
+        self.expanded = expanded
+        self.stored = stored
+        self.seconds = seconds
+
+    def rate(self) -> float:
+        """
+        Return the number of states expanded per second.
+        """
+        if self.seconds == 0:
+            return 0.0
+        return self.expanded / self.seconds
+
+    def __str__(self) -> str:
+        """
+        Return a summary of this result.
+        """
+        if self.solution is not None:
+            head = "solved in {} moves: {}".format(len(self.solution),
+                                                    self.solution)
+        else:
+            head = self.status
+        return "{}\nexpanded {} states ({} stored) in {:.2f}s, {:.0f} " \
+               "states/s".format(head, self.expanded, self.stored,
+                                 self.seconds, self.rate())
+
+
+def load_game(path: str) -> Game:
+    """
+    Return a new game of the map at <path>, loaded through the map cache,
+    that runs without a window and without printing.
+    """
+    game = load_cached(path)
+    game.verbose = False
+    return game
+
+
+def state_key(game: Game, actors: tuple) -> bytes:
+    """
+    Return a compact key identifying the state of <game>: the position of
+    each of <actors> (the actors the game started with), which one of them
+    is the player, and the flags of each.
+
+    The rules follow from the positions of the blocks, but flags can outlast
+    the rule that set them, so they are part of the key.
+    """
+    current = game.get_actors()
+    present = None
+    if len(current) != len(actors):
+        present = {id(ac) for ac in current}
+    key = array('H')
+    player = _REMOVED
+    for i, ac in enumerate(actors):
+        if present is not None and id(ac) not in present:
+            key.append(_REMOVED)
+            key.append(_REMOVED)
+        else:
+            key.append(ac.x)
+            key.append(ac.y)
+        if ac is game.player:
+            player = i
+    key.append(player)
+    return key.tobytes() + bytes(_bits(ac.get_flags()) for ac in actors)
+
+
+def enter_state(game: Game, actors: tuple, start: tuple, key: bytes) -> None:
+    """
+    Put <game> in the state of <key>, a key from state_key with <actors>,
+    starting from <start>, the snapshot of the game when it was loaded.
+
+    The actors are moved with the rules they had at the start, the rules are
+    then read again, and the flags of the key are set last.
+    """
+    values, bits = _split(key, len(actors))
+    present, states, kept = [], [], []
+    for i, (ac, (_, _, flags)) in enumerate(zip(actors, start[1])):
+        x, y = values[2 * i], values[2 * i + 1]
+        if x != _REMOVED:
+            present.append(ac)
+            states.append((x, y, flags))
+            kept.append(i)
+    game.restore((tuple(present), tuple(states), start[2], start[3],
+                  start[4]))
+    game._update()
+    for i in kept:
+        actors[i].set_flags(_flags(bits[i], len(actors[i].get_flags())))
+    player = values[-1]
+    game.player = actors[player] if player != _REMOVED else None
+
+
+def move_to_state(game: Game, actors: tuple, at: bytes, key: bytes,
+                  index: Dict[int, int]) -> bool:
+    """
+    Put <game>, which is in the state of <at>, in the state of <key> by
+    moving only the actors whose positions differ, and reading only the rules
+    next to them again. Both are keys from state_key with <actors>; <index>
+    maps id(actor) to its index in <actors>.
+
+    Returns False, without changing <game>, if an actor was removed in one
+    state and not in the other; use enter_state then.
+    """
+    n = len(actors)
+    # The x and y of an actor are compared at once, as one 32-bit value
+    old = memoryview(at)[:4 * n].cast('I')
+    new = memoryview(key)[:4 * n].cast('I')
+    changed = [i for i, (a, b) in enumerate(zip(old, new)) if a != b]
+    values, bits = _split(key, n)
+    before, before_bits = _split(at, n)
+    if any(values[2 * i] == _REMOVED or before[2 * i] == _REMOVED
+           for i in changed):
+        return False
+    # The flags to set are those that differ between the keys and those the
+    # rules changed on the way
+    trail = game.begin_trial()
+    for i in changed:
+        game.move_actor(actors[i], values[2 * i], values[2 * i + 1])
+    game._update()
+    game.keep_trial()
+    flagged = {index[id(ac)] for ac, _ in trail.flags}
+    if bits != before_bits:
+        flagged.update(i for i, (a, b) in enumerate(zip(bits, before_bits))
+                       if a != b)
+    for i in flagged:
+        if values[2 * i] != _REMOVED:
+            actors[i].set_flags(_flags(bits[i], len(actors[i].get_flags())))
+    player = values[-1]
+    game.player = actors[player] if player != _REMOVED else None
+    return True
+
+
+def child_key(game: Game, key: bytes, trail: Trail,
+              index: Dict[int, int]) -> bytes:
+    """
+    Return the state_key of <game> after a trial move recorded in <trail>
+    from the state of <key>, changing only the actors the move changed.
+    <index> maps id(actor) to its index in the actors of the keys.
+    """
+    values, bits = _split(key, len(index))
+    bits = bytearray(bits)
+    for ac, _, _ in trail.moves:
+        i = index[id(ac)]
+        values[2 * i], values[2 * i + 1] = ac.x, ac.y
+    for ac, _ in trail.flags:
+        bits[index[id(ac)]] = _bits(ac.get_flags())
+    for _, ac in trail.removed:
+        i = index[id(ac)]
+        values[2 * i] = values[2 * i + 1] = _REMOVED
+    values[-1] = _REMOVED if game.player is None \
+        else index[id(game.player)]
+    return values.tobytes() + bytes(bits)
+
+
+def solve(path: str, max_nodes: int = SOLVER_MAX_NODES,
+          max_seconds: float = SOLVER_MAX_SECONDS,
+          max_bytes: int = SOLVER_MAX_BYTES) -> SolveResult:
+    """
+    Search the map at <path> breadth-first for a shortest sequence of moves
+    that wins the game.
+
+    The search stops with status "limit" once it expanded <max_nodes> states,
+    ran for <max_seconds>, or the states it stored (their keys, transposition
+    table entries and places in the frontier) use an estimated <max_bytes>.
+    """
+    start = time.perf_counter()
+    game = load_game(path)
+    actors = tuple(game.get_actors())
+    index = {id(ac): i for i, ac in enumerate(actors)}
+    loaded = game.snapshot()
+
+    root = state_key(game, actors)
+    # Maps the key of every state seen to (key of its parent, move from it)
+    table: Dict[bytes, Tuple[Optional[bytes], str]] = {root: (None, "")}
+    nbytes = len(root) + _ENTRY_SIZE
+    frontier: Deque[bytes] = deque([root])
+    expanded = 0
+    # The key of the state the game is in
+    at = root
+
+    def result(status: str, solution: Optional[str]) -> SolveResult:
+        return SolveResult(status, solution, expanded, len(table),
+                           time.perf_counter() - start)
+
+    while frontier:
+        if expanded >= max_nodes or nbytes >= max_bytes \
+                or time.perf_counter() - start >= max_seconds:
+            return result("limit", None)
+        key = frontier.popleft()
+        expanded += 1
+        if key != at and not move_to_state(game, actors, at, key, index):
+            enter_state(game, actors, loaded, key)
+        at = key
+        for move, (dx, dy) in MOVES.items():
+            trail = game.begin_trial()
+            game.step(dx, dy, record=False)
+            won = not game.get_running()
+            child = None if won or game.player is None \
+                else child_key(game, key, trail, index)
+            game.end_trial()
+            if won:
+                return result("solved", _path(table, key) + move)
+            if child is not None and child not in table:
+                table[child] = (key, move)
+                nbytes += len(child) + _ENTRY_SIZE
+                frontier.append(child)
+    return result("unsolvable", None)
+
+
+def replay(path: str, moves: str) -> bool:
+    """
+    Return whether playing <moves> (a string of the keys of MOVES) on the map
+    at <path> wins the game.
+    """
+    game = load_game(path)
+    for move in moves:
+        game.step(*MOVES[move], record=False)
+        if not game.get_running():
+            return True
+    return False
+
+
+def _split(key: bytes, n: int) -> Tuple[array, bytes]:
+    """
+    Return the positions and player of the key <key> of <n> actors, and the
+    flags of each actor as the bits of a byte.
+    """
+    values = array('H')
+    values.frombytes(key[:4 * n + 2])
+    return values, key[4 * n + 2:]
+
+
+def _bits(flags: Tuple[bool, ...]) -> int:
+    """
+    Return <flags> as the bits of an int, the first flag lowest.
+    """
+    return sum(1 << i for i, flag in enumerate(flags) if flag)
+
+
+def _flags(bits: int, n: int) -> Tuple[bool, ...]:
+    """
+    Return the <n> flags held in <bits> by _bits.
+    """
+    return tuple(bool(bits >> i & 1) for i in range(n))
+
+
+def _path(table: Dict[bytes, Tuple[Optional[bytes], str]],
+          key: bytes) -> str:
+    """
+    Return the moves leading from the root of <table> to the state <key>.
+    """
+    moves: List[str] = []
+    while True:
+        parent, move = table[key]
+        if parent is None:
+            return "".join(reversed(moves))
+        moves.append(move)
+        key = parent
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Solve the maps given on the command line and print the results.
+    Returns 0 if every map was solved, otherwise 1.
+    """
+    parser = argparse.ArgumentParser(
+        description="Find a shortest winning sequence of moves for a map.")
+    parser.add_argument("maps", nargs="+", help="map files, e.g. maps/map.txt")
+    parser.add_argument("--max-nodes", type=int, default=SOLVER_MAX_NODES,
+                        help="stop after expanding this many states")
+    parser.add_argument("--max-seconds", type=float,
+                        default=SOLVER_MAX_SECONDS,
+                        help="stop after this many seconds")
+    parser.add_argument("--max-mb", type=float,
+                        default=SOLVER_MAX_BYTES / (1024 * 1024),
+                        help="memory budget of the states stored")
+    args = parser.parse_args(argv)
+
+    solved = True
+    for path in args.maps:
+        res = solve(path, args.max_nodes, args.max_seconds,
+                    int(args.max_mb * 1024 * 1024))
+        print("{}: {}".format(path, res))
+        solved = solved and res.solution is not None
+    return 0 if solved else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
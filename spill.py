@@ -0,0 +1,88 @@
+"""
+The SpillFile class, a stack of byte segments kept in a temporary file, where
+the undo history holds its oldest steps in long sessions.
+"""
+import mmap
+import tempfile
+from typing import Any, List, Optional, Tuple
+
+
+class SpillFile:
+    """
+    A stack of byte segments in a temporary file, which is deleted when it is
+    closed. The file is only created when the first segment is pushed.
+
+    === Public Attributes ===
+    count:
+        The total number of items in the segments, as given to push
+    nbytes:
+        The size of the file
+
+    === Private Attributes ===
+    _directory:
+        Where the file is created, or None for the system's temporary
+        directory
+    _file:
+        The temporary file, or None until the first segment is pushed
+    _segments:
+        (offset, length, number of items) of each segment, oldest first
+    """
+    count: int
+    nbytes: int
+    _directory: Optional[str]
+    _file: Optional[Any]
+    _segments: List[Tuple[int, int, int]]
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        """
+        Initialize an empty stack whose file will be created in <directory>.
+        """
+        self.count = 0
+        self.nbytes = 0
+        self._directory = directory
+        self._file = None
+        self._segments = []
+
+    def __len__(self) -> int:
+        """
+        Return the number of segments.
+        """
+        return len(self._segments)
+
+    def push(self, data: bytes, count: int) -> None:
+        """
+        Append the segment <data>, holding <count> items, to the file.
+        """
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(dir=self._directory)
+        self._file.seek(self.nbytes)
+        self._file.write(data)
+        self._file.flush()
+        self._segments.append((self.nbytes, len(data), count))
+        self.nbytes += len(data)
+        self.count += count
+
+    def pop(self) -> bytes:
+        """
+        Remove the last segment pushed from the file and return it.
+        Raises IndexError if there is none.
+        """
+        offset, length, count = self._segments.pop()
+        with mmap.mmap(self._file.fileno(), 0,
+                       access=mmap.ACCESS_READ) as view:
+            data = view[offset:offset + length]
+        self._file.truncate(offset)
+        self.nbytes = offset
+        self.count -= count
+        return data
+
+    def close(self) -> None:
+        """
+        Drop every segment and delete the file.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._segments = []
+        self.count = 0
+        self.nbytes = 0
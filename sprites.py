@@ -0,0 +1,195 @@
+"""
+Loads the images of the actors, from a texture atlas of the tiles when one
+exists. Run python sprites.py to rebuild the atlas and manifest.py.
+"""
+import json
+import math
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import pygame
+
+from settings import ATLAS_IMAGE, ATLAS_INDEX, IMAGE_CACHE_SIZE, \
+    SPRITES_DIR, TILESIZE
+
+# The version of the atlas index written by build_atlas
+ATLAS_VERSION = 1
+
+# The sprites that are not tiles, and are left out of the atlas
+NOT_TILES = {"backgroundBig.png", os.path.basename(ATLAS_IMAGE)}
+
+# The module listing the sprites, next to this one
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "manifest.py")
+
+
+def load_image(img_name: str, width: int = TILESIZE,
+               height: int = TILESIZE, flip_x: bool = False) -> pygame.Surface:
+    """
+    Return a pygame img of the PNG img_name that has been scaled according
+    to the given width and size, mirrored horizontally if <flip_x> is True.
+
+    Images are decoded from disk only once: every later call with the same
+    arguments returns the same surface from the image cache, so the returned
+    surface must not be drawn on. Images are converted to the pixel format of
+    the display if one is open. Tiles of TILESIZE are taken from the atlas
+    if it holds them.
+    """
+    key = (img_name, width, height, flip_x)
+    if key in _image_cache:
+        _image_cache.move_to_end(key)
+        return _image_cache[key]
+
+    img = None
+    if flip_x:
+        img = pygame.transform.flip(load_image(img_name, width, height),
+                                    True, False)
+    elif (width, height) == (TILESIZE, TILESIZE):
+        img = _atlas_tile(img_name)
+    if img is None:
+        img = pygame.image.load(img_name)
+        if pygame.display.get_surface() is not None:
+            img = img.convert_alpha()
+        img = pygame.transform.scale(img, (width, height))
+
+    _image_cache[key] = img
+    while len(_image_cache) > IMAGE_CACHE_SIZE:
+        _image_cache.popitem(last=False)
+    return img
+
+
+def blank_image() -> pygame.Surface:
+    """
+    Return the image of an actor without a sprite: a black tile.
+    """
+    global _blank
+    if _blank is None:
+        _blank = pygame.Surface((TILESIZE, TILESIZE))
+    return _blank
+
+
+def clear_image_cache(img_name: Optional[str] = None) -> None:
+    """
+    Drop the cached images of the PNG img_name, or every cached image (and
+    the atlas with its index) if img_name is None, so that the next load_image reads them
+    from disk again.
+    """
+    global _atlas, _atlas_index
+    if img_name is None:
+        _image_cache.clear()
+        _atlas = None
+        _atlas_index = None
+        return
+    for key in [k for k in _image_cache if k[0] == img_name]:
+        del _image_cache[key]
+
+
+def find_sprites(sprites_dir: str = SPRITES_DIR) -> List[str]:
+    """
+    Return the file names of the PNG images in <sprites_dir>, sorted.
+    """
+    return sorted(name for name in os.listdir(sprites_dir)
+                  if name.endswith(".png"))
+
+
+def write_manifest(path: str = MANIFEST_PATH,
+                   sprites_dir: str = SPRITES_DIR) -> None:
+    """
+    Write the module at <path> listing the sprites in <sprites_dir>.
+    """
+    with open(path, 'wt') as f:
+        f.write('"""\nThe sprites in {}. Written by sprites.py, do not '
+                'edit.\n"""\nSPRITES = frozenset([\n'.format(sprites_dir))
+        for name in find_sprites(sprites_dir):
+            f.write("    {!r},\n".format(name))
+        f.write("])\n")
+
+
+def build_atlas(image_path: str = ATLAS_IMAGE, index_path: str = ATLAS_INDEX,
+                sprites_dir: str = SPRITES_DIR, size: int = TILESIZE) -> None:
+    """
+    Pack every sprite of <sprites_dir> but NOT_TILES, scaled to <size>, into
+    the atlas image <image_path>, and write its index to <index_path>.
+    """
+    names = [name for name in find_sprites(sprites_dir)
+             if name not in NOT_TILES]
+    columns = max(1, math.ceil(math.sqrt(len(names))))
+    rows = max(1, math.ceil(len(names) / columns))
+    # The sprites are converted as load_image converts them for a window
+    if pygame.display.get_surface() is None:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        pygame.display.init()
+        pygame.display.set_mode((1, 1))
+    atlas = pygame.Surface((columns * size, rows * size), pygame.SRCALPHA)
+    index = {}
+    for i, name in enumerate(names):
+        x, y = (i % columns) * size, (i // columns) * size
+        img = pygame.image.load(os.path.join(sprites_dir, name))
+        img = pygame.transform.scale(img.convert_alpha(), (size, size))
+        # Taking the maximum with the empty atlas copies the pixels as they
+        # are, where blending would darken the translucent ones
+        atlas.blit(img, (x, y), special_flags=pygame.BLEND_RGBA_MAX)
+        index[name] = [x, y]
+    pygame.image.save(atlas, image_path)
+    with open(index_path, 'wt') as f:
+        json.dump({"version": ATLAS_VERSION, "tile_size": size,
+                   "sprites": index}, f, indent=2, sort_keys=True)
+
+
+def read_atlas_index(index_path: str = ATLAS_INDEX) -> Dict[str, Tuple[int,
+                                                                      int]]:
+    """
+    Return where each sprite is in the atlas, by file name, or an empty dict
+    if there is no atlas for TILESIZE.
+    """
+    try:
+        with open(index_path, 'rt') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get("version") != ATLAS_VERSION \
+            or index.get("tile_size") != TILESIZE:
+        return {}
+    return {name: (x, y) for name, (x, y) in index["sprites"].items()}
+
+
+def _atlas_tile(img_name: str) -> Optional[pygame.Surface]:
+    """
+    Return the tile of the PNG img_name from the atlas, decoding the atlas
+    if it is not yet, or None if the sprite is not in the atlas.
+    """
+    global _atlas, _atlas_index
+    if _atlas_index is None:
+        _atlas_index = read_atlas_index()
+    directory, name = os.path.split(img_name)
+    if name not in _atlas_index \
+            or os.path.normpath(directory) != os.path.normpath(SPRITES_DIR):
+        return None
+    if _atlas is None:
+        _atlas = pygame.image.load(ATLAS_IMAGE)
+        if pygame.display.get_surface() is not None:
+            _atlas = _atlas.convert_alpha()
+    x, y = _atlas_index[name]
+    return _atlas.subsurface((x, y, TILESIZE, TILESIZE))
+
+
+# Maps (img_name, width, height, flip_x) to the loaded image, least recently
+# used first
+_image_cache = OrderedDict()
+
+# The image returned by blank_image, once it is created
+_blank = None
+
+# The decoded atlas, and where each sprite is in it, once they are read
+_atlas = None
+_atlas_index = None
+
+
+if __name__ == "__main__":
+    build_atlas()
+    print("{} sprites packed into {}".format(len(read_atlas_index()),
+                                             ATLAS_IMAGE))
+    write_manifest()
+    print("{} sprites listed in {}".format(len(find_sprites()),
+                                           MANIFEST_PATH))
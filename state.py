@@ -0,0 +1,474 @@
+"""
+The CompactState class, an array-backed copy of the state of a Game that
+can be hashed in O(1) and converted back into a Game.
+"""
+import bisect
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import actor
+from settings import ATTRIBUTES, CHARACTERS, SUBJECTS
+
+# The tile code of an empty cell
+EMPTY = ord('.')
+
+# The tile code left in place of a removed actor until the arrays are
+# compacted
+REMOVED = 0
+
+# The tile code of every kind of actor, in the alphabet of the map files
+CHARACTER_CODES = {name: ord(tile) for tile, name in CHARACTERS.items()}
+SUBJECT_CODES = {word: ord(tile) for tile, word in SUBJECTS.items()}
+ATTRIBUTE_CODES = {word: ord(tile) for tile, word in ATTRIBUTES.items()}
+IS_CODE = ord('I')
+
+# The subject types, in the order of the rows of the attribute table
+SUBJECT_TYPES = list(CHARACTERS.values())
+
+# The bit of each rule attribute in the attribute table
+ATTRIBUTE_BITS = {"isYou": 1, "isPush": 2, "isStop": 4, "isVictory": 8,
+                  "isLose": 16}
+
+# The header of a state saved with to_bytes: width, height, player, running
+# and the number of actors
+_HEADER = struct.Struct('<HHi?I')
+
+_MASK = (1 << 64) - 1
+_PLAYER_TAG = 0x100
+_ATTRS_TAG = 0x200
+
+
+class CompactState:
+    """
+    The state of a game as arrays, with the actors in the order of the game's
+    list of actors so that the conversion back into a Game is lossless.
+
+    === Public Attributes ===
+    width:
+        The number of columns of the map
+    height:
+        The number of rows of the map
+    grid:
+        uint8 array of shape (height, width) holding the tile code of the first
+        actor on each cell, or EMPTY
+    codes:
+        uint8 array holding the tile code of each actor, or REMOVED
+    cells:
+        uint32 array holding the cell (y * width + x) of each actor
+    attrs:
+        uint8 array holding the bits of ATTRIBUTE_BITS in effect for each of
+        SUBJECT_TYPES
+    player:
+        The index of the player in the actors, or -1 if there is none
+    running:
+        Whether the game is still running
+    hash:
+        The Zobrist hash of the state
+
+    === Private Attributes ===
+    _index:
+        Maps id(actor) to the index of that actor, for the game being tracked
+    _occupants:
+        Maps each cell holding an actor to the indexes of its actors, in
+        order, or None until the state is first changed
+    _counts:
+        Maps (code, cell) to the number of actors with that tile code on that
+        cell, or None until the state is first changed
+    _removed:
+        The number of removed actors left in the arrays
+    """
+    width: int
+    height: int
+    grid: np.ndarray
+    codes: np.ndarray
+    cells: np.ndarray
+    attrs: np.ndarray
+    player: int
+    running: bool
+    hash: int
+    _index: Dict[int, int]
+    _occupants: Optional[Dict[int, List[int]]]
+    _counts: Optional[Dict[Tuple[int, int], int]]
+    _removed: int
+
+    def __init__(self, width: int, height: int, codes: np.ndarray,
+                 cells: np.ndarray, attrs: np.ndarray, player: int,
+                 running: bool = True) -> None:
+        """
+        Initialize a state from its arrays, computing its grid and hash.
+        """
+        self.width, self.height = width, height
+        self.codes = codes
+        self.cells = cells
+        self.attrs = attrs
+        self.player = player
+        self.running = running
+        self._index = {}
+        self._occupants = None
+        self._counts = None
+        self._removed = 0
+        self._build_grid()
+        self.hash = self._full_hash()
+
+    @staticmethod
+    def from_game(game_: Any) -> 'CompactState':
+        """
+        Return the compact state of <game_>.
+        """
+        actors = game_.get_actors()
+        width = game_.x_tiles
+        codes = np.array([tile_code(ac) for ac in actors], dtype=np.uint8)
+        cells = np.array([ac.y * width + ac.x for ac in actors],
+                         dtype=np.uint32)
+        state = CompactState(width, game_.y_tiles, codes, cells,
+                             rule_attrs(game_.get_rules()),
+                             _index_of(actors, game_.player),
+                             game_.get_running())
+        state._index = {id(ac): i for i, ac in enumerate(actors)}
+        return state
+
+    def to_game(self) -> Any:
+        """
+        Return a new Game, without a window, in this state.
+        """
+        from game import Game
+        self._compact()
+        game_ = Game()
+        game_.load_lines(self.map_lines())
+        actors = game_.get_actors()
+        for code, cell in zip(self.codes.tolist(), self.cells.tolist()):
+            actors.append(make_actor(chr(code), cell % self.width,
+                                     cell // self.width))
+        game_.reset_state([], None, self.running)
+        game_._update()
+        game_.player = actors[self.player] if self.player >= 0 else None
+        return game_
+
+    def map_lines(self) -> List[str]:
+        """
+        Return the grid as the lines of a map file.
+        """
+        return [row.tobytes().decode('ascii') for row in self.grid]
+
+    def copy(self) -> 'CompactState':
+        """
+        Return a copy of this state that is not tracking a game.
+        """
+        self._compact()
+        state = CompactState.__new__(CompactState)
+        state.width, state.height = self.width, self.height
+        state.grid = self.grid.copy()
+        state.codes = self.codes.copy()
+        state.cells = self.cells.copy()
+        state.attrs = self.attrs.copy()
+        state.player = self.player
+        state.running = self.running
+        state.hash = self.hash
+        state._index = {}
+        state._occupants = None
+        state._counts = None
+        state._removed = 0
+        return state
+
+    def to_bytes(self) -> bytes:
+        """
+        Return this state as bytes, to be read back with from_bytes.
+        """
+        self._compact()
+        return _HEADER.pack(self.width, self.height, self.player,
+                            self.running, len(self.codes)) \
+            + self.codes.tobytes() + self.cells.astype('<u4').tobytes() \
+            + self.attrs.tobytes()
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'CompactState':
+        """
+        Return the state saved as <data> by to_bytes.
+        """
+        width, height, player, running, n = _HEADER.unpack_from(data)
+        start = _HEADER.size
+        codes = np.frombuffer(data, np.uint8, n, start)
+        cells = np.frombuffer(data, '<u4', n, start + n)
+        attrs = np.frombuffer(data, np.uint8, len(SUBJECT_TYPES),
+                              start + 5 * n)
+        return CompactState(width, height, codes.copy(),
+                            cells.astype(np.uint32), attrs.copy(), player,
+                            running)
+
+    def key(self) -> bytes:
+        """
+        Return the positions, attributes and player of this state as bytes,
+        e.g. to compare two states exactly after their hashes match.
+        """
+        self._compact()
+        return self.cells.tobytes() + self.attrs.tobytes() \
+            + self.player.to_bytes(4, 'little', signed=True)
+
+    def nbytes(self) -> int:
+        """
+        Return the memory used by the arrays of this state.
+        """
+        return self.grid.nbytes + self.codes.nbytes + self.cells.nbytes \
+            + self.attrs.nbytes
+
+    def __eq__(self, other: Any) -> bool:
+        """
+        Return whether <other> is a CompactState of the same game state.
+        """
+        return isinstance(other, CompactState) and self.hash == other.hash \
+            and self.key() == other.key() and self.running == other.running
+
+    def __hash__(self) -> int:
+        """
+        Return the Zobrist hash of this state.
+        """
+        return self.hash
+
+    def move(self, actor_: Any, x: int, y: int) -> None:
+        """
+        Move the tracked <actor_> to the cell (x, y), updating the hash.
+        Does nothing if <actor_> is not tracked.
+        """
+        i = self._index.get(id(actor_))
+        if i is None:
+            return
+        code = int(self.codes[i])
+        old = int(self.cells[i])
+        new = y * self.width + x
+        # Taken off the top of the stack of its tile on <old>, put on top of
+        # the one on <new>
+        self.hash ^= _zobrist(code, old, self._take(code, old)) \
+            ^ _zobrist(code, new, self._put(code, new))
+        if self.player == i:
+            self.hash ^= _zobrist(_PLAYER_TAG, old) \
+                ^ _zobrist(_PLAYER_TAG, new)
+        self.cells[i] = new
+        self._leave(i, old)
+        self._enter(i, new)
+
+    def remove(self, actor_: Any) -> None:
+        """
+        Remove the tracked <actor_>, updating the hash.
+        Does nothing if <actor_> is not tracked.
+        """
+        i = self._index.pop(id(actor_), None)
+        if i is None:
+            return
+        old = int(self.cells[i])
+        code = int(self.codes[i])
+        self.hash ^= _zobrist(code, old, self._take(code, old))
+        if self.player == i:
+            self.hash ^= _zobrist(_PLAYER_TAG, old)
+            self.player = -1
+        self._leave(i, old)
+        self.codes[i] = REMOVED
+        self._removed += 1
+
+    def set_rules(self, rules: List[str], player: Optional[Any]) -> None:
+        """
+        Set the attribute table from <rules> and the player to the tracked
+        <player>, updating the hash.
+        """
+        attrs = rule_attrs(rules)
+        for i in np.flatnonzero(attrs != self.attrs).tolist():
+            self.hash ^= _zobrist(_ATTRS_TAG + i, int(self.attrs[i])) \
+                ^ _zobrist(_ATTRS_TAG + i, int(attrs[i]))
+        self.attrs = attrs
+        self.set_player(player)
+
+    def set_player(self, player: Optional[Any]) -> None:
+        """
+        Set the player to the tracked <player>, updating the hash.
+        """
+        index = -1 if player is None else self._index.get(id(player), -1)
+        if index == self.player:
+            return
+        if self.player >= 0:
+            self.hash ^= _zobrist(_PLAYER_TAG, int(self.cells[self.player]))
+        if index >= 0:
+            self.hash ^= _zobrist(_PLAYER_TAG, int(self.cells[index]))
+        self.player = index
+
+    def _build_grid(self) -> None:
+        """
+        Fill the grid from the cells of the actors.
+        """
+        self.grid = np.full((self.height, self.width), EMPTY, dtype=np.uint8)
+        cells, first = np.unique(self.cells, return_index=True)
+        self.grid.reshape(-1)[cells] = self.codes[first]
+
+    def _tracking(self) -> Tuple[Dict[int, List[int]],
+                                 Dict[Tuple[int, int], int]]:
+        """
+        Return the occupants of each cell and the count of each tile on each
+        cell, building them on first use.
+        """
+        if self._occupants is None:
+            self._occupants = {}
+            self._counts = {}
+            for i, (code, cell) in enumerate(zip(self.codes.tolist(),
+                                                 self.cells.tolist())):
+                if code != REMOVED:
+                    self._occupants.setdefault(cell, []).append(i)
+                    self._counts[code, cell] = \
+                        self._counts.get((code, cell), 0) + 1
+        return self._occupants, self._counts
+
+    def _take(self, code: int, cell: int) -> int:
+        """
+        Take one actor with the tile <code> off <cell> in the counts and
+        return how many are left, i.e. the occurrence of the one taken.
+        """
+        counts = self._tracking()[1]
+        left = counts[code, cell] - 1
+        if left:
+            counts[code, cell] = left
+        else:
+            del counts[code, cell]
+        return left
+
+    def _put(self, code: int, cell: int) -> int:
+        """
+        Put one actor with the tile <code> on <cell> in the counts and return
+        how many were there before, i.e. the occurrence of the one put.
+        """
+        counts = self._tracking()[1]
+        before = counts.get((code, cell), 0)
+        counts[code, cell] = before + 1
+        return before
+
+    def _leave(self, i: int, cell: int) -> None:
+        """
+        Take the actor at index <i> out of the occupants of <cell>, and set
+        the grid at <cell> to the code of its first actor left.
+        """
+        occupants = self._tracking()[0]
+        stack = occupants[cell]
+        stack.remove(i)
+        if stack:
+            code = self.codes[stack[0]]
+        else:
+            del occupants[cell]
+            code = EMPTY
+        self.grid[cell // self.width, cell % self.width] = code
+
+    def _enter(self, i: int, cell: int) -> None:
+        """
+        Put the actor at index <i> in the occupants of <cell>, in order, and
+        set the grid at <cell> to the code of its first actor.
+        """
+        stack = self._tracking()[0].setdefault(cell, [])
+        bisect.insort(stack, i)
+        self.grid[cell // self.width, cell % self.width] = \
+            self.codes[stack[0]]
+
+    def _compact(self) -> None:
+        """
+        Drop the removed actors from the arrays, renumbering the others.
+        """
+        if not self._removed:
+            return
+        keep = self.codes != REMOVED
+        renumber = np.cumsum(keep) - 1
+        self.codes = self.codes[keep]
+        self.cells = self.cells[keep]
+        self._index = {key: int(renumber[i])
+                       for key, i in self._index.items()}
+        if self.player >= 0:
+            self.player = int(renumber[self.player])
+        self._occupants = None
+        self._counts = None
+        self._removed = 0
+
+    def _full_hash(self) -> int:
+        """
+        Return the Zobrist hash of this state computed from scratch.
+        """
+        keys = np.sort((self.codes.astype(np.uint64) << np.uint64(32))
+                       | self.cells.astype(np.uint64))
+        # Number the actors with the same tile on the same cell, so that two
+        # of them do not cancel out
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        counts = np.diff(np.r_[starts, len(keys)])
+        occurrences = np.arange(len(keys)) - np.repeat(starts, counts)
+        keys |= occurrences.astype(np.uint64) << np.uint64(48)
+        h = int(np.bitwise_xor.reduce(_splitmix64(keys))) if len(keys) else 0
+        for i, bits in enumerate(self.attrs.tolist()):
+            h ^= _zobrist(_ATTRS_TAG + i, bits)
+        if self.player >= 0:
+            h ^= _zobrist(_PLAYER_TAG, int(self.cells[self.player]))
+        return h
+
+
+def tile_code(actor_: actor.Actor) -> int:
+    """
+    Return the tile code of <actor_>.
+    """
+    if isinstance(actor_, actor.Is):
+        return IS_CODE
+    if isinstance(actor_, actor.Subject):
+        return SUBJECT_CODES[actor_.word]
+    if isinstance(actor_, actor.Attribute):
+        return ATTRIBUTE_CODES[actor_.word]
+    return CHARACTER_CODES[type(actor_).__name__]
+
+
+def make_actor(tile: str, x: int, y: int) -> actor.Actor:
+    """
+    Return a new actor for the map tile <tile> at (x, y).
+    """
+    if tile.isnumeric():
+        return getattr(actor, CHARACTERS[tile])(x, y)
+    elif tile in SUBJECTS:
+        return actor.Subject(x, y, SUBJECTS[tile])
+    elif tile in ATTRIBUTES:
+        return actor.Attribute(x, y, ATTRIBUTES[tile])
+    return actor.Is(x, y)
+
+
+def rule_attrs(rules: List[str]) -> np.ndarray:
+    """
+    Return the attribute table for <rules>.
+    """
+    attrs = np.zeros(len(SUBJECT_TYPES), dtype=np.uint8)
+    for rule in rules:
+        subject, attribute = rule.split(" ")
+        if subject in SUBJECT_TYPES and attribute in ATTRIBUTE_BITS:
+            attrs[SUBJECT_TYPES.index(subject)] |= ATTRIBUTE_BITS[attribute]
+    return attrs
+
+
+def _index_of(actors: List[Any], target: Optional[Any]) -> int:
+    """
+    Return the index of <target> in <actors>, or -1 if it is not there.
+    """
+    for i, ac in enumerate(actors):
+        if ac is target:
+            return i
+    return -1
+
+
+def _zobrist(code: int, cell: int, occurrence: int = 0) -> int:
+    """
+    Return the Zobrist key of the <occurrence>th actor with the tile <code>
+    on <cell>.
+    """
+    z = (((occurrence << 48) | (code << 32) | cell) + 0x9E3779B97F4A7C15) \
+        & _MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+    return z ^ (z >> 31)
+
+
+def _splitmix64(keys: np.ndarray) -> np.ndarray:
+    """
+    Return the Zobrist keys of an array of (occurrence << 48) | (code << 32)
+    | cell values, the same as _zobrist does for one value.
+    """
+    with np.errstate(over='ignore'):
+        z = keys + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
@@ -1,3 +1,8 @@
+import subprocess
+import sys
+
+import pygame
+
 from actor import *
 from game import *
 
@@ -30,6 +35,13 @@ def setup_map(map: str) -> 'Game':
     return game
 
 
+def journal_move(game):
+    """Moves the player and records the move as an undo step"""
+    game._history.begin(game)
+    game.player.player_move(game)
+    game._history.commit()
+
+
 def set_keys(up, down, left, right, CTRL=0, Z=0):
     keys_pressed[pygame.K_UP] = up
     keys_pressed[pygame.K_DOWN] = down
@@ -196,15 +208,13 @@ def test_12_undo():
     """
     game = setup_map("student_map10.txt")
     set_keys(1, 0, 0, 0)
-    game.player.player_move(game)
-    game._history.push(game._copy())
+    journal_move(game)
     set_keys(1, 0, 0, 0)
-    game.player.player_move(game)
-    game._history.push(game._copy())
+    journal_move(game)
     set_keys(1, 0, 0, 0)
-    game.player.player_move(game)
-    game._history.push(game._copy())
-    save = game._history.pop()
+    journal_move(game)
+    game.win_or_lose()
+    assert game.player is None
     game._undo()
     assert game.player.x == 12
     assert game.player.y == 2
@@ -273,31 +283,23 @@ def test_15_undois():
     """
     game = setup_map("student_map11.txt")
     set_keys(0, 1, 0, 0)
-    game.player.player_move(game)
-    game._history.push(game._copy())
+    journal_move(game)
     set_keys(0, 1, 0, 0)
-    game.player.player_move(game)
-    game._history.push(game._copy())
+    journal_move(game)
     set_keys(0, 0, 0, 1)
-    game.player.player_move(game)
-    game._history.push(game._copy())
+    journal_move(game)
     set_keys(0, 0, 0, 1)
-    game.player.player_move(game)
-    game._history.push(game._copy())
+    journal_move(game)
     set_keys(0, 0, 0, 1)
-    game.player.player_move(game)
-    game._history.push(game._copy())
+    journal_move(game)
     set_keys(0, 0, 0, 1)
-    game.player.player_move(game)
-    game._history.push(game._copy())
+    journal_move(game)
     set_keys(1, 0, 0, 0)
-    game.player.player_move(game)
-    game._history.push(game._copy())
+    journal_move(game)
     game._update()
     block = [actor for actor in game._actors if isinstance(actor, Is)][0]
     assert block.colour == 'Light Blue'
-    game._history.pop()
-    game._history.pop()
+    game._undo()
     game._undo()
     game._update()
     block = [actor for actor in game._actors if isinstance(actor, Is)][0]
@@ -312,6 +314,689 @@ def test_16_subject_is_attribute():
     assert block.colour == 'Purple'
 
 
+def test_17_board_index():
+    """Checks to see that the board index follows the actors as they move and
+    reports every actor sharing a cell"""
+    game = setup_map("student_map9.txt")
+    flag = [actor for actor in game._actors if isinstance(actor, Flag)][0]
+    for _ in range(3):
+        set_keys(1, 0, 0, 0)
+        game.player.player_move(game)
+    assert game.get_actor(12, 4) is None
+    assert game.get_actors_at(12, 1) == [flag, game.player]
+    assert game.get_actor(12, 1) is flag
+
+
+def test_18_image_cache():
+    """Checks to see that sprites are loaded once and shared between actors
+    and their copies"""
+    from sprites import load_image, clear_image_cache
+    game = setup_map("student_map11.txt")
+    block = [actor for actor in game._actors if isinstance(actor, Is)][0]
+    assert block.image is load_image(IS_DARK_BLUE)
+    assert block.copy().image is block.image
+    assert game.player.copy().walk_left[0] is game.player.walk_left[0]
+    image = block.image
+    clear_image_cache(IS_DARK_BLUE)
+    assert load_image(IS_DARK_BLUE) is not image
+    assert block.image is load_image(IS_DARK_BLUE)
+
+
+def test_19_incremental_update():
+    """Checks to see that an update without any move leaves the Is blocks
+    alone, and that a move only re-reads the Is blocks next to it"""
+    game = setup_map("student_map2.txt")
+    block = [actor for actor in game._actors if isinstance(actor, Is)][1]
+    block.colour = "Untouched"
+    game._update()
+    assert block.colour == "Untouched"
+    set_keys(0, 0, 0, 1)
+    game.player.player_move(game)
+    game._update()
+    assert block.colour == "Light Blue"
+    assert game._rules == ["Wall isPush", "Meepo isYou"]
+
+
+def test_20_journal():
+    """Checks to see that the undo history only records what moved, and that
+    undo works through both keyframes and deltas"""
+    game = setup_map("student_map2.txt")
+    game.reset_history(Journal(keyframe_interval=2))
+    start = [(actor.x, actor.y) for actor in game._actors]
+    set_keys(0, 0, 0, 1)
+    journal_move(game)
+    game._update()
+    set_keys(0, 0, 1, 0)
+    journal_move(game)
+    game._update()
+    assert len(game._history) == 2
+    assert game._history._deltas[0].keyframe is not None
+    assert game._history._deltas[1].keyframe is None
+    assert len(game._history._deltas[1].moves) == 1
+    assert game._history.nbytes > 0
+    game._undo()
+    game._undo()
+    game._update()
+    assert [(actor.x, actor.y) for actor in game._actors] == start
+    # The steps undone are kept to be redone
+    assert game._history.redo_depth() == 2
+    assert game._rules == ["Meepo isYou"]
+
+
+def test_21_headless():
+    """Checks to see that a game can be played without pygame"""
+    script = "\n".join([
+        "import sys",
+        "from game import Game",
+        "game = Game()",
+        "game.load_map('maps/student_map9.txt')",
+        "game.new()",
+        "game._update()",
+        "for _ in range(3):",
+        "    game.step(0, -1)",
+        "assert game.get_running() is False",
+        "assert 'pygame' not in sys.modules",
+    ])
+    subprocess.run([sys.executable, "-c", script], check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def test_22_solver():
+    """Checks to see that the solver finds the shortest win, reports maps
+    that cannot be won, and tells states apart by their flags"""
+    import solver
+    result = solver.solve("maps/student_map9.txt")
+    assert result.status == "solved"
+    assert result.solution == "UUU"
+    assert solver.replay("maps/student_map9.txt", result.solution)
+    result = solver.solve("maps/student_map2.txt")
+    assert result.status == "unsolvable"
+    assert result.expanded == result.stored
+    result = solver.solve("maps/map.txt", max_nodes=10)
+    assert result.status == "limit"
+    assert result.expanded == 10
+    result = solver.solve("maps/map.txt", max_bytes=100000)
+    assert result.status == "limit"
+    assert 0 < result.stored < 150
+
+    game = solver.load_game("maps/map.txt")
+    actors = tuple(game.get_actors())
+    key = solver.state_key(game, actors)
+    game.player.unset_player()
+    assert solver.state_key(game, actors) != key
+
+
+def test_23_compact_state():
+    """Checks to see that the compact state hash follows the moves, that
+    a game converted to a compact state and back is the same game, and that
+    actors stacked on one cell do not cancel out in the hash"""
+    import numpy as np
+    from state import CompactState
+    game = setup_map("student_map11.txt")
+    state = game.track_state()
+    assert state.map_lines() == game.map_data
+    for keys in [(0, 1, 0, 0), (0, 1, 0, 0), (0, 0, 0, 1)]:
+        set_keys(*keys)
+        game.player.player_move(game)
+        game._update()
+    assert state == CompactState.from_game(game)
+    assert state.hash == CompactState.from_game(game).hash
+    copy = state.to_game()
+    assert [(type(a), a.x, a.y, a.get_flags()) for a in copy._actors] == \
+        [(type(a), a.x, a.y, a.get_flags()) for a in game._actors]
+    assert copy._rules == game._rules
+    assert CompactState.from_game(copy) == state
+    game._undo()
+    assert game.compact_state == CompactState.from_game(game)
+
+    # Two rocks on one cell do not hash as none
+    rocks = [Rock(1, 1), Rock(2, 1)]
+    stacked = CompactState(4, 3, np.array([52, 52], dtype=np.uint8),
+                           np.array([5, 6], dtype=np.uint32),
+                           np.zeros(5, dtype=np.uint8), -1)
+    stacked._index = {id(rock): i for i, rock in enumerate(rocks)}
+    stacked.move(rocks[1], 1, 1)
+    empty = CompactState(4, 3, np.array([], dtype=np.uint8),
+                         np.array([], dtype=np.uint32),
+                         np.zeros(5, dtype=np.uint8), -1)
+    assert stacked.hash != empty.hash
+    assert stacked.hash == CompactState(4, 3, stacked.codes, stacked.cells,
+                                        stacked.attrs, -1).hash
+
+    # A removed actor is left as a tombstone until the arrays are read whole
+    stacked.remove(rocks[0])
+    assert len(stacked.codes) == 2
+    assert stacked.grid[1, 1] == 52
+    assert stacked.hash == CompactState(4, 3, np.array([52], dtype=np.uint8),
+                                        np.array([5], dtype=np.uint32),
+                                        stacked.attrs, -1).hash
+    assert stacked.copy().codes.tolist() == [52]
+    assert stacked._index == {id(rocks[1]): 0}
+
+
+def test_24_redraw_cells():
+    """Checks to see that only the cells that changed are drawn again, and
+    that nothing is drawn when nothing changed"""
+    game = setup_map("student_map11.txt")
+    assert game.take_redraw()[0]
+    assert game.take_redraw() == (False, set())
+    x, y = game.player.x, game.player.y
+    game.step(0, 1)
+    redraw_all, cells = game.take_redraw()
+    assert not redraw_all
+    assert {(x, y), (x, y + 1)} <= cells
+    game._update()
+    assert game.take_redraw() == (False, set())
+    game._undo()
+    assert game.take_redraw()[0]
+
+
+def test_25_static_types():
+    """Checks to see that the actors that cannot move are told apart from the
+    ones that can, following the rules"""
+    game = setup_map("student_map2.txt")
+    assert game.static_types() == {Bush, Wall, Rock, Flag}
+    set_keys(0, 0, 0, 1)
+    game.player.player_move(game)
+    game._update()
+    assert game.static_types() == {Bush, Rock, Flag}
+    game.player = None
+    game._rules = []
+    assert game.static_types() == {Bush, Meepo, Wall, Rock, Flag}
+
+
+def test_26_queued_input():
+    """Checks to see that queued key presses are played one per tick, in
+    order, and that an undo can be queued between moves"""
+    game = setup_map("student_map11.txt")
+    x, y = game.player.x, game.player.y
+    game._inputs.extend([(1, 0), None, (0, -1)])
+    game._tick()
+    assert (game.player.x, game.player.y) == (x + 1, y)
+    assert len(game._inputs) == 2
+    game._tick()
+    assert (game.player.x, game.player.y) == (x, y)
+    game._tick()
+    assert (game.player.x, game.player.y) == (x, y - 1)
+    game._tick()
+    assert (game.player.x, game.player.y) == (x, y - 1)
+
+
+def test_27_replay(tmp_path):
+    """Checks to see that a recorded game replays to the same state, and that
+    seeking through keyframes and undos finds the state after any input"""
+    import replay
+    import solver
+    from state import CompactState
+    path = "maps/student_map2.txt"
+    game = solver.load_game(path)
+    game.recorder = replay.Recorder(path, interval=2)
+    states = [CompactState.from_game(game)]
+    for move in [(0, -1), (0, -1), None, (1, 0), None, None, (0, 1)]:
+        game._inputs.append(move)
+        game._tick()
+        states.append(CompactState.from_game(game))
+    game.recorder.finish(game).save(str(tmp_path / "session.txt"))
+    recording = replay.Recording.load(str(tmp_path / "session.txt"))
+    assert replay.encode(recording.inputs) == "U2ZRZ2D"
+    assert len(recording.keyframes) == 3
+    assert replay.verify(recording)
+    for i, state in enumerate(states):
+        assert CompactState.from_game(replay.seek(recording, i)) == state
+
+
+def test_28_benchmark():
+    """Checks to see that the generated maps have a player pushing a line of
+    rocks, and that slower timings than the baseline are flagged"""
+    import benchmark
+    game = benchmark.make_game(benchmark.make_map(20, 10, chain=5))
+    assert game._rules == ["Meepo isYou", "Rock isPush"]
+    assert (game.player.x, game.player.y) == (1, 3)
+    assert game.player.move(game, 1, 0)
+    assert [type(game.get_actor(x, 3)) for x in range(2, 8)] == \
+        [Meepo, Rock, Rock, Rock, Rock, Rock]
+    report = benchmark.run_benchmarks([(20, 10)], chain=5, repeat=2,
+                                      draw=False)
+    results = report["results"]["20x10"]
+    assert set(results) == {"actors", "actor_bytes"} | \
+        set(benchmark.OPERATIONS[:9])
+    assert results["actor_bytes"] > 0
+    baseline = {"results": {"20x10": {
+        op: {"median_us": results[op]["median_us"] / 4}
+        for op in ["move", "undo"]}}}
+    assert [(size, op) for size, op, _ in
+            benchmark.compare(report, baseline)] == \
+        [("20x10", "move"), ("20x10", "undo")]
+
+
+def test_29_profiler():
+    """Checks to see that the profiler counts the calls of a tick, keeps only
+    the last ticks, and takes the wrappers away when detached"""
+    from profiler import Profiler, percentile
+    import sprites
+    game = setup_map("student_map11.txt")
+    profiler = Profiler(size=3)
+    profiler.attach(game)
+    for _ in range(4):
+        profiler.begin()
+        game._inputs.append((1, 0))
+        profiler.lap("events")
+        game._tick()
+        profiler.lap("update")
+        profiler.end(game)
+    profiler.end(game, active=False)
+    profiler.detach()
+    assert "get_actor" not in vars(game)
+    assert len(profiler.samples) == 3
+    assert profiler.samples[-1]["get_actor"] > 0
+    assert profiler.samples[-1]["history"] == game.history_stats()[0]
+    assert profiler.samples[-1]["draw"] == 0.0
+    assert set(profiler.summary()["update"]) == {"mean", "max", "p50", "p95",
+                                                 "p99"}
+    assert percentile([1, 2, 3, 4], 50) == 2
+    sprites.clear_image_cache()
+    profiler.attach(game)
+    profiler.begin()
+    sprites.load_image("sprites/meepo.png", flip_x=True)
+    profiler.detach()
+    assert profiler._calls["load_image"] == 1
+    assert percentile([1, 2, 3, 4], 99) == 4
+
+
+def test_30_validate():
+    """Checks to see that broken maps are reported, and that the maps are
+    solved in worker processes with the results kept in order"""
+    import validate
+    assert validate.check_map("maps/student_map9.txt") == []
+    assert validate.check_map("maps/student_map6.txt") == \
+        ["no Is You rule at the start"]
+    problems = validate.check_map("maps/student_map10.txt")
+    assert len(problems) == 2
+    assert problems[0].startswith("rows have different lengths")
+    results = validate.validate(["maps/student_map9.txt",
+                                 "maps/student_map2.txt",
+                                 "maps/student_map6.txt"], max_seconds=5,
+                                jobs=2)
+    assert [r["status"] for r in results] == ["solved", "unsolvable",
+                                              "invalid"]
+    assert results[0]["moves"] == 3
+    assert "3 " in validate.format_results(results).splitlines()[1]
+
+
+def test_31_rule_scan():
+    """Checks to see that the rules found on the grid are those of the game,
+    with the same Is colours, including after moves"""
+    import rules
+    import solver
+    from state import CompactState
+    game = setup_map("student_map2.txt")
+    game.track_state()
+    scan = rules.scan_game(game)
+    assert scan.rules == game._rules
+    assert scan.colours() == [block.colour for block in game._is]
+    set_keys(0, 0, 0, 1)
+    game.player.player_move(game)
+    game._update()
+    scan = rules.scan_game(game)
+    assert scan.rules == game._rules == ["Wall isPush", "Meepo isYou"]
+    assert scan.colours() == [block.colour for block in game._is]
+    assert [(chr(row["subject"]), bool(row["vertical"]), chr(row["attribute"]))
+            for row in scan.found] == [("W", False, "P"), ("M", False, "Y")]
+    for path in ["maps/map.txt", "maps/student_map11.txt"]:
+        game = solver.load_game(path)
+        assert rules.scan(CompactState.from_game(game)).rules == game._rules
+
+
+def test_32_push_chain():
+    """Checks to see that a line of pushed rocks moves at once, longer than
+    the recursion limit, and that a blocked line does not move at all"""
+    import benchmark
+    chain = sys.getrecursionlimit() + 100
+    game = benchmark.make_game(benchmark.make_map(chain + 5, 7, 0, 0, chain))
+    rocks = [game.get_actor(x, 3) for x in range(2, chain + 2)]
+    assert game.player.move(game, 1, 0)
+    assert [rock.x for rock in rocks] == list(range(3, chain + 3))
+    assert game.player.move(game, 1, 0)
+    # A blocked push counts as a move, but nothing moves
+    assert game.player.move(game, 1, 0)
+    assert game.player.x == 3
+    assert [rock.x for rock in rocks] == list(range(4, chain + 4))
+    assert game.player.move(game, 0, -1)
+    assert game.player.move(game, -1, 0)
+    assert game.player.move(game, -1, 0)
+    assert not game.player.move(game, -1, 0)
+    assert (game.player.x, game.player.y) == (1, 2)
+
+
+def test_33_map_cache(tmp_path):
+    """Checks to see that a map loaded from its compiled form and from a
+    level pack is the same as the map read as text, that the cache is
+    rebuilt when the map file changes, and that a truncated cache or pack is
+    refused"""
+    import mmap
+    import os
+    import mapcache
+    def layout(game):
+        return [(type(a).__name__, a.x, a.y) for a in game.get_actors()]
+
+    path = tmp_path / "map.txt"
+    path.write_text(open("maps/map.txt").read())
+    text = Game()
+    text.load_map("maps/map.txt")
+    text.new()
+    cached = mapcache.load_game(str(path), str(tmp_path / "cache"))
+    assert layout(cached) == layout(text)
+    assert cached.size == text.size
+    assert cached._rules == text._rules
+    hit = mapcache.load_map(str(path), str(tmp_path / "cache"))
+    assert isinstance(hit._data.obj, mmap.mmap)
+    hit.close()
+
+    # Touched without changing: hashed once, then a hit again
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    touched = mapcache.load_map(str(path), str(tmp_path / "cache"))
+    assert touched.source_mtime == stat.st_mtime_ns + 10 ** 9
+    touched.close()
+    hit = mapcache.load_map(str(path), str(tmp_path / "cache"))
+    assert isinstance(hit._data.obj, mmap.mmap)
+    hit.close()
+
+    old = mapcache.load_map(str(path), str(tmp_path / "cache"))
+    path.write_text(open("maps/student_map1.txt").read())
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+    new = mapcache.load_map(str(path), str(tmp_path / "cache"))
+    assert (old.width, new.width) == (26, 8)
+    old.close()
+    new.close()
+
+    # A truncated cache with the right source is compiled again
+    cached = mapcache.cache_path(str(path), str(tmp_path / "cache"))
+    with open(cached, "rb") as f:
+        head = f.read(40)
+    with open(cached, "wb") as f:
+        f.write(head)
+    try:
+        mapcache.CompiledMap(head)
+        assert False, "a truncated compiled map was read"
+    except ValueError:
+        pass
+    assert layout(mapcache.load_game(str(path), str(tmp_path / "cache"))) \
+        == layout(setup_map("student_map1.txt"))
+    other = tmp_path / "other" / "map.txt"
+    other.parent.mkdir()
+    other.write_text(open("maps/map.txt").read())
+    assert mapcache.cache_path(str(other)) != mapcache.cache_path(str(path))
+
+    try:
+        mapcache.compile_map("maps/student_map10.txt")
+        assert False, "a map with rows of different lengths was compiled"
+    except ValueError:
+        pass
+
+    mapcache.pack_maps(["maps/map.txt", "maps/student_map1.txt"],
+                       str(tmp_path / "maps.pak"))
+    pack = mapcache.LevelPack(str(tmp_path / "maps.pak"))
+    assert pack.names == ["map.txt", "student_map1.txt"]
+    compiled = pack.get("map.txt")
+    assert layout(compiled.to_game()) == layout(text)
+    compiled.close()
+    compiled = pack.get(1)
+    assert compiled.lines() == [line.strip() for line in
+                                open("maps/student_map1.txt")]
+    compiled.close()
+    pack.close()
+
+    with open(tmp_path / "maps.pak", "rb") as f:
+        data = f.read()
+    (tmp_path / "short.pak").write_bytes(data[:-10])
+    try:
+        mapcache.pack_maps([str(path), str(other)], str(tmp_path / "two.pak"))
+        assert False, "two maps with the same name were packed"
+    except ValueError:
+        pass
+    try:
+        mapcache.LevelPack(str(tmp_path / "short.pak"))
+        assert False, "a truncated level pack was opened"
+    except ValueError:
+        pass
+
+
+def test_34_import_budget():
+    """Checks to see that the game logic imports quickly, without pygame,
+    NumPy or looking for sprites on disk, and that the list of sprites is up
+    to date"""
+    import manifest
+    import sprites
+    assert sorted(manifest.SPRITES) == sprites.find_sprites()
+
+    budget_ms = 250
+    script = "\n".join([
+        "import os, sys, time",
+        "exists = os.path.exists",
+        "os.path.exists = lambda path: 1 / 0",
+        "start = time.perf_counter()",
+        "import game, solver",
+        "print((time.perf_counter() - start) * 1000)",
+        "os.path.exists = exists",
+        "assert 'pygame' not in sys.modules",
+        "assert 'numpy' not in sys.modules",
+    ])
+    times = [float(subprocess.run([sys.executable, "-c", script], check=True,
+                                  capture_output=True, text=True).stdout)
+             for _ in range(3)]
+    assert min(times) < budget_ms
+
+
+def test_35_camera():
+    """Checks to see that the camera shows small maps whole, scrolls only
+    near the edge of the view, and never shows cells outside the map"""
+    from camera import Camera
+    camera = Camera(26, 19, (40, 24), 4)
+    assert (camera.width, camera.height) == (26, 19)
+    camera.centre(25, 18)
+    assert not camera.follow(0, 0)
+    assert (camera.x, camera.y) == (0, 0)
+
+    camera = Camera(2000, 2000, (40, 24), 4)
+    camera.centre(1, 1)
+    assert (camera.x, camera.y) == (0, 0)
+    assert not camera.follow(35, 19)
+    assert camera.follow(36, 19)
+    assert (camera.x, camera.y) == (1, 0)
+    assert camera.follow(36, 20)
+    assert (camera.x, camera.y) == (1, 1)
+    assert not camera.follow(5, 5)
+    assert camera.follow(4, 5)
+    assert (camera.x, camera.y) == (0, 1)
+    camera.centre(1999, 1999)
+    assert (camera.x, camera.y) == (1960, 1976)
+    assert camera.visible(1960, 1999) and not camera.visible(1959, 1999)
+    assert len(list(camera.cells())) == 40 * 24
+
+
+def test_36_cell_stack():
+    """Checks to see that a win is found on the player's cell alone, with the
+    actors of the cell stacked in the order of the list of actors"""
+    class Unscanned(list):
+        def __iter__(self):
+            raise AssertionError("the list of actors was scanned")
+
+    game = setup_map("student_map9.txt")
+    for _ in range(3):
+        set_keys(1, 0, 0, 0)
+        game.player.player_move(game)
+    stack = game.get_actors_at(game.player.x, game.player.y)
+    assert [type(ar) for ar in stack] == [Flag, Meepo]
+    assert stack == sorted(stack, key=game._actors.index)
+    game._actors = Unscanned(game._actors)
+    assert game.win_or_lose() is True
+    assert game._running is False
+
+
+def test_37_type_index():
+    """Checks to see that a rule only touches the actors of its subject, and
+    that the actors of each type are kept up to date when the player is
+    removed and brought back by an undo"""
+    import benchmark
+    game = benchmark.make_game(benchmark.make_map(30, 12, 0, 0.3, chain=5))
+    touched = []
+    enforce_rule = game.enforce_rule
+    game.enforce_rule = lambda ar, rule: (touched.append(type(ar)),
+                                          enforce_rule(ar, rule))
+    game._rules = []
+    game._rules_stale = True
+    game._update()
+    rocks = game._board.get_type(Rock)
+    assert touched == [Meepo] + [Rock] * len(rocks)
+    assert rocks == [ar for ar in game._actors if type(ar) is Rock]
+
+    game = setup_map("student_map10.txt")
+    meepo = game.player
+    for _ in range(3):
+        game.play_move(0, -1)
+    assert game.player is None
+    assert game._board.get_type(Meepo) == []
+    game._undo()
+    game._update()
+    assert game._board.get_type(Meepo) == [meepo]
+    assert game.player is meepo
+
+
+def test_38_flyweight_actors(monkeypatch):
+    """Checks to see that actors are slotted, share their sprites, and are
+    copied field by field without calling their constructors"""
+    game = setup_map("student_map11.txt")
+    for ar in game.get_actors():
+        assert not hasattr(ar, "__dict__")
+    walls = [Wall(1, 2), Wall(3, 4)]
+    assert walls[0].sprite is walls[1].sprite is Wall.sprite
+    assert Subject(0, 0, "Rock").sprite is Subject(1, 1, "Rock").sprite
+
+    game.player.turn(-1, 0)
+    game.player.set_win()
+    block = game._is[0]
+    monkeypatch.setattr(Meepo, "__init__", None)
+    monkeypatch.setattr(Is, "__init__", None)
+    meepo, is_copy = game.player.copy(), block.copy()
+    assert type(meepo) is Meepo and meepo is not game.player
+    assert (meepo.x, meepo.y, meepo.sprite, meepo.flip_x, meepo.count) == \
+        (game.player.x, game.player.y, game.player.sprite,
+         game.player.flip_x, game.player.count)
+    assert meepo.get_flags() == game.player.get_flags()
+    assert (is_copy.word, is_copy.colour, is_copy.sprite) == \
+        (block.word, block.colour, block.sprite)
+
+
+def test_39_atlas(tmp_path):
+    """Checks to see that the atlas holds every tile, that tiles are taken
+    from it, that clearing the cache drops the atlas and its index, and that
+    an atlas for another tile size is ignored"""
+    import manifest
+    import sprites
+    from sprites import load_image, clear_image_cache
+    index = sprites.read_atlas_index()
+    assert set(index) == set(manifest.SPRITES) - sprites.NOT_TILES
+    clear_image_cache()
+    image = load_image(WALL_SPRITE)
+    assert image.get_parent() is sprites._atlas
+    assert image.get_size() == (TILESIZE, TILESIZE)
+    assert load_image(WALL_SPRITE, 20, 20).get_parent() is None
+    clear_image_cache()
+    assert sprites._atlas is None and sprites._atlas_index is None
+
+    stale = tmp_path / "atlas.json"
+    stale.write_text('{"version": 1, "tile_size": 10, "sprites": {}}')
+    assert sprites.read_atlas_index(str(stale)) == {}
+    assert sprites.read_atlas_index(str(tmp_path / "missing.json")) == {}
+
+
+def test_40_history_graph(tmp_path):
+    """Checks to see that undone moves can be redone until a new move, that
+    any state visited can be jumped to, that moves played again are stored
+    once, and that redos replay"""
+    import replay
+    import solver
+    from state import CompactState
+    path = "maps/student_map11.txt"
+    game = solver.load_game(path)
+    game.recorder = replay.Recorder(path, interval=3)
+    states = [CompactState.from_game(game)]
+    for move in [(1, 0), (0, -1), None, None, REDO, REDO, REDO]:
+        game._inputs.append(move)
+        game._tick()
+        states.append(CompactState.from_game(game))
+    assert states[4] == states[0] and states[3] == states[5] == states[1]
+    assert states[6] == states[7] == states[2]
+    top = game._history.state(game)
+
+    game._undo()
+    game.step(0, 1)
+    assert not game._history.can_redo()
+    game._history.jump(game, top)
+    game._update()
+    assert CompactState.from_game(game) == states[2]
+
+    history = game._history
+    moves = history.stats()["moves"]
+    for _ in range(10):
+        game.step(-1, 0)
+        game.step(1, 0)
+    history.state(game)
+    assert history.stats()["moves"] == moves + 2
+    assert history.saved > 0
+
+    game.recorder.finish(game).save(str(tmp_path / "session.txt"))
+    recording = replay.Recording.load(str(tmp_path / "session.txt"))
+    assert replay.encode(recording.inputs) == "RUZ2Y3"
+    assert replay.verify(recording)
+    for i, state in enumerate(states):
+        assert CompactState.from_game(replay.seek(recording, i)) == state
+
+
+def test_41_spilled_history(tmp_path):
+    """Checks to see that only the last undo steps stay in memory, and that
+    undo reads older ones back from the spill file"""
+    from history import Journal
+    from state import CompactState
+    game = setup_map("student_map11.txt")
+    game.reset_history(Journal(keyframe_interval=3, ram_steps=2,
+                               segment_steps=2, spill_dir=str(tmp_path)))
+    states = [CompactState.from_game(game)]
+    for move in [(0, 1), (1, 0), (1, 0), (0, -1), (-1, 0), (0, -1), (1, 0)]:
+        assert game.step(*move)
+        states.append(CompactState.from_game(game))
+    assert len(game._history) == 7
+    assert len(game._history._deltas) <= 4
+    assert game._history.stats()["spilled"] >= 3
+    assert game._history.stats()["disk_bytes"] > 0
+    spilled = game._history
+    while not game._history.is_empty():
+        game._undo()
+        game._update()
+        assert CompactState.from_game(game) == states[len(game._history)]
+    assert game._history.stats()["disk_bytes"] == 0
+    game.reset_history()
+    assert spilled._spill._file is None and game._history is not spilled
+
+
+def test_42_redo_after_loss(tmp_path):
+    """Checks to see that a losing move made after undoing every move drops
+    the moves undone, so that redo does nothing instead of failing"""
+    import solver
+    path = tmp_path / "map.txt"
+    path.write_text("1111111\n1MIY..1\n1FIL..1\n1.25..1\n1111111\n")
+    game = solver.load_game(str(path))
+    for move in [(-1, 0), None, (1, 0)]:
+        game._inputs.append(move)
+        game._tick()
+    assert game.player is None
+    assert not game._history.can_redo(game)
+    game._inputs.append(REDO)
+    game._tick()
+    assert game.player is None
+
+
 if __name__ == "__main__":
     import pytest
 
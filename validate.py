@@ -0,0 +1,155 @@
+"""
+Checks in parallel that the maps matching a glob pattern are well formed and
+can be won, e.g. python validate.py "maps/*.txt".
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import solver
+from settings import ATTRIBUTES, CHARACTERS, SOLVER_MAX_NODES, SUBJECTS
+
+# Every glyph a map may contain: empty cells, characters, words and Is
+GLYPHS = set(".I") | set(CHARACTERS) | set(SUBJECTS) | set(ATTRIBUTES)
+
+# How long the solver may search each map by default, in seconds
+MAX_SECONDS = 10
+
+# The status of a map whose search ran out of time, nodes or memory
+TIMEOUT = "timeout"
+
+# The status of a map that is not well formed or has no player
+INVALID = "invalid"
+
+
+def check_map(path: str) -> List[str]:
+    """
+    Return the problems of the map file at <path>: unreadable file, rows of
+    different lengths, unknown glyphs, or no "Is You" rule at the start so
+    nothing can ever move. An empty list means the map is well formed.
+    """
+    try:
+        with open(path, 'rt', encoding='utf-8', errors='replace') as f:
+            lines = [line.strip() for line in f]
+    except OSError as e:
+        return ["cannot be read: {}".format(e)]
+    while lines and lines[-1] == "":
+        lines.pop()
+    if not lines:
+        return ["is empty"]
+
+    problems = []
+    widths = {len(line) for line in lines}
+    if len(widths) > 1:
+        problems.append("rows have different lengths ({})".format(
+            ", ".join(str(w) for w in sorted(widths))))
+    unknown = sorted({c for line in lines for c in line} - GLYPHS)
+    if unknown:
+        problems.append("unknown glyphs {}".format(" ".join(
+            repr(c) for c in unknown)))
+    if problems:
+        return problems
+
+    game = solver.load_game(path)
+    if game.player is None:
+        problems.append("no Is You rule at the start")
+    return problems
+
+
+def validate_map(path: str, max_seconds: float = MAX_SECONDS,
+                 max_nodes: int = SOLVER_MAX_NODES) -> Dict[str, Any]:
+    """
+    Return the result of checking the map at <path> and, if it is valid,
+    searching it for a win for up to <max_seconds> and <max_nodes> states.
+    """
+    start = time.perf_counter()
+    result = {"map": path, "status": INVALID, "moves": None,
+              "solution": None, "expanded": 0, "stored": 0, "seconds": 0.0,
+              "problems": check_map(path)}
+    if not result["problems"]:
+        res = solver.solve(path, max_nodes=max_nodes, max_seconds=max_seconds)
+        result.update(status=TIMEOUT if res.status == "limit"
+                      else res.status, solution=res.solution,
+                      moves=None if res.solution is None
+                      else len(res.solution),
+                      expanded=res.expanded, stored=res.stored)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def validate(paths: List[str], max_seconds: float = MAX_SECONDS,
+             max_nodes: int = SOLVER_MAX_NODES,
+             jobs: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Return the results of validate_map for each of <paths>, in order, running
+    up to <jobs> maps at once in worker processes (one per core if None).
+    """
+    if jobs == 1 or len(paths) <= 1:
+        return [validate_map(path, max_seconds, max_nodes) for path in paths]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(validate_map, paths,
+                             [max_seconds] * len(paths),
+                             [max_nodes] * len(paths)))
+
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    """
+    Return <results> as a table, followed by the count of each status.
+    """
+    width = max([len("map")] + [len(r["map"]) for r in results])
+    row = "{:<" + str(width) + "}  {:<10} {:>5} {:>10} {:>10} {:>8}  {}"
+    lines = [row.format("map", "status", "moves", "expanded", "stored",
+                        "seconds", "notes")]
+    for r in results:
+        notes = "; ".join(r["problems"]) or (r["solution"] or "")
+        lines.append(row.format(
+            r["map"], r["status"], "-" if r["moves"] is None else r["moves"],
+            r["expanded"], r["stored"], "{:.2f}".format(r["seconds"]),
+            notes))
+    counts: Dict[str, int] = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    lines.append("")
+    lines.append(", ".join("{} {}".format(n, status)
+                           for status, n in sorted(counts.items())))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Validate the maps matching the patterns given on the command line and
+    print the table. Returns 1 if a map is invalid (or, with
+    --require-solved, not solved), otherwise 0.
+    """
+    parser = argparse.ArgumentParser(
+        description="Check and solve every map matching a pattern.")
+    parser.add_argument("patterns", nargs="+",
+                        help="glob patterns of map files, e.g. 'maps/*.txt'")
+    parser.add_argument("--max-seconds", type=float, default=MAX_SECONDS,
+                        help="time budget of the search of each map")
+    parser.add_argument("--max-nodes", type=int, default=SOLVER_MAX_NODES,
+                        help="stop the search of a map after this many states")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="number of maps checked at once")
+    parser.add_argument("--require-solved", action="store_true",
+                        help="fail unless every map is solved")
+    args = parser.parse_args(argv)
+
+    paths = sorted({path for pattern in args.patterns
+                    for path in glob.glob(pattern)})
+    if not paths:
+        print("no maps match {}".format(" ".join(args.patterns)))
+        return 1
+    results = validate(paths, args.max_seconds, args.max_nodes, args.jobs)
+    print(format_results(results))
+    ok = ["solved"] if args.require_solved \
+        else ["solved", "unsolvable", TIMEOUT]
+    return 0 if all(r["status"] in ok for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
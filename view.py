@@ -0,0 +1,181 @@
+"""
+The pygame window that shows a Game.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+
+import pygame
+
+import sprites
+from camera import Camera
+from settings import *
+
+
+class View:
+    """
+    The pygame window showing the part of a game's map seen by its camera,
+    with the actors that cannot move drawn once into chunks.
+
+    === Public Attributes ===
+    screen:
+        the surface of the window
+    background:
+        the image drawn behind the actors
+    camera:
+        the part of the map shown in the window
+
+    === Private Attributes ===
+    _chunks:
+        maps (column, row) of a chunk to the background with the static
+        actors of the chunk drawn on it, least recently used first
+    _static:
+        the types of the actors drawn in _chunks, or None before any is built
+    """
+    screen: pygame.Surface
+    background: pygame.Surface
+    camera: Camera
+    _chunks: Dict[Tuple[int, int], pygame.Surface]
+    _static: Optional[FrozenSet[type]]
+
+    def __init__(self, game_: Any) -> None:
+        """
+        Open a window on the map of <game_>, as large as the map or as
+        VIEWPORT_TILES if the map is larger, centred on the player.
+        """
+        self.camera = Camera(game_.x_tiles, game_.y_tiles)
+        if game_.player:
+            self.camera.centre(game_.player.x, game_.player.y)
+        self.screen = pygame.display.set_mode(
+            (self.camera.width * TILESIZE, self.camera.height * TILESIZE))
+        self.background = pygame.image.load(
+            "{}/backgroundBig.png".format(SPRITES_DIR)).convert_alpha()
+        # Images loaded before the window was opened were not converted to
+        # its pixel format, so load them again
+        sprites.clear_image_cache()
+        self._chunks = OrderedDict()
+        self._static = None
+
+    def draw(self, game_: Any) -> None:
+        """
+        Draws the screen, grid, and objects/players on the screen.
+
+        Only the cells in view that changed since the last frame are drawn
+        again and sent to the display; nothing is done if no cell changed.
+        The whole window is drawn again when the camera scrolls, and the
+        chunks are built again when the static actors may have changed.
+        """
+        redraw_all, cells = game_.take_redraw()
+        static = game_.static_types()
+        if redraw_all or static != self._static:
+            self._chunks.clear()
+            self._static = static
+            redraw_all = True
+        if game_.player and self.camera.follow(game_.player.x,
+                                               game_.player.y):
+            redraw_all = True
+        if redraw_all:
+            self._draw_view(game_)
+            pygame.display.flip()
+            return
+
+        rects = [self._draw_cell(game_, x, y) for x, y in cells
+                 if self.camera.visible(x, y)]
+        if rects:
+            pygame.display.update(rects)
+
+    def _draw_view(self, game_: Any) -> None:
+        """
+        Draw every cell in view: the chunks under them, then the cells
+        holding an actor that can move.
+        """
+        camera = self.camera
+        for cy in range(camera.y // CHUNK_TILES,
+                        (camera.y + camera.height - 1) // CHUNK_TILES + 1):
+            for cx in range(camera.x // CHUNK_TILES,
+                            (camera.x + camera.width - 1) // CHUNK_TILES + 1):
+                self.screen.blit(self._chunk(game_, cx, cy), self._to_screen(
+                    cx * CHUNK_TILES, cy * CHUNK_TILES))
+        for x, y in camera.cells():
+            if any(type(ar) not in self._static
+                   for ar in game_.get_actors_at(x, y)):
+                self._draw_cell(game_, x, y)
+
+    def _chunk(self, game_: Any, cx: int, cy: int) -> pygame.Surface:
+        """
+        Return the chunk (cx, cy) of <game_>: the background with the static
+        actors of its cells drawn on it, building it if it is not cached.
+        """
+        key = (cx, cy)
+        if key in self._chunks:
+            self._chunks.move_to_end(key)
+            return self._chunks[key]
+
+        size = CHUNK_TILES * TILESIZE
+        chunk = pygame.Surface((size, size)).convert()
+        offset_x, offset_y = self._background_offset(game_)
+        chunk.blit(self.background, (offset_x - cx * size,
+                                     offset_y - cy * size))
+        # The tiles come from one atlas surface (see sprites.py), so they are
+        # drawn in one batch
+        left, top = cx * CHUNK_TILES, cy * CHUNK_TILES
+        tiles = []
+        for y in range(top, min(top + CHUNK_TILES, game_.y_tiles)):
+            for x in range(left, min(left + CHUNK_TILES, game_.x_tiles)):
+                for actor_ in game_.get_actors_at(x, y):
+                    if type(actor_) in self._static:
+                        tiles.append((actor_.image, ((x - left) * TILESIZE,
+                                                     (y - top) * TILESIZE)))
+        chunk.blits(tiles, doreturn=False)
+
+        self._chunks[key] = chunk
+        while len(self._chunks) > CHUNK_CACHE_SIZE:
+            self._chunks.popitem(last=False)
+        return chunk
+
+    def _draw_cell(self, game_: Any, x: int, y: int) -> pygame.Rect:
+        """
+        Draw the cell (x, y) of <game_> on the screen and return its area.
+
+        The actors are drawn in the order of the list of actors, then the
+        player on top of them. The chunk is used under the cell unless a
+        static actor there must be drawn over an actor that can move.
+        """
+        rect = pygame.Rect(self._to_screen(x, y), (TILESIZE, TILESIZE))
+        actors = game_.get_actors_at(x, y)
+        first = 0
+        while first < len(actors) and type(actors[first]) in self._static:
+            first += 1
+        if any(type(ar) in self._static for ar in actors[first:]):
+            # Cells beyond the background are black, as in the chunks
+            offset_x, offset_y = self._background_offset(game_)
+            self.screen.fill(BLACK, rect)
+            self.screen.blit(self.background, rect, rect.move(
+                self.camera.x * TILESIZE - offset_x,
+                self.camera.y * TILESIZE - offset_y))
+            first = 0
+        else:
+            cx, cy = x // CHUNK_TILES, y // CHUNK_TILES
+            self.screen.blit(self._chunk(game_, cx, cy), rect, pygame.Rect(
+                (x - cx * CHUNK_TILES) * TILESIZE,
+                (y - cy * CHUNK_TILES) * TILESIZE, TILESIZE, TILESIZE))
+        for actor_ in actors[first:]:
+            self.screen.blit(actor_.image, rect)
+        if game_.player and (game_.player.x, game_.player.y) == (x, y):
+            self.screen.blit(game_.player.image, rect)
+        return rect
+
+    def _to_screen(self, x: int, y: int) -> Tuple[int, int]:
+        """
+        Return where the cell (x, y) of the map is drawn in the window.
+        """
+        return ((x - self.camera.x) * TILESIZE,
+                (y - self.camera.y) * TILESIZE)
+
+    @staticmethod
+    def _background_offset(game_: Any) -> Tuple[int, int]:
+        """
+        Return where the background is drawn on the map of <game_> so that
+        it is centered on it.
+        """
+        return (int((0.5 * game_.width) - (0.5 * 1920)),
+                int((0.5 * game_.height) - (0.5 * 1080)))